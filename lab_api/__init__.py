@@ -1,19 +1,49 @@
-from time import sleep
-from typing import Callable
-from fastapi import Path
+import json
+from asyncio import gather, run, to_thread
+from functools import lru_cache
+from hashlib import sha256
+from typing import TYPE_CHECKING, Callable, List
+from fastapi import Header, Path, Query
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from rq import Queue
 from rq.job import Job
 from rq.exceptions import NoSuchJobError
-from .ise import ISE
-from .device import DeviceLab
-from .services import DNAC, vManage, Appliance
+from rq.utils import parse_timeout
+from .jobs import (
+    JOB_PERCENT_KEY,
+    JOB_PROGRESS_KEY,
+    JobProgress,
+    JobWaiters,
+    async_wait_for_job,
+    enqueue_once,
+    format_sse,
+    job_events,
+)
+from .cache import (
+    bump_appliance_generation,
+    claim_refresh,
+    invalidate_status,
+    load_status,
+    status_cache_meta,
+)
+from .orchestrator import PlanNode, orchestration_status, start_orchestration
 from .config import (
     app,
     REDIS_CONN,
+    ASYNC_REDIS_CONN,
     logger,
     DEFAULT_Q,
-    NETDEVICE_TESTBED,
+    STATUS_Q,
+    RESET_Q,
+    BACKUP_Q,
     APPLIANCES,
+    INVENTORY,
+    get_netdevice_testbed,
+    get_device_pool,
     HTTPException,
+    STATUS_FRESH_TTL,
+    STATUS_STALE_TTL,
 )
 from .models import (
     ISEModel,
@@ -29,10 +59,23 @@ from .models import (
     vManageModel,
     BaseModel,
     MultiJobResponse,
+    JobsRequest,
+    OrchestrationNode,
+    OrchestrationResponse,
+    OrchestrationStatus,
 )
 
+# pyATS, paramiko and the appliance SDKs take seconds and hundreds of MB to
+# import, they are imported by the tasks that use them so the API doesn't
+if TYPE_CHECKING:
+    from .appliance import ApplianceAPI
+    from .services import Appliance
+
+
+def get_appliance_obj(name: str) -> "Appliance":
+    from .ise import ISE
+    from .services import DNAC, vManage
 
-def get_appliance_obj(name: str) -> Appliance:
     name.lower()
     params = APPLIANCES.get(name)
     args = [
@@ -51,49 +94,118 @@ def get_appliance_obj(name: str) -> Appliance:
     return obj
 
 
+# Appliance shells kept logged in between status jobs by a non-forking worker
+@lru_cache(maxsize=None)
+def get_appliance_pool():
+    from .services import ApplianceSessionPool
+
+    return ApplianceSessionPool(get_appliance_obj, connection=REDIS_CONN)
+
+
+def reset_appliance_sessions(name: str) -> None:
+    """Drop the sessions to an appliance held by this and every other worker"""
+    get_appliance_pool().drop(name)
+    # Other workers see the new generation on their next session checkout
+    bump_appliance_generation(REDIS_CONN, name)
+
+
+def get_appliance_api(name: str) -> "ApplianceAPI":
+    """Build the REST API client of an appliance"""
+    from .dnac import DNAC
+    from .ise import ISE
+    from .sdwan import vManage
+
+    params = APPLIANCES[name]
+    args = [params["host"], params["username"], params["password"]]
+    match name:
+        case "dnac":
+            obj = DNAC(*args)
+        case "ise":
+            obj = ISE(*args, params["version"])
+        case "vmanage":
+            obj = vManage(*args)
+    return obj
+
+
+# Appliance API clients kept logged in and shared by the jobs of a worker
+@lru_cache(maxsize=None)
+def get_appliance_registry():
+    from .appliance import ApplianceRegistry
+
+    return ApplianceRegistry(get_appliance_api)
+
+
 # LAB TASKS
 
 
 def task_get_dnac_status() -> DNACModel:
-    dnac = get_appliance_obj("dnac")
-    dnac.connect()
-    resp = dnac.get_status()
-    dnac.disconnect()
+    resp = get_appliance_registry().get("dnac").get_status()
     return DNACModel(**resp)
 
 
 def task_get_vmanage_status() -> vManageModel:
-    vmanage = get_appliance_obj("vmanage")
-    vmanage.connect()
-    resp = vmanage.get_status()
-    vmanage.disconnect()
+    with get_appliance_pool().session("vmanage") as vmanage:
+        resp = vmanage.get_status()
     return vManageModel(**resp)
 
 
 def task_get_ise_status() -> ISEModel:
-    host = APPLIANCES["ise"]["host"]
-    username = APPLIANCES["ise"]["username"]
-    password = APPLIANCES["ise"]["password"]
-    version = APPLIANCES["ise"]["version"]
-    ise = ISE(
-        host,
-        username,
-        password,
-        version,
-    )
+    ise = get_appliance_registry().get("ise")
     resp = ise.get_status()
     return ISEModel(**resp)
 
 
+# Appliance models by name, for collected statuses
+APPLIANCE_MODELS = {"dnac": DNACModel, "ise": ISEModel, "vmanage": vManageModel}
+
+
+def task_get_appliance_status_all() -> LabStatus:
+    """Get the status of every appliance at once
+
+    DNAC and ISE are asked over their REST APIs, vManage has no REST API
+    for its restore history and is asked over SSH in a thread. Each has
+    its status_deadline in the appliance data, or STATUS_DEADLINE seconds.
+    """
+    from .collector import STATUS_DEADLINE, collect_status
+
+    registry = get_appliance_registry()
+
+    async def vmanage_status(session):
+        return await to_thread(task_get_vmanage_status)
+
+    checks = {
+        "dnac": registry.get("dnac").get_status_async,
+        "ise": registry.get("ise").get_status_async,
+        "vmanage": vmanage_status,
+    }
+    deadlines = {
+        name: APPLIANCES[name].get("status_deadline", STATUS_DEADLINE)
+        for name in checks
+    }
+    results = run(collect_status(checks, deadlines))
+    lab_status = LabStatus()
+    for name, result in results.items():
+        model = APPLIANCE_MODELS[name]
+        if isinstance(result, BaseModel):
+            setattr(lab_status, name, result)
+        elif isinstance(result, Exception):
+            logger.info(f"Status of {name} failed: {result!r}")
+            host = APPLIANCES[name].get("host")
+            setattr(lab_status, name, model(host=host, status=str(result)))
+        else:
+            setattr(lab_status, name, model(**result))
+    return lab_status
+
+
 def task_get_network_device_status(name: str) -> NetworkDevice:
     """Get network device status"""
-    device_lab = DeviceLab(NETDEVICE_TESTBED)
+    from .device import DeviceLab
+
+    device_lab = DeviceLab(get_netdevice_testbed(), cache=REDIS_CONN)
     selectedDevice = device_lab.devices.get(name)
     if selectedDevice:
-        logger.info(f"Connecting to: {selectedDevice.name}")
-        selectedDevice.connect()
-        status = device_lab.get_status(selectedDevice)
-        selectedDevice.disconnect()
+        with get_device_pool().connection(selectedDevice):
+            status = device_lab.get_status(selectedDevice)
         result = NetworkDevice(
             name=selectedDevice.name,
             status=status,
@@ -106,86 +218,105 @@ def task_get_network_device_status(name: str) -> NetworkDevice:
 
 
 def net_device_model_packing(device):
+    # A device that failed in a *_all run may not have every attribute set
     return NetworkDevice(
         name=device.name,
-        status=device.status,
+        status=getattr(device, "status", None),
         host=str(device.connections.ssh.ip),
-        default_cfg_on_flash=device.default_config_exists,
+        default_cfg_on_flash=getattr(device, "default_config_exists", None),
+        error=getattr(device, "error", None),
     )
 
 
 def task_get_network_device_status_all() -> list[NetworkDevice]:
     """Get all network devices status"""
+    from .device import DeviceLab
+
     devices = []
-    device_lab = DeviceLab(NETDEVICE_TESTBED)
-    device_lab.connect_all()
-    device_lab.get_status_all()
+    device_lab = DeviceLab(get_netdevice_testbed(), cache=REDIS_CONN)
+    with get_device_pool().connections(device_lab):
+        device_lab.get_status_all()
     devices = [net_device_model_packing(device) for device in device_lab]
     logger.debug(devices)
-    device_lab.disconnect_all()
     return devices
 
 
-def task_reset_network_device_all():
-    device_lab = DeviceLab(NETDEVICE_TESTBED)
-    device_lab.connect_all()
-    device_lab.reset_device_to_default_all()
-    device_lab.disconnect_all()
-    return True
+def net_device_reset_model_packing(device):
+    return NetworkDevice(
+        name=device.name,
+        reset=getattr(device, "reset", None),
+        reset_strategy=getattr(device, "reset_strategy", None),
+        reset_time=getattr(device, "reset_time", None),
+        error=getattr(device, "error", None),
+    )
 
 
-def task_reset_network_device(name: str) -> bool:
+def task_reset_network_device_all(max_workers: int = None) -> list[NetworkDevice]:
+    from .device import DeviceLab
+
+    device_lab = DeviceLab(
+        get_netdevice_testbed(), max_workers=max_workers, cache=REDIS_CONN
+    )
+    with get_device_pool().connections(device_lab):
+        device_lab.reset_device_to_default_all()
+    return [net_device_reset_model_packing(device) for device in device_lab]
+
+
+def task_reset_network_device(name: str) -> NetworkDevice:
+    from .device import DeviceLab
+
     logger.info("Resetting a network device.")
-    device_lab = DeviceLab(NETDEVICE_TESTBED)
+    device_lab = DeviceLab(get_netdevice_testbed(), cache=REDIS_CONN)
     logger.info("Device lab init.")
     logger.info(f"Searching for network device {name}")
     device = device_lab.devices.get(name)
     if device:
         logger.info(f"Found network device: {device.name}")
-        logger.info(f"Connecting to: {device.name}")
-        device.connect()
-        reset_resp = device_lab.reset(device)
-        device.disconnect()
+        device.error = None
+        with get_device_pool().connection(device):
+            device_lab.reset(device)
+        reset_resp = net_device_reset_model_packing(device)
     else:
         logger.info(f"Found no network device: {name}")
         logger.info("No reset.")
-        reset_resp = False
+        reset_resp = NetworkDevice(name=name, reset=False, error="Device not found.")
     return reset_resp
 
 
 def task_reset_dnac():
     id = APPLIANCES["dnac"]["backup_id"]
+    # The restore takes over the shell and restarts services, pooled
+    # sessions are reopened after it. Logins to the REST API are redone
+    # when DNAC rejects them, see ApplianceAPI.call.
+    reset_appliance_sessions("dnac")
     dnac = get_appliance_obj("dnac")
     dnac.connect()
-    resp = dnac.reset(id)
+    resp = dnac.reset(id, progress=JobProgress())
     dnac.disconnect()
+    reset_appliance_sessions("dnac")
     return resp
 
 
 def task_reset_vmanage() -> str:
     backup_path = APPLIANCES["vmanage"]["backup_path"]
+    # The restore takes over the shell and restarts services, pooled
+    # sessions are reopened after it. Logins to the REST API are redone
+    # when vManage rejects them, see ApplianceAPI.call.
+    reset_appliance_sessions("vmanage")
     vmanage = get_appliance_obj("vmanage")
     vmanage.connect()
-    resp = vmanage.reset(backup_path)
+    resp = vmanage.reset(backup_path, progress=JobProgress())
     vmanage.disconnect()
+    reset_appliance_sessions("vmanage")
     return resp
 
 
 def task_reset_ise() -> tuple:
-    host = APPLIANCES["ise"]["host"]
-    username = APPLIANCES["ise"]["username"]
-    password = APPLIANCES["ise"]["password"]
-    version = APPLIANCES["ise"]["version"]
     file = APPLIANCES["ise"]["backup_file"]
     repo = APPLIANCES["ise"]["backup_repo"]
     key = APPLIANCES["ise"]["backup_key"]
     # repo_pass = APPLIANCES["ise"]["backup_repo_pass"]
-    ise = ISE(
-        host,
-        username,
-        password,
-        version,
-    )
+    ise = get_appliance_registry().get("ise")
     # Make sure the password to the repo is set correctly
     # It becomes unset after a restore
     # update, msg = ise.update_repo_pass(repo, repo_pass)
@@ -195,15 +326,61 @@ def task_reset_ise() -> tuple:
     return resp
 
 
+# Job IDs of the cached statuses each reset makes out of date
+RESET_STATUS_IDS = {
+    "task_reset_dnac": ("dnac_status", "appliances_status"),
+    "task_reset_ise": ("ise_status", "appliances_status"),
+    "task_reset_vmanage": ("vmanage_status", "appliances_status"),
+    "task_reset_network_device_all": (
+        "netdevices_status",
+        *[f"{device['name']}_status" for device in INVENTORY["network_devices"]],
+    ),
+}
+
+
+def reset_status_ids(task_name: str, args: tuple = None) -> list:
+    """Job IDs of the cached statuses a reset task makes out of date"""
+    if task_name == "task_reset_network_device":
+        return [f"{args[0]}_status", "netdevices_status"]
+    return [*RESET_STATUS_IDS.get(task_name, ())]
+
+
+def invalidate_reset_status(connection, task_name: str, args: tuple = None) -> None:
+    """Drop the cached statuses of what a reset task resets
+
+    Called when the reset is queued, so status requests stop being served
+    the state from before it, and by the worker when it ends.
+    """
+    ids = reset_status_ids(task_name, args)
+    if ids:
+        invalidate_status(connection, ids)
+
+
+# Order of a whole lab reset. Network devices are reset after DNAC is
+# restored, the other appliances restore in parallel.
+# Expected seconds are a first guess until durations are recorded.
+RESET_PLAN = {
+    "ise": PlanNode(task_reset_ise, "reset_ise", expected=3000),
+    "dnac": PlanNode(task_reset_dnac, "reset_dnac", expected=2400),
+    "vmanage": PlanNode(task_reset_vmanage, "reset_vmanage", expected=2400),
+    "netdevices": PlanNode(
+        task_reset_network_device_all,
+        "reset_netdevices",
+        depends_on=("dnac",),
+        expected=900,
+    ),
+}
+
+
 def task_backup_network_device(name: str, cust_id: str) -> bool:
+    from .device import DeviceLab
+
     logger.info(f"Backing up configuration on {name}")
-    device_lab = DeviceLab(NETDEVICE_TESTBED)
+    device_lab = DeviceLab(get_netdevice_testbed(), cache=REDIS_CONN)
     device = device_lab.devices.get(name)
     if device:
-        logger.info(f"Connecting to: {device.name}")
-        device.connect()
-        backup_status = device_lab.backup(device, cust_id)
-        device.disconnect()
+        with get_device_pool().connection(device):
+            backup_status = device_lab.backup(device, cust_id)
         result = NetworkDevice(
             name=device.name,
             backup=backup_status,
@@ -220,70 +397,110 @@ def task_backup_network_device(name: str, cust_id: str) -> bool:
 # Using ame job_id = get cached results when available
 # Use consistent job_id for each task to use the queue as a cache and protect
 # the services (lab appliance being automated) from being overrun by jobs.
+# Dispatchers are async so waiting requests don't hold threadpool threads.
+# Quick blocking Redis calls (fetch, enqueue) run in the threadpool, the
+# long wait for the job to end runs on the asyncio Redis client.
 
 # Run job and wait for results
 # Useful for short running jobs, e.g. get_status tasks
 # Why use for short jobs? Cache and protect device being automated
 # Timeout is how long to run the job
 # TTL is how long to cache the results
-def rq_dispatcher_run(
+async def rq_dispatcher_run(
     task: Callable,
     id: str = None,
     args: tuple = None,
     timeout: str = "10m",
     ttl: int = 30,
     cache: bool = True,
+    meta: dict = None,
 ) -> BaseModel:
     logger.info(f"Running job to completion: {task}")
+    id = id or rq_job_id(task, args)
     if not cache:
         logger.info("Not using cached job result.")
-        job = DEFAULT_Q.enqueue(
-            task, job_id=id, args=args, result_ttl=ttl, job_timeout=timeout
-        )
-        job = rq_job_wait(job)
-    else:
-        try:
-            logger.info("Looking up cached job result.")
-            job = Job.fetch(id, connection=REDIS_CONN)
-            if not job.result:
-                raise NoSuchJobError
-        except NoSuchJobError as e:
-            logger.info("No cached job result.")
-            logger.debug(e)
-            job = DEFAULT_Q.enqueue(
-                task, job_id=id, args=args, result_ttl=ttl, job_timeout=timeout
-            )
-            job = rq_job_wait(job)
+    job = await run_in_threadpool(
+        enqueue_once,
+        rq_queue(task),
+        task,
+        id,
+        reuse_finished=cache,
+        args=args,
+        result_ttl=ttl,
+        job_timeout=timeout,
+        meta=meta,
+    )
+    job = await rq_job_wait(job)
     logger.debug(job)
-    logger.info(f"Job status: {job.get_status()}.")
+    logger.info(f"Job status: {job.get_status(refresh=False)}.")
+    rq_job_check(job)
     logger.info(job.result)
     return job.result
 
 
+# Same task and args = same job ID, so identical requests share one job
+# Queue of each kind of task by name prefix, other tasks go on DEFAULT_Q
+TASK_QUEUES = {
+    "task_get_": STATUS_Q,
+    "task_reset_": RESET_Q,
+    "task_backup_": BACKUP_Q,
+}
+
+
+def rq_queue(task: Callable) -> Queue:
+    """Queue a task is routed to, so short status jobs never wait on resets"""
+    for prefix, queue in TASK_QUEUES.items():
+        if task.__name__.startswith(prefix):
+            return queue
+    return DEFAULT_Q
+
+
+def rq_job_id(task: Callable, args: tuple = None) -> str:
+    return ":".join([task.__name__, *[str(arg) for arg in args or ()]])
+
+
+# Waiting requests share one subscription to the job channels
+JOB_WAITERS = JobWaiters(ASYNC_REDIS_CONN)
+
+
 # Wait around until job is done
-def rq_job_wait(job: Job, wait: int = 2) -> Job:
-    while not job.result:
-        logger.info(f"Waiting on job {job.id} to finish...")
-        sleep(wait)
+# The worker publishes when a job ends, so this wakes as soon as it does
+async def rq_job_wait(job: Job, timeout: int = None) -> Job:
+    await async_wait_for_job(job.id, JOB_WAITERS, timeout=timeout)
+    try:
+        # Load the final status and result
+        await run_in_threadpool(job.refresh)
+    except NoSuchJobError:
+        raise HTTPException(status_code=502, detail=f"Job {job.id} expired.")
     return job
 
 
-def rq_job_wait_multi(jobs: list, wait: int = 2) -> None:
-    run = True
-    while run is True:
-        sleep(wait)
-        i = 0
-        for job in jobs:
-            if job.result:
-                i += 1
-            if i == len(jobs):
-                run = False
-                break
+# Surface failed jobs to the caller instead of returning an empty result
+def rq_job_check(job: Job) -> None:
+    status = job.get_status(refresh=False)
+    if status != "finished":
+        logger.info(f"Job {job.id} did not finish: {status}.")
+        raise HTTPException(
+            status_code=502, detail=f"Job {job.id} did not finish: {status}."
+        )
 
 
 # Queue job and return job ID for checking status later
 # Useful for long running jobs, e.g. reset tasks
-def rq_dispatcher_enq(
+async def rq_dispatcher_enq(
+    task: Callable,
+    id: str = None,
+    args: tuple = None,
+    timeout: str = "1h",
+    ttl: int = 600,
+    cache: bool = True,
+) -> JobResponse:
+    return await run_in_threadpool(
+        rq_dispatcher_enq_sync, task, id, args, timeout, ttl, cache
+    )
+
+
+def rq_dispatcher_enq_sync(
     task: Callable,
     id: str = None,
     args: tuple = None,
@@ -292,123 +509,161 @@ def rq_dispatcher_enq(
     cache: bool = True,
 ) -> JobResponse:
     logger.info(f"Queuing job: {task}")
+    id = id or rq_job_id(task, args)
     if not cache:
         logger.info("Not using cached job result.")
-        job = DEFAULT_Q.enqueue(
-            task, job_id=id, args=args, result_ttl=ttl, job_timeout=timeout
+    job = enqueue_once(
+        rq_queue(task),
+        task,
+        id,
+        reuse_finished=cache,
+        args=args,
+        result_ttl=ttl,
+        job_timeout=timeout,
+    )
+    invalidate_reset_status(REDIS_CONN, task.__name__, args)
+    if job.result:
+        job_status = JobStatus(
+            id=job.id,
+            status=job.get_status(),
+            result=str(job.result),
+            # disposition=job.result[1],
         )
     else:
-        try:
-            logger.info("Looking up cached job result.")
-            job = Job.fetch(id, connection=REDIS_CONN)
-        except NoSuchJobError as e:
-            logger.info("No cached job result.")
-            logger.debug(e)
-            job = DEFAULT_Q.enqueue(
-                task, job_id=id, args=args, result_ttl=ttl, job_timeout=timeout
-            )
-        if job.result:
-            job_status = JobStatus(
-                id=job.id,
-                status=job.get_status(),
-                result=str(job.result),
-                # disposition=job.result[1],
-            )
-        else:
-            job_status = JobStatus(id=job.id, status=job.get_status())
+        job_status = JobStatus(id=job.id, status=job.get_status())
     logger.debug(job)
     logger.info(f"Job status: {job.get_status()}.")
     logger.info(job_status)
     return JobResponse(job=job_status)
 
 
-def rq_dispatcher_multi_enq(task_map):
-    job_ids = task_map.keys()
-    results = {}
-    # Check the queue and see if there are cached results
-    jobs = Job.fetch_many(job_ids, connection=REDIS_CONN)
-    # Stash the cached results
-    for job in jobs:
-        if job and job.get_status() == "finished":
-            results[job.id] = job.result
-    # Process jobs without results
-    if not len(job_ids) == len(results):
-        new_jobs = []
-        for id, func in task_map.items():
-            # We only want to run tasks we don't have results for
-            if id not in results.keys():
-                job = DEFAULT_Q.enqueue(func, job_id=id)
-                new_jobs.append(job)
-        rq_job_wait_multi(new_jobs)
-        results.update({job.id: job.result for job in new_jobs})
-    return results
+# Serve the last known status, refreshing it in the background when stale
+# Useful for status tasks where an old answer now beats a new one later
+# Fresh TTL is how long a status is served without a refresh
+# Stale TTL is how long a status may be served while it is refreshed
+# Returns the status and its age in seconds
+async def rq_dispatcher_cached(
+    task: Callable,
+    id: str = None,
+    args: tuple = None,
+    timeout: str = "10m",
+    fresh_ttl: int = STATUS_FRESH_TTL,
+    stale_ttl: int = STATUS_STALE_TTL,
+) -> tuple:
+    id = id or rq_job_id(task, args)
+    meta = status_cache_meta(stale_ttl)
+    cached = await load_status(ASYNC_REDIS_CONN, id)
+    if cached is None:
+        logger.info(f"No cached status for {id}.")
+        result = await rq_dispatcher_run(
+            task, id=id, args=args, timeout=timeout, meta=meta
+        )
+        return result, 0
+    age, result = cached
+    logger.info(f"Cached status for {id} is {int(age)}s old.")
+    if age > fresh_ttl and await claim_refresh(
+        ASYNC_REDIS_CONN, id, parse_timeout(timeout)
+    ):
+        logger.info(f"Refreshing status for {id} in the background.")
+        await run_in_threadpool(
+            enqueue_once,
+            rq_queue(task),
+            task,
+            id,
+            reuse_finished=False,
+            args=args,
+            job_timeout=timeout,
+            meta=meta,
+        )
+    return result, int(age)
+
+
+async def rq_dispatcher_cached_multi(task_map: dict) -> tuple:
+    # Look up all statuses at once, total wait is as long as the slowest miss
+    responses = await gather(
+        *[rq_dispatcher_cached(task, id=id) for id, task in task_map.items()]
+    )
+    results = {id: result for id, (result, _) in zip(task_map, responses)}
+    age = max(age for _, age in responses)
+    return results, age
+
+
+def list_response_body(inventory: dict) -> tuple:
+    """Encoded /v1/list response of an inventory and its ETag"""
+    resp = ListResponse(
+        appliances=[ListItem(**item) for item in inventory["appliances"]],
+        network_devices=[ListItem(**item) for item in inventory["network_devices"]],
+    )
+    body = resp.json().encode("utf-8")
+    return body, f'"{sha256(body).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an If-None-Match header matches an ETag, weakly as in RFC 7232"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag.removeprefix("W/") for tag in tags]
+
+
+# The inventory only changes when the API restarts, encode the list once
+LIST_BODY, LIST_ETAG = list_response_body(INVENTORY)
 
 
 # ROUTES
 @app.get("/v1/list", response_model=ListResponse)
-def list():
+async def list(if_none_match: str = Header(None)):
     """List all of the devices in the lab."""
-    appliance_items = []
-    for k, v in APPLIANCES.items():
-        item = ListItem(name=k, host=v.get("host"))
-        appliance_items.append(item)
-    device_items = []
-    for device in NETDEVICE_TESTBED:
-        item = ListItem(name=device.name, host=str(device.connections.ssh.ip))
-        device_items.append(item)
-    return ListResponse(appliances=appliance_items, network_devices=device_items)
+    # Let clients cache the list, but check it is current before each use
+    headers = {"ETag": LIST_ETAG, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, LIST_ETAG):
+        return Response(status_code=304, headers=headers)
+    return Response(LIST_BODY, media_type="application/json", headers=headers)
 
 
 @app.get("/v1/status", response_model=StatusResponse, response_model_exclude_unset=True)
-def status():
+async def status():
     # Common job id to task mapping
     task_map = {
         "netdevices_status": task_get_network_device_status_all,
-        "dnac_status": task_get_dnac_status,
-        "vmanage_status": task_get_vmanage_status,
-        "ise_status": task_get_ise_status,
+        "appliances_status": task_get_appliance_status_all,
     }
-    results = rq_dispatcher_multi_enq(task_map=task_map)
+    results, age = await rq_dispatcher_cached_multi(task_map=task_map)
     for dev_result in results["netdevices_status"]:
         dev_result.host= str(dev_result.host)
     logger.info("Results from status all: ", results)
-    lab_status = LabStatus()
+    lab_status = results["appliances_status"].copy()
     lab_status.devices = results["netdevices_status"]
-    lab_status.dnac = results["dnac_status"]
-    lab_status.vmanage = results["vmanage_status"]
-    lab_status.ise = results["ise_status"]
-    return StatusResponse(status=lab_status)
+    return StatusResponse(status=lab_status, age=age)
 
 
 @app.get(
     "/v1/status/vmanage", response_model=StatusResponse, response_model_exclude_unset=True
 )
-def get_status_vmanage():
-    lab_status_resp = LabStatus(
-        vmanage=rq_dispatcher_run(task_get_vmanage_status, id="vmanage_status")
+async def get_status_vmanage():
+    vmanage, age = await rq_dispatcher_cached(
+        task_get_vmanage_status, id="vmanage_status"
     )
-    return StatusResponse(status=lab_status_resp)
+    lab_status_resp = LabStatus(vmanage=vmanage)
+    return StatusResponse(status=lab_status_resp, age=age)
 
 
 @app.get(
     "/v1/status/dnac", response_model=StatusResponse, response_model_exclude_unset=True
 )
-def get_status_dnac():
-    lab_status = LabStatus(
-        dnac=rq_dispatcher_run(task_get_dnac_status, id="dnac_status")
-    )
-    return StatusResponse(status=lab_status)
+async def get_status_dnac():
+    dnac, age = await rq_dispatcher_cached(task_get_dnac_status, id="dnac_status")
+    lab_status = LabStatus(dnac=dnac)
+    return StatusResponse(status=lab_status, age=age)
 
 
 @app.get(
     "/v1/status/ise", response_model=StatusResponse, response_model_exclude_unset=True
 )
-def get_status_ise():
-    # Not using queue because we're talking to ISE API
-    # ise=rq_dispatcher_run(task_get_ise_status, id="ise_status")
-    ise = task_get_ise_status()
+async def get_status_ise():
+    ise, age = await rq_dispatcher_cached(task_get_ise_status, id="ise_status")
     lab_status = LabStatus(ise=ise)
-    return StatusResponse(status=lab_status)
+    return StatusResponse(status=lab_status, age=age)
 
 
 # Status for all network devices in lab
@@ -417,27 +672,27 @@ def get_status_ise():
     response_model=StatusResponse,
     response_model_exclude_unset=True,
 )
-def get_status_network_devices():
+async def get_status_network_devices():
     """
     Get status for all autonomous network devices.
     """
     lab_status = LabStatus()
-    lab_status.devices = rq_dispatcher_run(
+    lab_status.devices, age = await rq_dispatcher_cached(
         task_get_network_device_status_all, id="netdevices_status"
     )
-    return StatusResponse(status=lab_status)
+    return StatusResponse(status=lab_status, age=age)
 
 
 # Wildcard status route for network devices
 @app.get(
     "/v1/status/{name}", response_model=StatusResponse, response_model_exclude_unset=True
 )
-def get_status_network_device(name: str):
+async def get_status_network_device(name: str):
     """
     Get status for a single autonomous network device based on hostname.
     """
     name.lower()
-    netdevice = rq_dispatcher_run(
+    netdevice, age = await rq_dispatcher_cached(
         task_get_network_device_status, id=f"{name}_status", args=(name,)
     )
     lab_status = LabStatus()
@@ -446,30 +701,107 @@ def get_status_network_device(name: str):
         lab_status.devices = [netdevice]
     else:
         lab_status.devices = [netdevice]
-    return StatusResponse(status=lab_status)
+    return StatusResponse(status=lab_status, age=age)
 
 
 # Retrieve status of job given the job ID
 @app.get("/v1/job/{jobID}", response_model=JobResponse, response_model_exclude_unset=True)
-def get_job_status(jobID: str):
+async def get_job_status(jobID: str):
     """
     Get the status of queued jobs.
     """
     try:
-        job = Job.fetch(jobID, connection=REDIS_CONN)
-        if job.result:
-            job_status = JobStatus(
-                id=job.id,
-                status=job.get_status(),
-                result=str(job.result),
-                # disposition=job.result[1],
+        job = await run_in_threadpool(Job.fetch, jobID, connection=REDIS_CONN)
+        return JobResponse(job=rq_job_status(job))
+    except NoSuchJobError:
+        raise HTTPException(status_code=404, detail="No job found.")
+
+
+@app.get("/v1/jobs", response_model=MultiJobResponse, response_model_exclude_unset=True)
+async def get_jobs_status(ids: List[str] = Query(...)):
+    """
+    Get the status of several jobs at once.
+    Pass ids more than once or comma separated. Missing jobs get an error.
+    """
+    ids = [id for value in ids for id in value.split(",") if id]
+    return await rq_jobs_status(ids)
+
+
+@app.post(
+    "/v1/jobs", response_model=MultiJobResponse, response_model_exclude_unset=True
+)
+async def post_jobs_status(request: JobsRequest):
+    """
+    Get the status of several jobs at once, for more IDs than fit in a URL.
+    """
+    return await rq_jobs_status(request.ids)
+
+
+async def rq_jobs_status(ids: List[str]) -> MultiJobResponse:
+    # Duplicates are looked up and returned once
+    ids = [*dict.fromkeys(ids)]
+    jobs = await run_in_threadpool(Job.fetch_many, ids, connection=REDIS_CONN)
+    responses = []
+    for id, job in zip(ids, jobs):
+        if job is None:
+            responses.append(
+                JobResponse(job=JobStatus(id=id), error=JobError(error="No job found."))
             )
         else:
-            job_status = JobStatus(id=job.id, status=job.get_status())
-        return JobResponse(job=job_status)
-    except NoSuchJobError:
+            responses.append(JobResponse(job=rq_job_status(job)))
+    return MultiJobResponse(responses=responses)
+
+
+def rq_job_status(job: Job) -> JobStatus:
+    # Use the result loaded with the job, job.result reads Redis again for
+    # every job without one, blocking the event loop
+    if job._result:
+        job_status = JobStatus(
+            id=job.id,
+            status=job.get_status(refresh=False),
+            result=str(job._result),
+            # disposition=job.result[1],
+        )
+    else:
+        job_status = JobStatus(id=job.id, status=job.get_status(refresh=False))
+    if JOB_PROGRESS_KEY in job.meta:
+        job_status.progress = job.meta[JOB_PROGRESS_KEY]
+        job_status.percent = job.meta.get(JOB_PERCENT_KEY)
+    for timing in ("enqueued_at", "started_at", "ended_at"):
+        if getattr(job, timing):
+            setattr(job_status, timing, getattr(job, timing))
+    return job_status
+
+
+@app.get("/v1/job/{jobID}/events")
+async def get_job_events(jobID: str):
+    """
+    Stream status changes and progress of a job as Server-Sent Events.
+    Ends with a result event once the job is done.
+    """
+    exists = await ASYNC_REDIS_CONN.exists(Job.key_for(jobID))
+    if not exists:
         raise HTTPException(status_code=404, detail="No job found.")
 
+    async def stream():
+        async for event, data in job_events(jobID, ASYNC_REDIS_CONN):
+            if event == "keepalive":
+                yield ": keepalive\n\n"
+            else:
+                yield format_sse(event, data)
+        try:
+            result = await get_job_status(jobID)
+        except HTTPException:
+            return
+        # Round trip through the model JSON so the job timings serialize
+        yield format_sse("result", json.loads(result.json(exclude_unset=True)))
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
 
 # Reset the state of the entire lab back to default.
 @app.put(
@@ -478,18 +810,40 @@ def get_job_status(jobID: str):
     response_model_exclude_unset=True,
     status_code=201,
 )
-def reset():
-    # timeout = "1h"
-    responses = []
-    ise = rq_dispatcher_enq(task_reset_ise, id="reset_ise")
-    vmanage = rq_dispatcher_enq(task_reset_vmanage, id="reset_vmanage")
-    dnac = rq_dispatcher_enq(task_reset_dnac, id="reset_dnac")
-    netdevices = rq_dispatcher_enq(task_reset_network_device_all, id="reset_netdevices")
-    responses.append(ise)
-    responses.append(vmanage)
-    responses.append(dnac)
-    responses.append(netdevices)
-    return MultiJobResponse(responses=responses)
+async def reset():
+    """
+    Reset the whole lab, following RESET_PLAN.
+    Track it with /v1/orchestration/{orchID}.
+    """
+    id, jobs = await run_in_threadpool(start_orchestration, RESET_Q, RESET_PLAN)
+    for node in RESET_PLAN.values():
+        await run_in_threadpool(invalidate_reset_status, REDIS_CONN, node.task.__name__)
+    responses = [
+        JobResponse(job=JobStatus(id=job.id, status=job.get_status(refresh=False)))
+        for job in jobs.values()
+    ]
+    return MultiJobResponse(responses=responses, orchestration=id)
+
+
+@app.get(
+    "/v1/orchestration/{orchID}",
+    response_model=OrchestrationResponse,
+    response_model_exclude_unset=True,
+)
+async def get_orchestration_status(orchID: str):
+    """
+    Get the state of each step of a lab reset, and when it should end.
+    """
+    status = await run_in_threadpool(orchestration_status, REDIS_CONN, orchID)
+    if status is None:
+        raise HTTPException(status_code=404, detail="No orchestration found.")
+    nodes = [
+        OrchestrationNode(name=name, **state)
+        for name, state in status.pop("nodes").items()
+    ]
+    return OrchestrationResponse(
+        orchestration=OrchestrationStatus(nodes=nodes, **status)
+    )
 
 
 # Reset the state of the entire lab back to default.
@@ -499,8 +853,8 @@ def reset():
     response_model_exclude_unset=True,
     status_code=201,
 )
-def reset_dnac():
-    return rq_dispatcher_enq(task_reset_dnac, id="reset_dnac")
+async def reset_dnac():
+    return await rq_dispatcher_enq(task_reset_dnac, id="reset_dnac")
 
 
 # Reset the state of the entire lab back to default.
@@ -510,10 +864,12 @@ def reset_dnac():
     response_model_exclude_unset=True,
     status_code=201,
 )
-def reset_ise():
+async def reset_ise():
     # return rq_dispatcher_enq(task_reset_ise, id="reset_ise")
     # Migrated to using the ISE OpenAPI and don't need to use task queue any longer.
-    r, m = task_reset_ise()
+    await run_in_threadpool(invalidate_reset_status, REDIS_CONN, "task_reset_ise")
+    r, m = await run_in_threadpool(task_reset_ise)
+    await run_in_threadpool(invalidate_reset_status, REDIS_CONN, "task_reset_ise")
     if not r:
         j_err = JobError(error=m)
         j_stat = JobStatus(id="reset_ise")
@@ -531,8 +887,8 @@ def reset_ise():
     response_model_exclude_unset=True,
     status_code=201,
 )
-def reset_vmanage():
-    return rq_dispatcher_enq(task_reset_vmanage, id="reset_vmanage")
+async def reset_vmanage():
+    return await rq_dispatcher_enq(task_reset_vmanage, id="reset_vmanage")
 
 
 # Reset all network devices in lab
@@ -542,8 +898,8 @@ def reset_vmanage():
     response_model_exclude_unset=True,
     status_code=201,
 )
-def reset_network_devices():
-    return rq_dispatcher_enq(task_reset_network_device_all, id="reset_netdevices")
+async def reset_network_devices():
+    return await rq_dispatcher_enq(task_reset_network_device_all, id="reset_netdevices")
 
 
 # Reset a specified lab device
@@ -553,9 +909,9 @@ def reset_network_devices():
     response_model_exclude_unset=True,
     status_code=201,
 )
-def reset_network_device(name: str):
+async def reset_network_device(name: str):
     name.lower()
-    return rq_dispatcher_enq(
+    return await rq_dispatcher_enq(
         task_reset_network_device, id=f"{name}_reset", args=(name,)
     )
 
@@ -566,7 +922,7 @@ def reset_network_device(name: str):
     response_model_exclude_unset=True,
     status_code=201,
 )
-def backup_network_device(
+async def backup_network_device(
     name: str,
     cust_id: str = Path(
         title="The customer ID to add to the backup configuration file",
@@ -577,7 +933,7 @@ def backup_network_device(
         ),
     ):
     name.lower()
-    backup_resp = rq_dispatcher_run(
+    backup_resp = await rq_dispatcher_run(
         task_backup_network_device, id=f"{name}_backup", args=(name, cust_id)
     )
     lab_status = LabStatus()
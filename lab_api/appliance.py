@@ -1,15 +1,122 @@
+import asyncio
+import logging
 from abc import ABC
+from threading import Lock
+from time import monotonic
+from typing import Callable
+
+
+logger = logging.getLogger("civlab_api")
 
 
 class ApplianceAPI(ABC):
+    # Seconds a login is used before logging in again ahead of the
+    # appliance expiring it, None to use it until it is rejected
+    auth_ttl = None
+
     def __init__(self, host: str, username: str, password: str, port: str):
         self.host = host
         self.username = username
         self.password = password
         self.port = port
+        self._auth_lock = Lock()
+        # Bumped on every login, 0 until the first
+        self._auth_generation = 0
+        self._auth_expires = None
 
     def get_status(self) -> dict:
         pass
 
     def reset(self) -> tuple:
         pass
+
+    def _auth(self) -> None:
+        """Log in to the appliance, keeping the token or cookie on self"""
+        pass
+
+    def _unauthorized(self, resp) -> bool:
+        """Whether the appliance rejected the login of a response"""
+        # requests responses have status_code, aiohttp responses status
+        return getattr(resp, "status_code", getattr(resp, "status", None)) == 401
+
+    def login(self, stale: int = None) -> int:
+        """Log in if not logged in, the login expired or is stale
+
+        Threads sharing the client wait on one login instead of each
+        logging in.
+
+        Args:
+            stale (int): Login generation the appliance rejected
+        Returns:
+            int: generation of the current login
+        """
+        with self._auth_lock:
+            expires = self._auth_expires
+            expired = expires is not None and monotonic() >= expires
+            if not self._auth_generation or expired or stale == self._auth_generation:
+                logger.info(f"Logging in to {self.host}")
+                self._auth()
+                self._auth_generation += 1
+                if self.auth_ttl is not None:
+                    self._auth_expires = monotonic() + self.auth_ttl
+            return self._auth_generation
+
+    def call(self, request: Callable):
+        """Make a request, logging in again once if the login is rejected
+
+        Args:
+            request (Callable): makes the request with the current login
+        Returns:
+            the response of request
+        """
+        generation = self.login()
+        resp = request()
+        if self._unauthorized(resp):
+            logger.info(f"Login to {self.host} rejected, logging in again")
+            self.login(stale=generation)
+            resp = request()
+        return resp
+
+    async def acall(self, request: Callable):
+        """Like call, for a request that is a coroutine function
+
+        Logging in is blocking, it runs in a thread.
+        """
+        generation = await asyncio.to_thread(self.login)
+        resp = await request()
+        if self._unauthorized(resp):
+            logger.info(f"Login to {self.host} rejected, logging in again")
+            await asyncio.to_thread(self.login, generation)
+            resp = await request()
+        return resp
+
+
+class ApplianceRegistry:
+    """Hands out one long-lived API client per appliance
+
+    Clients keep their login between jobs and are shared by the threads
+    of a worker, see ApplianceAPI.login.
+    """
+
+    def __init__(self, factory: Callable) -> None:
+        # Builds an API client from the appliance name
+        self._factory = factory
+        self._clients = {}
+        self._lock = Lock()
+
+    def get(self, name: str) -> ApplianceAPI:
+        """The API client of an appliance
+
+        Args:
+            name (str): Appliance name, e.g. dnac
+        """
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                client = self._clients[name] = self._factory(name)
+        return client
+
+    def drop(self, name: str) -> None:
+        """Forget the client of an appliance, the next get builds a new one"""
+        with self._lock:
+            self._clients.pop(name, None)
@@ -0,0 +1,179 @@
+import logging
+import pickle
+from time import time
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from rq.job import Job
+
+
+logger = logging.getLogger("civlab_api")
+
+# Last known status results, stored by the worker when a status job finishes
+STATUS_KEY_PREFIX = "civlab:status:"
+# Held while a background refresh of a status is queued or running
+REFRESH_KEY_SUFFIX = ":refreshing"
+# Parsed default configs, shared by every worker
+DEFAULT_CFG_KEY_PREFIX = "civlab:defaultcfg:"
+# Seconds a parsed default config is kept, the key changes with the file
+DEFAULT_CFG_TTL = 86400
+# Appended to a default config key for the fingerprint of the config
+FINGERPRINT_KEY_SUFFIX = ":fingerprint"
+# Measured reload durations of each network device, newest first
+RELOAD_TIMES_KEY_PREFIX = "civlab:reload:"
+# Bumped when an appliance is reset, pooled sessions from before are dropped
+APPLIANCE_GENERATION_KEY_PREFIX = "civlab:appliance:generation:"
+
+
+def status_key(id: str) -> str:
+    """Name of the key holding the last known status for a job ID"""
+    return f"{STATUS_KEY_PREFIX}{id}"
+
+
+def refresh_key(id: str) -> str:
+    """Name of the key marking a status refresh in flight"""
+    return f"{status_key(id)}{REFRESH_KEY_SUFFIX}"
+
+
+def default_cfg_key(device: str, path: str, stamp: str) -> str:
+    """Name of the key holding a parsed default config
+
+    Args:
+        device (str): Device name
+        path (str): Path of the config file on the device
+        stamp (str): Identifies the file version, e.g. its size and mtime
+    """
+    return f"{DEFAULT_CFG_KEY_PREFIX}{device}:{path}:{stamp}"
+
+
+def default_fingerprint_key(device: str, path: str, stamp: str) -> str:
+    """Name of the key holding the fingerprint of a default config"""
+    return f"{default_cfg_key(device, path, stamp)}{FINGERPRINT_KEY_SUFFIX}"
+
+
+def status_cache_meta(stale_ttl: int) -> dict:
+    """Job meta telling the worker to store the job result as a status"""
+    return {"status_cache_ttl": stale_ttl}
+
+
+def store_job_status(connection: Redis, job: Job) -> bool:
+    """Store the result of a finished status job with the time it was taken
+
+    Only jobs enqueued with status_cache_meta are stored. The entry expires
+    after the stale TTL, past which the status is too old to serve.
+
+    Args:
+        connection (Redis): Redis connection to store on
+        job (Job): Finished job
+    Returns:
+        bool: True if the result was stored
+    """
+    ttl = job.meta.get("status_cache_ttl")
+    if not ttl:
+        return False
+    logger.debug(f"Storing status of job {job.id} for {ttl}s")
+    entry = pickle.dumps((time(), job.result))
+    with connection.pipeline() as pipe:
+        pipe.set(status_key(job.id), entry, ex=ttl)
+        pipe.delete(refresh_key(job.id))
+        pipe.execute()
+    return True
+
+
+def release_job_status(connection: Redis, job: Job) -> None:
+    """Let another refresh be queued after a status job failed"""
+    if job.meta.get("status_cache_ttl"):
+        connection.delete(refresh_key(job.id))
+
+
+def invalidate_status(connection: Redis, ids: list) -> None:
+    """Drop the last known statuses and refresh claims of job IDs
+
+    The next request for each status waits on a new status job instead of
+    being served one from before, e.g. a reset.
+    """
+    logger.debug(f"Dropping cached status of {ids}")
+    connection.delete(*[key for id in ids for key in (status_key(id), refresh_key(id))])
+
+
+async def load_status(connection: AsyncRedis, id: str) -> tuple | None:
+    """Read the last known status for a job ID
+
+    Args:
+        connection (AsyncRedis): asyncio Redis connection to read from
+        id (str): Job ID of the status task
+    Returns:
+        tuple:
+            (float) Age of the status in seconds
+            (Any) The status
+        None if there is no status within the stale TTL
+    """
+    entry = await connection.get(status_key(id))
+    if entry is None:
+        return None
+    taken, result = pickle.loads(entry)
+    return max(time() - taken, 0), result
+
+
+async def claim_refresh(connection: AsyncRedis, id: str, ttl: int) -> bool:
+    """Claim the single background refresh of a status
+
+    Args:
+        connection (AsyncRedis): asyncio Redis connection
+        id (str): Job ID of the status task
+        ttl (int): Seconds to hold the claim if the worker never releases it
+    Returns:
+        bool: True if the caller should queue the refresh
+    """
+    return bool(await connection.set(refresh_key(id), 1, nx=True, ex=ttl))
+
+
+def load_default_cfg(connection: Redis, key: str) -> dict | str | None:
+    """Read a parsed default config or fingerprint, None if it isn't cached"""
+    entry = connection.get(key)
+    if entry is None:
+        return None
+    return pickle.loads(entry)
+
+
+def store_default_cfg(
+    connection: Redis, key: str, cfg: dict | str, ttl: int = DEFAULT_CFG_TTL
+) -> None:
+    """Store a parsed default config or fingerprint for ttl seconds"""
+    logger.debug(f"Storing default config {key} for {ttl}s")
+    connection.set(key, pickle.dumps(cfg), ex=ttl)
+
+
+def reload_times_key(device: str) -> str:
+    """Name of the list holding the reload durations of a device"""
+    return f"{RELOAD_TIMES_KEY_PREFIX}{device}"
+
+
+def record_reload_time(
+    connection: Redis, device: str, seconds: float, keep: int = 50
+) -> None:
+    """Add a measured reload duration, keeping the latest keep of them"""
+    key = reload_times_key(device)
+    with connection.pipeline() as pipe:
+        pipe.lpush(key, round(seconds, 1))
+        pipe.ltrim(key, 0, keep - 1)
+        pipe.execute()
+
+
+def load_reload_times(connection: Redis, device: str) -> list:
+    """Read the measured reload durations of a device, newest first"""
+    return [float(t) for t in connection.lrange(reload_times_key(device), 0, -1)]
+
+
+def appliance_generation_key(name: str) -> str:
+    """Name of the key counting the resets of an appliance"""
+    return f"{APPLIANCE_GENERATION_KEY_PREFIX}{name}"
+
+
+def bump_appliance_generation(connection: Redis, name: str) -> int:
+    """Tell every process its sessions to an appliance are out of date"""
+    return connection.incr(appliance_generation_key(name))
+
+
+def load_appliance_generation(connection: Redis, name: str) -> int:
+    """Read the generation of an appliance, 0 if it was never reset"""
+    return int(connection.get(appliance_generation_key(name)) or 0)
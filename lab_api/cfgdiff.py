@@ -0,0 +1,113 @@
+from hashlib import sha256
+from re import Pattern
+from re import compile as re_compile
+
+
+# Lines genie's compare_config_dicts always leaves out of a diff
+DEFAULT_EXCLUDES = [r"(^Load|Time|Build|Current|Using|exit|end)"]
+# Joins the lines of a config path when hashing
+PATH_SEP = "\x1f"
+
+
+def compile_excludes(excludes: list = None) -> Pattern:
+    """Compile exclude regexes into a single alternation
+
+    Like genie, a line is excluded if a regex matches at its start, and
+    the lines nested under an excluded line are excluded with it.
+
+    Args:
+        excludes (list): Regexes added to DEFAULT_EXCLUDES
+    Returns:
+        Pattern: compiled alternation of every exclude
+    """
+    return re_compile("|".join(DEFAULT_EXCLUDES + list(excludes or [])))
+
+
+def parse_config(cfg: str, exclude: Pattern = None) -> dict:
+    """Parse an IOS-XE config into the set of its line paths
+
+    A line path is the tuple of the line and the section lines it is
+    nested under, e.g. ("interface GigabitEthernet1", "no shutdown"). The
+    paths are the keys of the returned dict, in config order, so set
+    operations on them are hash lookups.
+
+    Args:
+        cfg (str): Config text, e.g. show running-config output
+        exclude (Pattern): Lines to leave out, see compile_excludes
+    Returns:
+        dict: line paths of the config, values are None
+    """
+    paths = {}
+    # (indent, path) of the sections enclosing the current line,
+    # path is None for an excluded section
+    stack = []
+    for line in cfg.splitlines():
+        text = line.strip()
+        if not text:
+            continue
+        indent = len(line) - len(line.lstrip())
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        parent = stack[-1][1] if stack else ()
+        if parent is None or (exclude and exclude.match(text)):
+            stack.append((indent, None))
+            continue
+        path = parent + (text,)
+        paths[path] = None
+        stack.append((indent, path))
+    return paths
+
+
+def diff_configs(running: dict, default: dict) -> dict:
+    """Diff two parsed configs
+
+    Only the outermost differing line of a section is listed, e.g. an
+    added interface is one path, not one per line under it.
+
+    Args:
+        running (dict): Parsed config, see parse_config
+        default (dict): Parsed config to compare against
+    Returns:
+        dict:
+            added: line paths in running but not in default
+            removed: line paths in default but not in running
+        Empty if the configs match.
+    """
+    diff = {}
+    added = _outermost(running, default)
+    removed = _outermost(default, running)
+    if added:
+        diff["added"] = added
+    if removed:
+        diff["removed"] = removed
+    return diff
+
+
+def _outermost(a: dict, b: dict) -> list:
+    """Paths of a missing from b, skipping those under a listed path"""
+    paths = []
+    for path in a:
+        if path in b:
+            continue
+        if paths and path[: len(paths[-1])] == paths[-1]:
+            continue
+        paths.append(path)
+    return paths
+
+
+def format_diff(diff: dict) -> str:
+    """Render a diff from diff_configs as +/- lines, for logs"""
+    lines = []
+    for sign, key in (("+", "added"), ("-", "removed")):
+        for path in diff.get(key, []):
+            lines.append(f"{sign} {' > '.join(path)}")
+    return "\n".join(lines)
+
+
+def config_fingerprint(paths: dict) -> str:
+    """Hash of a parsed config, equal for configs that diff_configs matches"""
+    digest = sha256()
+    for path in sorted(paths):
+        digest.update(PATH_SEP.join(path).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+from time import monotonic
+from typing import Callable
+from aiohttp import ClientSession
+
+
+logger = logging.getLogger("civlab_api")
+
+# Seconds an appliance has to answer a status check
+STATUS_DEADLINE = 30
+
+
+async def collect_status(checks: dict, deadlines: dict = None) -> dict:
+    """Run status checks concurrently, each cut off at its deadline
+
+    The checks share one HTTP session, so all of them take as long as the
+    slowest one, at most the longest deadline.
+
+    Args:
+        checks (dict): name to a coroutine function checking the status,
+            called with the aiohttp session
+        deadlines (dict): name to seconds its check may take, defaults to
+            STATUS_DEADLINE
+    Returns:
+        dict: name to the status returned by its check, or to the
+            exception it raised, TimeoutError if it ran out of time
+    """
+    deadlines = deadlines or {}
+
+    async def run(name: str, check: Callable, session: ClientSession):
+        start = monotonic()
+        deadline = deadlines.get(name, STATUS_DEADLINE)
+        try:
+            return await asyncio.wait_for(check(session), deadline)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No answer in {deadline}s") from None
+        finally:
+            logger.info(f"Status of {name} took {monotonic() - start:.1f}s")
+
+    async with ClientSession() as session:
+        results = await asyncio.gather(
+            *[run(name, check, session) for name, check in checks.items()],
+            return_exceptions=True,
+        )
+    return dict(zip(checks, results))
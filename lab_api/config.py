@@ -1,3 +1,4 @@
+from functools import lru_cache
 from os import environ, getenv
 from logging import getLogger
 from logging.config import dictConfig
@@ -6,19 +7,59 @@ from fastapi import Depends, FastAPI, HTTPException, Security
 from fastapi.security.api_key import APIKeyHeader
 from starlette.status import HTTP_401_UNAUTHORIZED
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 from rq import Queue
-from genie.testbed import load as testbed_load
 from yaml import load as yamlload
 from yaml import Loader as yamlLoader
+from .inventory import load_inventory
 
 
 # Config and setup
 REDIS_CONN = Redis(host="redis", port=6379)
+# Used by the API to await jobs without tying up threadpool threads
+ASYNC_REDIS_CONN = AsyncRedis(host="redis", port=6379)
 DEFAULT_Q = Queue(connection=REDIS_CONN)
-NETDEVICE_TESTBED = testbed_load(getenv("CIVLAB_NETDEVICE_DATA"))
+# Separate queues and workers so status checks never wait behind resets
+STATUS_Q = Queue("status", connection=REDIS_CONN)
+RESET_Q = Queue("reset", connection=REDIS_CONN)
+BACKUP_Q = Queue("backup", connection=REDIS_CONN)
 with open(getenv("CIVLAB_APPLIANCE_DATA"), "r") as stream:
     APPLIANCES = yamlload(stream, Loader=yamlLoader)
+# Names and hosts of the lab devices, read by the API without loading genie.
+# Compiled by start.sh, compiling here would load genie in every process.
+INVENTORY = load_inventory(
+    getenv("CIVLAB_INVENTORY", ".inventory.json"),
+    getenv("CIVLAB_NETDEVICE_DATA"),
+    getenv("CIVLAB_APPLIANCE_DATA"),
+    compile=False,
+)
 API_KEY = environ["CIVLAB_API_KEY"]
+# Seconds a status is served as is, and how long it may be served stale
+# while a background refresh runs
+STATUS_FRESH_TTL = int(getenv("CIVLAB_STATUS_FRESH_TTL", 30))
+STATUS_STALE_TTL = int(getenv("CIVLAB_STATUS_STALE_TTL", 3600))
+
+
+# The testbed and device pool are only needed by tasks, load them on first
+# use so the API process doesn't import pyATS
+@lru_cache(maxsize=None)
+def get_netdevice_testbed():
+    from genie.testbed import load as testbed_load
+
+    return testbed_load(getenv("CIVLAB_NETDEVICE_DATA"))
+
+
+# Network device connections kept open between jobs by a non-forking worker
+@lru_cache(maxsize=None)
+def get_device_pool():
+    from .pool import DevicePool
+
+    return DevicePool(
+        get_netdevice_testbed(),
+        idle_timeout=int(getenv("CIVLAB_DEVICE_IDLE_TIMEOUT", 300)),
+    )
+
+
 api_key_header_auth = APIKeyHeader(name="access_token", auto_error=True)
 
 
@@ -1,7 +1,27 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from socket import create_connection
+from time import monotonic, sleep
+from typing import Callable
 # from datetime import datetime
 from genie.libs.conf.testbed import Testbed
 from pyats.topology.device import Device
+from redis import Redis
+from .cfgdiff import (
+    compile_excludes,
+    config_fingerprint,
+    diff_configs,
+    format_diff,
+    parse_config,
+)
+from .cache import (
+    default_cfg_key,
+    default_fingerprint_key,
+    load_default_cfg,
+    load_reload_times,
+    record_reload_time,
+    store_default_cfg,
+)
 
 
 # Make sure .ssh/config adds the key exchange methods the network devices support
@@ -12,11 +32,33 @@ from pyats.topology.device import Device
 #    UserKnownHostsFile /dev/null
 
 
+def ssh_answers(host: str, port: int = 22, timeout: float = 5) -> bool:
+    """Check a host sends an SSH banner on a port
+
+    args:
+        host: address of the host
+        port: SSH port
+        timeout: seconds to wait for the connection and the banner
+    returns: bool
+    """
+    try:
+        with create_connection((host, port), timeout=timeout) as sock:
+            return sock.recv(4).startswith(b"SSH-")
+    except OSError:
+        return False
+
+
 class DeviceLab:
     """Class to connect to lab devices"""
-    def __init__(self, testbed: Testbed) -> None:
+    def __init__(
+        self, testbed: Testbed, max_workers: int = None, cache: Redis = None
+    ) -> None:
         self.testbed = testbed
+        # Shares parsed default configs between workers, None to always parse
+        self.cache = cache
         self.default_cfg_file = testbed.custom.get("default_cfg_file")
+        # Max devices worked on at once by the *_all methods, 1 is serial
+        self.max_workers = max_workers or int(testbed.custom.get("max_workers", 1))
         self.devices = self.testbed.devices
         self._cfg_diff_excludes = [
             r"(^!)",
@@ -27,56 +69,109 @@ class DeviceLab:
             r"(^service password-encryption)",
             r"(^crypto pki trustpoint)",
             ]
+        # The excludes above and genie's defaults as one regex
+        self._cfg_exclude = compile_excludes(self._cfg_diff_excludes)
         self._logger = logging.getLogger("civlab_api")
         self._reload_sleep = 300
         self._reload_timeout = 1200
+        # "probe" waits until the device answers on SSH after a reload,
+        # "sleep" waits a fixed _reload_sleep
+        self.reload_wait = testbed.custom.get("reload_wait", "probe")
+        # Seconds before the first probe, the device is still going down
+        self._reload_probe_delay = 30
+        # Seconds between probes, doubling up to the max
+        self._reload_probe_interval = 5
+        self._reload_probe_max = 60
+        # "replace" tries configure replace before falling back to a copy to
+        # startup and reload, "reload" always reloads. Devices can override
+        # it with reset_strategy in their custom data.
+        self.reset_strategy = testbed.custom.get("reset_strategy", "replace")
+        self._replace_timeout = 120
         self._backup_prefix = "cpoc_backup_"
 
-    def get_status(self, device: Device) -> str:
+    def get_status(self, device: Device, details: bool = False) -> str:
         """Get the device config status: default or configured
-        
+
+        Compares fingerprints of the running and default configs. The full
+        diff is only worked out if they differ and details are asked for.
+
         args:
             device: string name of the device to reset
+            details: set device.running_default_diff for configured devices
         returns:
             status: configured or default
         """
         self._logger.info(f"Getting status of {device}...")
-        diff = self.get_running_default_cfg_diff(device)
-        if len(diff) > 0:
-            device.status = "configured"
-        else:
+        if self.is_running_cfg_default(device):
             device.status = "default"
+            device.running_default_diff = {}
+        else:
+            device.status = "configured"
+            if details and device.default_config_exists:
+                self.get_running_default_cfg_diff(
+                    device, running_cfg=device.running_cfg_text
+                )
         return device.status
 
-    def get_running_default_cfg_diff(self, device: Device) -> str:
+    def is_running_cfg_default(self, device: Device) -> bool:
+        """Determine if the running config matches the default config
+
+        args:
+            device: device to check
+        returns: bool, False if there is no default config on flash
+        """
+        if not self.get_default_cfg_exists(device):
+            device.running_cfg_text = None
+            return False
+        device.running_cfg_text = device.execute("show running-config")
+        running = self.cfg_fingerprint(device.running_cfg_text)
+        default = self.get_default_cfg_fingerprint(device)
+        self._logger.debug(f"Fingerprints of {device}: {running} {default}")
+        return running == default
+
+    def cfg_fingerprint(self, cfg: str) -> str:
+        """Hash of a config, ignoring the lines the config diff excludes
+
+        args:
+            cfg: config text
+        returns: string hex digest
+        """
+        return config_fingerprint(parse_config(cfg, self._cfg_exclude))
+
+    def get_running_default_cfg_diff(
+        self, device: Device, running_cfg: str = None
+    ) -> dict:
         """Get diff between default config and running
         
         args:
             device: string name of the device to reset
+            running_cfg: running config text already read off the device
         returns:
-            running_default_diff: string diff between running and default cfg
+            running_default_diff: dict of added and removed config lines,
+            empty for none (see lab_api.cfgdiff.diff_configs)
         """
         self._logger.info("Determining difference of running "
         f"and default configurations of {device}.")
         # Check to see if the default configuration exists on device
         if self.get_default_cfg_exists(device):
-            # Get the running config and parse into a dict
-            device.running_cfg = device.api.get_running_config_dict()
-            # Get the default config from file on flash and parse into dict
-            device.default_cfg = device.api.get_config_from_file(
-                device.default_dir, self.default_cfg_file
-            )
-            # Diff the running and default config dicts
+            # Get the running config and parse into line paths
             # Exclude config lines added by pyats and comments
-            device.running_default_diff = device.api.compare_config_dicts(
-                device.running_cfg,
-                device.default_cfg,
-                exclude=self._cfg_diff_excludes,
+            if running_cfg is None:
+                running_cfg = device.execute("show running-config")
+            device.running_cfg = parse_config(running_cfg, self._cfg_exclude)
+            # Get the default config from file on flash, parsed the same way
+            device.default_cfg = self.get_default_cfg(device)
+            # Diff the running and default configs
+            device.running_default_diff = diff_configs(
+                device.running_cfg, device.default_cfg
             )
-            
-        # Return differences between the configs, '' for none.
+        else:
+            # Nothing to diff against
+            device.running_default_diff = {}
+
+        # Return differences between the configs, {} for none.
         self._logger.debug("Difference in configurations:")
-        self._logger.debug(device.running_default_diff)
+        self._logger.debug(format_diff(device.running_default_diff))
         return device.running_default_diff
 
     def get_default_cfg_exists(self, device: Device) -> bool:
@@ -91,13 +186,94 @@ class DeviceLab:
         device.default_dir = device.api.get_platform_default_dir()
         # Path of the default configuration file
         device.default_cfg_path = f"{device.default_dir}/{self.default_cfg_file}"
+        # Listing of the directory, kept to identify the default config file
+        device.default_dir_output = device.execute(f"dir {device.default_dir}/")
         # Bool for if the default configuration file exists on device
         device.default_config_exists = device.api.verify_file_exists(
-            device.default_cfg_path
+            device.default_cfg_path, dir_output=device.default_dir_output
         )
         self._logger.info(f"Default config exists: {device.default_config_exists}")
         return device.default_config_exists
 
+    def get_default_cfg(self, device: Device) -> dict:
+        """Get the default config parsed into line paths
+
+        The parsed config is cached by file size and modification time, so
+        it is only read off flash again when the file changes.
+        Call get_default_cfg_exists first.
+
+        args:
+            device: device to get the default config of
+        returns: dict of the default config, see lab_api.cfgdiff.parse_config
+        """
+        return self._cached_default(
+            device,
+            default_cfg_key,
+            lambda: parse_config(
+                device.execute(f"more {device.default_dir}{self.default_cfg_file}"),
+                self._cfg_exclude,
+            ),
+        )
+
+    def get_default_cfg_fingerprint(self, device: Device) -> str:
+        """Get the fingerprint of the default config
+
+        Cached the same way as get_default_cfg.
+        Call get_default_cfg_exists first.
+
+        args:
+            device: device to get the default config fingerprint of
+        returns: string hex digest
+        """
+        return self._cached_default(
+            device,
+            default_fingerprint_key,
+            lambda: config_fingerprint(self.get_default_cfg(device)),
+        )
+
+    def _cached_default(self, device: Device, key_func: Callable, get: Callable):
+        """Get a value derived from the default config, through the cache"""
+        stamp = self.get_default_cfg_stamp(device)
+        key = None
+        if self.cache is not None and stamp:
+            key = key_func(device.name, device.default_cfg_path, stamp)
+            try:
+                value = load_default_cfg(self.cache, key)
+            except Exception as e:
+                self._logger.error(f"Failed to read default config cache: {e}")
+                value = key = None
+            if value is not None:
+                self._logger.info(f"Using cached default config of {device}.")
+                return value
+        value = get()
+        if key and value is not None:
+            try:
+                store_default_cfg(self.cache, key, value)
+            except Exception as e:
+                self._logger.error(f"Failed to cache default config: {e}")
+        return value
+
+    def get_default_cfg_stamp(self, device: Device) -> str | None:
+        """Identify the version of the default config file on flash
+
+        Uses the directory listing from get_default_cfg_exists, so no
+        further commands are sent to the device.
+
+        args:
+            device: device to get the default config file stamp of
+        returns: string of the file size and modification time, None if unknown
+        """
+        try:
+            dir_out = device.parse(
+                f"dir {device.default_dir}/", output=device.default_dir_output
+            )
+            device_dir = dir_out["dir"]["dir"]
+            info = dir_out["dir"][device_dir]["files"][self.default_cfg_file]
+        except Exception as e:
+            self._logger.debug(f"No default config file stamp for {device}: {e}")
+            return None
+        return f"{info.get('size')}:{info.get('last_modified_date')}"
+
     def is_file_on_flash(self, device: Device, filename: str) -> bool:
         """Determine if a file is on the device flash
 
@@ -117,22 +293,61 @@ class DeviceLab:
 
     def reset(self, device: Device) -> bool:
         """Reset Device
-        
+
+        Sets device.reset_strategy to the strategy that ran, replace or
+        reload, and device.reset_time to the seconds it took.
+
         args:
             device: string name of the device to reset
         returns: bool
         """
+        device.reset_strategy = device.reset_time = None
         diff = self.get_running_default_cfg_diff(device)
         if len(diff) > 0:
-            self._logger.info(f"Resetting {device}...")
+            started = monotonic()
+            strategy = self.get_reset_strategy(device)
+            self._logger.info(f"Resetting {device} by {strategy}...")
             self.reset_device_to_default(device)
-            self.reload(device)
-            # self.clean_device_to_default(device)
+            if strategy == "replace" and self.replace_device_cfg(device):
+                device.reset_strategy = "replace"
+            else:
+                self.reload(device)
+                device.reset_strategy = "reload"
+            device.reset_time = round(monotonic() - started, 1)
+            self._logger.info(
+                f"Reset {device} by {device.reset_strategy} in {device.reset_time}s"
+            )
             device.reset = True
         else:
             device.reset = False
         return device.reset
 
+    def get_reset_strategy(self, device: Device) -> str:
+        """Reset strategy of a device, from its custom data or the testbed's"""
+        return device.custom.get("reset_strategy", self.reset_strategy)
+
+    def replace_device_cfg(self, device: Device) -> bool:
+        """Replace the running config with the default config, no reload
+
+        args:
+            device: device to reset
+        returns: bool, False if the replace failed or left a difference
+        """
+        try:
+            device.api.configure_replace(
+                device.default_dir,
+                self.default_cfg_file,
+                config_replace_options="force",
+                timeout=self._replace_timeout,
+            )
+        except Exception as e:
+            self._logger.error(f"Configure replace failed on {device}: {e}")
+            return False
+        if not self.is_running_cfg_default(device):
+            self._logger.error(f"Configure replace left a difference on {device}")
+            return False
+        return True
+
     def clean_device_to_default(self, device):
         device.api.clean.apply_configuration(
             file=device.default_cfg_path,
@@ -146,12 +361,93 @@ class DeviceLab:
             device: string name of the device to reload
         """
         self._logger.info(f"Reloading {device}...")
-        device.api.execute_reload(
-            prompt_recovery=False,
-            reload_creds="default",
-            sleep_after_reload=self._reload_sleep,
-            timeout=self._reload_timeout,
-        )
+        if self.reload_wait != "probe":
+            device.api.execute_reload(
+                prompt_recovery=False,
+                reload_creds="default",
+                sleep_after_reload=self._reload_sleep,
+                timeout=self._reload_timeout,
+            )
+            return
+        started = monotonic()
+        # Don't let unicon sleep and reconnect, wait_for_reload does it
+        attempts = device.settings.RELOAD_RECONNECT_ATTEMPTS
+        device.settings.RELOAD_RECONNECT_ATTEMPTS = 0
+        try:
+            device.api.execute_reload(
+                prompt_recovery=False,
+                reload_creds="default",
+                sleep_after_reload=0,
+                timeout=self._reload_timeout,
+            )
+        finally:
+            device.settings.RELOAD_RECONNECT_ATTEMPTS = attempts
+        self.wait_for_reload(device, started)
+
+    def wait_for_reload(self, device: Device, started: float) -> float:
+        """Wait until a reloading device answers on SSH and log in again
+
+        Probes the SSH port with exponential backoff. The time taken is
+        recorded for the device and used to size later timeouts.
+
+        args:
+            device: device being reloaded
+            started: monotonic time the reload was sent
+        returns: seconds the reload took
+        """
+        deadline = started + self.get_reload_timeout(device)
+        interval = self._reload_probe_interval
+        self._disconnect(device)
+        sleep(self._reload_probe_delay)
+        while not self._reload_done(device):
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{device} did not come back after reload")
+            sleep(min(interval, remaining))
+            interval = min(interval * 2, self._reload_probe_max)
+        elapsed = monotonic() - started
+        self._logger.info(f"{device} came back after {elapsed:.0f}s")
+        if self.cache is not None:
+            record_reload_time(self.cache, device.name, elapsed)
+        return elapsed
+
+    def get_reload_timeout(self, device: Device) -> float:
+        """Seconds to wait for a device to reload
+
+        Twice the longest recorded reload of the device, or _reload_timeout
+        if none are recorded. Never more than _reload_timeout.
+
+        args:
+            device: device being reloaded
+        """
+        times = []
+        if self.cache is not None:
+            try:
+                times = load_reload_times(self.cache, device.name)
+            except Exception as e:
+                self._logger.error(f"Failed to read reload times: {e}")
+        if not times:
+            return self._reload_timeout
+        return min(max(times) * 2, self._reload_timeout)
+
+    def _reload_done(self, device: Device) -> bool:
+        """Probe the SSH port, then log in once the port answers"""
+        ssh = device.connections.ssh
+        if not ssh_answers(str(ssh.ip), ssh.get("port", 22)):
+            return False
+        try:
+            device.connect()
+        except Exception as e:
+            self._logger.info(f"{device} answers but login failed: {e}")
+            self._disconnect(device)
+            return False
+        return True
+
+    def _disconnect(self, device: Device) -> None:
+        try:
+            device.disconnect()
+        except Exception:
+            device.destroy()
 
     def reset_device_to_default(self, device: Device) -> None:
         """Reset device to default configuration
@@ -187,30 +483,51 @@ class DeviceLab:
         device.api.clean.copy_run_to_flash(file_name=backup_fn)
         return backup_fn
 
-    def backup_running_to_flash_all(self, cust_id: str) -> None:
+    def backup_running_to_flash_all(self, cust_id: str) -> dict:
         """Backup running config on all devices"""
-        for device in self.testbed:
-            self.backup_running_to_flash(device, cust_id)
+        return self._run_all(self.backup_running_to_flash, cust_id)
 
-    def reset_device_to_default_all(self) -> None:
+    def reset_device_to_default_all(self) -> dict:
         """Reset config to default on all devices"""
-        for device in self.testbed:
-            self.reset(device)
+        return self._run_all(self.reset)
 
-    def get_default_cfg_exists_all(self) -> None:
+    def get_default_cfg_exists_all(self) -> dict:
         """Confirm default config is on all devices"""
-        for device in self.testbed:
-            self.get_default_cfg_exists(device)
+        return self._run_all(self.get_default_cfg_exists)
 
-    def get_running_default_cfg_diff_all(self) -> None:
+    def get_running_default_cfg_diff_all(self) -> dict:
         """Get diff between running and default cfg"""
-        for device in self.testbed:
-            self.get_running_default_cfg_diff(device)
+        return self._run_all(self.get_running_default_cfg_diff)
 
-    def get_status_all(self) -> None:
+    def get_status_all(self) -> dict:
         """Get config status of all devices"""
-        for device in self.testbed:
-            self.get_status(device)
+        return self._run_all(self.get_status)
+
+    def _run_all(self, func: Callable, *args) -> dict:
+        """Run a method on every device, max_workers devices at a time
+
+        A device that raises doesn't stop the others. Its exception is
+        returned in place of a result and kept on device.error.
+
+        args:
+            func: method taking the device as first argument
+            args: further arguments passed to func
+        returns:
+            results: device name to result or exception raised
+        """
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(func, device, *args): device for device in self}
+            for future in as_completed(futures):
+                device = futures[future]
+                try:
+                    results[device.name] = future.result()
+                except Exception as e:
+                    self._logger.error(f"{func.__name__} failed on {device}: {e}")
+                    # Keep an earlier error, e.g. from connecting
+                    device.error = getattr(device, "error", None) or str(e)
+                    results[device.name] = e
+        return results
 
     def connect_all(self) -> None:
         """Connect to all devices via SSH"""
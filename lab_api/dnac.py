@@ -1,52 +1,132 @@
 import logging
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .appliance import ApplianceAPI
 
 
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
+
 requests.packages.urllib3.disable_warnings()
 
 
 class DNAC(ApplianceAPI):
-    def __init__(self, host: str, username: str, password: str, port: str = 443, verify: bool = False):
+    # Tokens are valid for an hour
+    auth_ttl = 3300
+
+    def __init__(
+        self,
+        host: str,
+        username: str,
+        password: str,
+        port: str = 443,
+        verify: bool = False,
+        pool_size: int = 4,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 30,
+    ):
+        """
+        Args:
+            pool_size (int): Connections kept open to DNAC
+            retries (int): Retries of a request on connection errors and 5xx,
+                only idempotent requests are retried once sent
+            backoff (float): Seconds before the second retry, doubling after
+            timeout (float): Seconds to wait to connect and for each read
+        """
         super().__init__(host, username, password, port)
         self._logger = logging.getLogger("civlab_api")
         self.verify = verify
+        self.timeout = timeout
+        self._base_url = f"https://{self.host}:{self.port}"
         self._token = None
         self._headers = {
             "Content-Type": "application/json",
             "Accept": "application/json",
         }
-        self._auth_resp = self._auth()
+        self._auth_resp = None
+        self._session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(500, 502, 503, 504),
+            # Return the last error response for raise_for_status
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+        )
+        self._session.mount("https://", adapter)
+        self._default_result = {
+            "last_restore": "None found",
+            "restore_id": "None found",
+            "status": "No restore history found",
+            "host": self.host,
+        }
 
     def get_status(self) -> dict:
-        pass
+        """Last restore of DNAC, from its restore history"""
+        history = self._get_restore_history().get("response") or []
+        return self._parse_restore_history(history, dict(self._default_result))
+
+    async def get_status_async(self, session: "ClientSession") -> dict:
+        """Like get_status, on an aiohttp session
+
+        Args:
+            session (ClientSession): session to make the request on
+        """
+        path = f"{self._base_url}/api/system/v1/maglev/restore/history"
+        self._logger.info(f"GET {path}")
+
+        async def request():
+            resp = await session.get(
+                path, headers=self._headers, ssl=None if self.verify else False
+            )
+            await resp.read()
+            return resp
+
+        resp = await self.acall(request)
+        self._logger.debug(f"Status code: {resp.status}")
+        resp.raise_for_status()
+        history = (await resp.json()).get("response") or []
+        return self._parse_restore_history(history, dict(self._default_result))
 
     def reset(self) -> dict:
         pass
 
-    def _auth(self) -> dict:
-        path = f"{self.host}/dna/system/api/v1/auth/token"
+    def _auth(self) -> None:
+        path = f"{self._base_url}/dna/system/api/v1/auth/token"
         self._logger.info(f"POST {path}")
-        resp = requests.post(
+        resp = self._session.post(
             path,
             auth=(self.username, self.password),
-            headers=self.headers,
+            headers=self._headers,
             verify=self.verify,
+            timeout=self.timeout,
         )
         resp.raise_for_status()
-        r_json = resp.json()
-        self._token = r_json.get("Token")
+        self._auth_resp = resp.json()
+        self._token = self._auth_resp.get("Token")
         self._headers["X-Auth-Token"] = self._token
-        return r_json
 
     def _request(
         self, method: str, path: str, params: dict = None, body: dict = None
     ) -> dict:
-        method = str(method).lower()
-        req = getattr(requests, method)
-        self._logger.info(f"{method.upper()} {path}")
-        resp = req(
-            path, headers=self.headers, verify=self.verify, params=params, json=body
+        method = str(method).upper()
+        self._logger.info(f"{method} {path}")
+        resp = self.call(
+            lambda: self._session.request(
+                method,
+                path,
+                headers=self._headers,
+                verify=self.verify,
+                params=params,
+                json=body,
+                timeout=self.timeout,
+            )
         )
         self._logger.debug(f"Status code: {resp.status_code}")
         self._logger.debug(resp.text)
@@ -54,9 +134,53 @@ class DNAC(ApplianceAPI):
         return resp.json()
 
     def _get_backup_history(self) -> dict:
-        path = f"{self.host}/api/system/v1/maglev/backup"
+        path = f"{self._base_url}/api/system/v1/maglev/backup"
         return self._request("get", path)
 
+    def _get_restore_history(self) -> dict:
+        path = f"{self._base_url}/api/system/v1/maglev/restore/history"
+        return self._request("get", path)
+
+    def _parse_restore_history(self, history: list, r: dict) -> dict:
+        """Fill r with the latest restore of a restore history
+
+        Args:
+            history (list): restores, each with id, status and start_timestamp
+                as epoch seconds or milliseconds, or a date string
+            r (dict): result to fill in
+        """
+        if not history:
+            return r
+        restore = max(
+            history,
+            key=lambda restore: (_epoch(restore), str(restore.get("start_timestamp"))),
+        )
+        r["restore_id"] = restore.get("id", r["restore_id"])
+        r["status"] = restore.get("status", r["status"])
+        started = restore.get("start_timestamp")
+        if isinstance(started, (int, float)):
+            r["last_restore"] = _format_epoch(_epoch(restore))
+        elif started:
+            r["last_restore"] = str(started)
+        return r
+
+    def close(self) -> None:
+        """Close the pooled connections to DNAC"""
+        self._session.close()
+
+
+def _epoch(restore: dict) -> float:
+    """Start of a restore in epoch seconds, 0 if not known"""
+    started = restore.get("start_timestamp")
+    if not isinstance(started, (int, float)):
+        return 0
+    # Maglev timestamps are in milliseconds
+    return started / 1000 if started > 1e11 else started
+
+
+def _format_epoch(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
 
 if __name__ == "__main__":
     vm = DNAC("192.133.187.27", "admin", "FEDciv123!")
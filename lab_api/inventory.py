@@ -0,0 +1,103 @@
+import json
+import logging
+from os import getenv, getpid, replace
+from os.path import getmtime
+
+
+logger = logging.getLogger("civlab_api")
+
+
+def compile_inventory(testbed_file: str, appliance_file: str) -> dict:
+    """Names and hosts of the lab devices, from the testbed and appliance data
+
+    Loads the testbed with genie so host markup resolves as it does in the
+    worker. That takes seconds, see load_inventory to do it once.
+
+    Args:
+        testbed_file (str): pyATS testbed YAML of the network devices
+        appliance_file (str): YAML of the appliances
+    Returns:
+        dict:
+            sources: data file to its modification time
+            appliances: name and host of each appliance
+            network_devices: name and host of each network device
+    """
+    from genie.testbed import load as testbed_load
+    from yaml import Loader as yamlLoader
+    from yaml import load as yamlload
+
+    testbed = testbed_load(testbed_file)
+    with open(appliance_file, "r") as stream:
+        appliances = yamlload(stream, Loader=yamlLoader)
+    return {
+        "sources": _sources(testbed_file, appliance_file),
+        "appliances": [
+            {"name": name, "host": params.get("host")}
+            for name, params in appliances.items()
+        ],
+        "network_devices": [
+            {"name": device.name, "host": str(device.connections.ssh.ip)}
+            for device in testbed
+        ],
+    }
+
+
+def load_inventory(
+    path: str, testbed_file: str, appliance_file: str, compile: bool = True
+) -> dict:
+    """Read the compiled inventory, compiling it if the data has changed
+
+    The inventory is kept as JSON, so the API process reads it without
+    loading genie, and recompiled when a data file is newer than it.
+
+    Args:
+        path (str): JSON file the inventory is compiled to
+        testbed_file (str): pyATS testbed YAML of the network devices
+        appliance_file (str): YAML of the appliances
+        compile (bool): Compile a missing or out of date inventory, else
+            raise RuntimeError
+    Returns:
+        dict: see compile_inventory
+    """
+    try:
+        with open(path, "r") as stream:
+            inventory = json.load(stream)
+        if inventory.get("sources") == _sources(testbed_file, appliance_file):
+            return inventory
+    except (OSError, ValueError):
+        pass
+    if not compile:
+        raise RuntimeError(
+            f"Inventory {path} is missing or out of date, "
+            "compile it with: python lab_api/inventory.py"
+        )
+    logger.info(f"Compiling inventory to {path}")
+    inventory = compile_inventory(testbed_file, appliance_file)
+    try:
+        save_inventory(inventory, path)
+    except OSError as e:
+        logger.warning(f"Could not save inventory to {path}: {e}")
+    return inventory
+
+
+def save_inventory(inventory: dict, path: str) -> None:
+    """Write a compiled inventory to its JSON file"""
+    # Write and rename so another process never reads half a file
+    tmp = f"{path}.{getpid()}"
+    with open(tmp, "w") as stream:
+        json.dump(inventory, stream)
+    replace(tmp, path)
+
+
+def _sources(*files: str) -> dict:
+    return {file: getmtime(file) for file in files}
+
+
+# Run as a script, not with -m, so lab_api and its config aren't imported:
+#     python lab_api/inventory.py
+if __name__ == "__main__":
+    path = getenv("CIVLAB_INVENTORY", ".inventory.json")
+    testbed_file = getenv("CIVLAB_NETDEVICE_DATA")
+    appliance_file = getenv("CIVLAB_APPLIANCE_DATA")
+    print(f"Compiling inventory to {path}")
+    save_inventory(compile_inventory(testbed_file, appliance_file), path)
@@ -1,8 +1,119 @@
 import logging
+from collections import OrderedDict
+from threading import Lock, Thread
+from time import monotonic
+from typing import TYPE_CHECKING, Callable
 from ciscoisesdk import IdentityServicesEngineAPI
 from ciscoisesdk.exceptions import ciscoisesdkException, ApiError
 from .appliance import ApplianceAPI
 
+if TYPE_CHECKING:
+    from aiohttp import ClientSession
+
+
+logger = logging.getLogger("civlab_api")
+
+# Seconds ISE API results are cached for
+LAST_STATUS_TTL = 30
+REPO_FILES_TTL = 300
+REPO_TTL = 300
+
+
+class TTLCache:
+    """Thread-safe cache of API results, each with its own TTL
+
+    A result is fetched by one caller at a time, others wait for it. In
+    the last refresh_ahead part of its TTL a result is still served, and
+    refreshed in the background, so busy keys never make callers wait.
+    The least recently used results are dropped past maxsize.
+    """
+
+    def __init__(self, maxsize: int = 64, refresh_ahead: float = 0.2) -> None:
+        self.maxsize = maxsize
+        self.refresh_ahead = refresh_ahead
+        # key to [value, fetched, ttl, refreshing]
+        self._entries = OrderedDict()
+        self._fetch_locks = {}
+        self._lock = Lock()
+
+    def get(self, key, fetch: Callable, ttl: float):
+        """Cached result of fetch, calling it if there is none or it expired
+
+        Args:
+            key: cache key
+            fetch (Callable): gets the result, exceptions are raised to the
+                caller and not cached
+            ttl (float): Seconds the result is served for
+        """
+        with self._lock:
+            value, found = self._lookup(key, fetch)
+            if found:
+                return value
+            fetch_lock = self._fetch_locks.setdefault(key, Lock())
+        with fetch_lock:
+            with self._lock:
+                value, found = self._lookup(key, fetch)
+            if found:
+                return value
+            value = fetch()
+            self._store(key, value, ttl)
+            return value
+
+    async def aget(self, key, fetch: Callable, ttl: float, refresh: Callable = None):
+        """Like get, for a fetch that is a coroutine function
+
+        Async fetches of a key aren't serialized. A result in the refresh
+        ahead part of its TTL is only refreshed if refresh is given, it is
+        called in the background like the fetch of get.
+        """
+        with self._lock:
+            value, found = self._lookup(key, refresh)
+        if found:
+            return value
+        value = await fetch()
+        self._store(key, value, ttl)
+        return value
+
+    def invalidate(self, key) -> None:
+        """Drop a cached result, the next get fetches it"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _lookup(self, key, fetch: Callable) -> tuple:
+        """Fresh cached value of key and whether there is one, hold _lock"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        value, fetched, ttl, refreshing = entry
+        age = monotonic() - fetched
+        if age >= ttl:
+            return None, False
+        self._entries.move_to_end(key)
+        if fetch and age >= ttl * (1 - self.refresh_ahead) and not refreshing:
+            entry[3] = True
+            Thread(target=self._refresh, args=(key, fetch, ttl), daemon=True).start()
+        return value, True
+
+    def _refresh(self, key, fetch: Callable, ttl: float) -> None:
+        try:
+            value = fetch()
+        except Exception as e:
+            logger.info(f"Refreshing {key} failed: {e}")
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry[3] = False
+            return
+        self._store(key, value, ttl)
+
+    def _store(self, key, value, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = [value, monotonic(), ttl, False]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                old, _ = self._entries.popitem(last=False)
+                self._fetch_locks.pop(old, None)
+
 
 class ISE(ApplianceAPI):
     def __init__(
@@ -18,6 +129,8 @@ class ISE(ApplianceAPI):
             verify=False,
         )
         self._logger = logging.getLogger("civlab_api")
+        # ISE is slow and rate limited, shared by every caller of this client
+        self._cache = TTLCache()
 
     def get_status(self) -> dict:
         result = {
@@ -27,18 +140,64 @@ class ISE(ApplianceAPI):
             "host": self.host,
         }
         try:
-            r = self._api.backup_and_restore.get_last_status()
+            status_code, resp = self._cache.get(
+                "last_status", self._get_last_status, LAST_STATUS_TTL
+            )
         except (ciscoisesdkException, ApiError) as e:
             result["status"] = str(e)
             return result
-        resp = r.response
-        self._logger.debug(f"ISE response: {r.status_code} {resp}")
-        if r.status_code == 200:
-            result["last_restore"] = resp.response.startDate
-            result["restore_file"] = resp.response.name
-            result["status"] = f"{resp.response.action} {resp.response.status}"
+        return self._parse_last_status(status_code, resp, result)
+
+    async def get_status_async(self, session: "ClientSession") -> dict:
+        """Like get_status, on an aiohttp session
+
+        Shares the cached last status with get_status, which refreshes it
+        ahead of expiry.
+
+        Args:
+            session (ClientSession): session to make the request on
+        """
+        from aiohttp import BasicAuth
+
+        result = {
+            "last_restore": "",
+            "restore_file": "",
+            "status": "",
+            "host": self.host,
+        }
+        path = f"{self._base_url}/api/v1/backup-restore/config/last-backup-status"
+
+        async def fetch():
+            self._logger.info(f"GET {path}")
+            async with session.get(
+                path,
+                auth=BasicAuth(self.username, self.password),
+                headers={"Accept": "application/json"},
+                ssl=False,
+            ) as r:
+                resp = await r.json(content_type=None)
+            self._logger.debug(f"ISE response: {r.status} {resp}")
+            return r.status, resp
+
+        status_code, resp = await self._cache.aget(
+            "last_status", fetch, LAST_STATUS_TTL, refresh=self._get_last_status
+        )
+        return self._parse_last_status(status_code, resp, result)
+
+    def _get_last_status(self) -> tuple:
+        """Status code and body of the last backup or restore status"""
+        r = self._api.backup_and_restore.get_last_status()
+        self._logger.debug(f"ISE response: {r.status_code} {r.response}")
+        return r.status_code, r.response
+
+    def _parse_last_status(self, status_code: int, resp: dict, result: dict) -> dict:
+        if status_code == 200:
+            last = resp["response"]
+            result["last_restore"] = last["startDate"]
+            result["restore_file"] = last["name"]
+            result["status"] = f"{last['action']} {last['status']}"
         else:
-            result["status"] = resp
+            result["status"] = str(resp)
         return result
 
     def reset(self, backup_file: str, backup_repo: str, backup_key: str) -> tuple:
@@ -56,17 +215,26 @@ class ISE(ApplianceAPI):
         resp = r.response
         self._logger.debug(f"ISE response: {r.status_code} {resp}")
         if r.status_code == 202:
+            # The last status is now the restore
+            self._cache.invalidate("last_status")
             return True, resp.response.message
         else:
             return False, resp.message
 
     def _check_backup_file(self, file, repo) -> bool:
-        r = self._api.repository.get_files(repo)
-        resp = r.response.response
-        if file in resp:
+        if file in self._get_repo_files(repo):
             return True
-        else:
-            return False
+        # The file may be new since the listing was cached
+        self._cache.invalidate(("files", repo))
+        return file in self._get_repo_files(repo)
+
+    def _get_repo_files(self, repo) -> list:
+        r = self._cache.get(
+            ("files", repo),
+            lambda: self._api.repository.get_files(repo),
+            REPO_FILES_TTL,
+        )
+        return r.response.response
 
     def update_repo_pass(self, name, password) -> tuple:
         """Update the ISE repo password"""
@@ -88,12 +256,17 @@ class ISE(ApplianceAPI):
         resp = r.response
         self._logger.debug(f"ISE response: {r.status_code} {resp}")
         if r.status_code == 200:
+            self._cache.invalidate(("repository", name))
             return True, resp.success.message
         else:
             return False, resp.error.message
 
     def get_repo(self, name) -> dict:
         self._logger.info(f"Getting ISE repo {name}...")
-        r = self._api.repository.get_repository(name)
+        r = self._cache.get(
+            ("repository", name),
+            lambda: self._api.repository.get_repository(name),
+            REPO_TTL,
+        )
         self._logger.debug(f"ISE response: {r.status_code} {r.response}")
         return r.response.response
@@ -0,0 +1,324 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from re import compile as re_compile
+from time import monotonic
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+from rq import Queue, get_current_job
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from rq.serializers import DefaultSerializer
+
+
+logger = logging.getLogger("civlab_api")
+
+# Workers publish on this channel when a job ends so waiters wake right away
+JOB_CHANNEL_PREFIX = "civlab:job:"
+# Job statuses that mean the job will not make any more progress.
+# None means the job hash is gone, e.g. the result TTL expired.
+JOB_DONE_STATUSES = ("finished", "failed", "stopped", "canceled", None)
+# Job statuses of a job that is still going to run, callers attach to these
+JOB_ACTIVE_STATUSES = ("queued", "started", "deferred", "scheduled")
+# Serializes the check-and-enqueue of a job ID across API processes
+JOB_LOCK_PREFIX = "civlab:lock:"
+
+# Job meta key holding the latest output lines of a long running job
+JOB_PROGRESS_KEY = "progress"
+# Job meta key holding the last percentage seen in the output
+JOB_PERCENT_KEY = "percent"
+# Appended to the job channel for progress published as it happens
+PROGRESS_CHANNEL_SUFFIX = ":progress"
+
+
+def job_channel(job_id: str) -> str:
+    """Name of the pub/sub channel used to announce the end of a job"""
+    return f"{JOB_CHANNEL_PREFIX}{job_id}"
+
+
+def job_progress_channel(job_id: str) -> str:
+    """Name of the pub/sub channel carrying the progress of a job"""
+    return f"{job_channel(job_id)}{PROGRESS_CHANNEL_SUFFIX}"
+
+
+def enqueue_once(
+    queue: Queue,
+    func,
+    job_id: str,
+    reuse_finished: bool = True,
+    lock_timeout: int = 10,
+    **kwargs,
+) -> Job:
+    """Enqueue a job unless a job with the same ID is already in flight
+
+    The lookup and the enqueue run under a Redis lock on the job ID, so
+    concurrent callers never enqueue duplicates or overwrite the hash of a
+    running job. They all get the same job back and share its result.
+
+    Args:
+        queue (Queue): Queue to enqueue on
+        func (Callable): Task to run
+        job_id (str): Job ID, the same for every call with the same task and args
+        reuse_finished (bool): Return a finished job instead of running again
+        lock_timeout (int): Seconds to hold or wait for the lock (default is 10)
+        **kwargs: Passed on to Queue.enqueue
+    Returns:
+        Job: the job in flight, finished or just enqueued
+    """
+    connection = queue.connection
+    lock = connection.lock(
+        f"{JOB_LOCK_PREFIX}{job_id}",
+        timeout=lock_timeout,
+        blocking_timeout=lock_timeout,
+    )
+    with lock:
+        try:
+            job = Job.fetch(job_id, connection=connection)
+            status = job.get_status(refresh=False)
+            if status in JOB_ACTIVE_STATUSES or (
+                reuse_finished and status == "finished"
+            ):
+                logger.info(f"Attaching to job {job_id}: {status}.")
+                return job
+        except NoSuchJobError:
+            pass
+        logger.info(f"Enqueuing job {job_id}.")
+        return queue.enqueue(func, job_id=job_id, **kwargs)
+
+
+def publish_job_done(connection: Redis, job: Job) -> int:
+    """Announce that a job has ended, or another change of its status
+
+    Args:
+        connection (Redis): Redis connection to publish on
+        job (Job): Job that finished or failed
+    Returns:
+        int: number of waiters that received the notification
+    """
+    status = job.get_status(refresh=False)
+    logger.debug(f"Publishing job {job.id} {status}")
+    return connection.publish(job_channel(job.id), str(status))
+
+
+class JobWaiters:
+    """Wakes the job waiters of a process from one pub/sub subscription
+
+    Every job channel is followed with a single pattern subscription, so
+    waiting requests share one Redis connection instead of each opening
+    their own. The subscription starts on first use, and again after it
+    fails. Waiters still re-check job statuses on their own, see
+    async_wait_for_job, so a lost subscription only makes them slower.
+
+    Args:
+        connection (AsyncRedis): asyncio Redis connection to subscribe on
+    """
+
+    def __init__(self, connection: AsyncRedis) -> None:
+        self.connection = connection
+        # job ID to the events of its waiters
+        self._events = {}
+        self._listener = None
+        self._ready = None
+
+    @asynccontextmanager
+    async def waiting(self, job_id: str):
+        """Event set whenever the channel of a job gets a message
+
+        The subscription is sent before the block runs, so a message sent
+        after the block checks the job status is never missed.
+        """
+        event = asyncio.Event()
+        self._events.setdefault(job_id, set()).add(event)
+        try:
+            await self._subscribe()
+            yield event
+        finally:
+            events = self._events[job_id]
+            events.discard(event)
+            if not events:
+                del self._events[job_id]
+
+    async def _subscribe(self) -> None:
+        """Start the subscription unless it runs, and wait for it to be sent"""
+        loop = asyncio.get_running_loop()
+        listener = self._listener
+        if listener is None or listener.done() or listener.get_loop() is not loop:
+            self._ready = loop.create_future()
+            self._listener = asyncio.create_task(self._listen(self._ready))
+        try:
+            await asyncio.shield(self._ready)
+        except Exception as e:
+            logger.info(f"No job notifications, polling job statuses: {e}")
+
+    async def _listen(self, ready: asyncio.Future) -> None:
+        pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.psubscribe(f"{JOB_CHANNEL_PREFIX}*")
+            ready.set_result(None)
+            async for message in pubsub.listen():
+                channel = message["channel"].decode("utf-8")
+                # Progress channels don't match a job ID and are skipped
+                job_id = channel[len(JOB_CHANNEL_PREFIX) :]
+                for event in self._events.get(job_id, ()):
+                    event.set()
+        except Exception as e:
+            logger.info(f"Job notifications stopped: {e}")
+            if not ready.done():
+                ready.set_exception(e)
+        finally:
+            await pubsub.close()
+
+
+async def async_wait_for_job(
+    job_id: str, waiters: JobWaiters, timeout: int = None, poll: int = 10
+) -> str | None:
+    """Await the end of a job without holding a thread
+
+    Waits on the job channel before checking the job status so a
+    notification sent between the check and the wait is never missed.
+    The status is re-checked at least every poll seconds in case a
+    notification is lost, e.g. the worker died before it could publish.
+
+    Args:
+        job_id (str): ID of the job to wait on
+        waiters (JobWaiters): shared subscription to the job channels
+        timeout (int): Seconds to wait before giving up (default is no limit)
+        poll (int): Max seconds between status checks (default is 10)
+    Returns:
+        str: last seen status of the job, None if the job no longer exists
+    """
+    started = monotonic()
+    key = Job.key_for(job_id)
+    async with waiters.waiting(job_id) as woken:
+        while True:
+            woken.clear()
+            status = await waiters.connection.hget(key, "status")
+            status = status.decode("utf-8") if status else None
+            if status in JOB_DONE_STATUSES:
+                break
+            wait = poll
+            if timeout is not None:
+                wait = min(poll, timeout - (monotonic() - started))
+                if wait <= 0:
+                    logger.info(f"Timed out waiting on job {job_id}.")
+                    break
+            logger.info(f"Waiting on job {job_id} to finish...")
+            try:
+                await asyncio.wait_for(woken.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+    return status
+
+
+class JobProgress:
+    """Keeps the latest output lines of the current job in its meta
+
+    Pass an instance as the progress callback of a long running operation,
+    e.g. Appliance._wait_on_restore. The lines show in /v1/job/{jobID}
+    while the job runs, along with the last percentage seen in them. Meta
+    is saved at most every save_every seconds. New lines are also published
+    as they come for /v1/job/{jobID}/events. Outside of a job the lines are
+    only logged.
+
+    Args:
+        lines (int): Number of latest lines to keep (default is 50)
+        save_every (int): Min seconds between saves (default is 2)
+    """
+
+    _percent = re_compile(r"(\d{1,3}(?:\.\d+)?)\s*%")
+
+    def __init__(self, lines: int = 50, save_every: int = 2) -> None:
+        self.job = get_current_job()
+        self.lines = deque(maxlen=lines)
+        self.percent = None
+        self.save_every = save_every
+        self._saved = 0
+
+    def __call__(self, lines: list) -> None:
+        new = []
+        for line in lines:
+            line = line.rstrip()
+            if line:
+                logger.debug(f"Progress: {line}")
+                self.lines.append(line)
+                new.append(line)
+                match = self._percent.search(line)
+                if match and float(match.group(1)) <= 100:
+                    self.percent = float(match.group(1))
+        if self.job is None:
+            return
+        if new:
+            self.publish(new)
+        if monotonic() - self._saved < self.save_every:
+            return
+        self.job.meta[JOB_PROGRESS_KEY] = list(self.lines)
+        self.job.meta[JOB_PERCENT_KEY] = self.percent
+        self.job.save_meta()
+        self._saved = monotonic()
+
+    def publish(self, lines: list) -> None:
+        event = {"lines": lines, "percent": self.percent}
+        try:
+            self.job.connection.publish(
+                job_progress_channel(self.job.id), json.dumps(event)
+            )
+        except Exception as e:
+            logger.debug(f"Failed to publish progress of job {self.job.id}: {e}")
+
+
+def format_sse(event: str, data) -> str:
+    """Format a Server-Sent Event with JSON data"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def job_events(job_id: str, connection: AsyncRedis, keepalive: int = 15):
+    """Yield the status changes and progress of a job until it ends
+
+    Starts with the current status and saved progress, then follows the
+    job and progress channels. The status is re-read on each job channel
+    message and at least every keepalive seconds.
+
+    Args:
+        job_id (str): ID of the job to follow
+        connection (AsyncRedis): asyncio Redis connection to subscribe on
+        keepalive (int): Max seconds between events (default is 15)
+    Yields:
+        tuple: event name and data, ("status", str), ("progress", dict), or
+            ("keepalive", None)
+    """
+    key = Job.key_for(job_id)
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe(job_channel(job_id), job_progress_channel(job_id))
+    try:
+        status, meta = await connection.hmget(key, "status", "meta")
+        status = status.decode("utf-8") if status else None
+        yield "status", status
+        meta = DefaultSerializer.loads(meta) if meta else {}
+        if JOB_PROGRESS_KEY in meta:
+            yield "progress", {
+                "lines": meta[JOB_PROGRESS_KEY],
+                "percent": meta.get(JOB_PERCENT_KEY),
+            }
+        sent = monotonic()
+        while status not in JOB_DONE_STATUSES:
+            message = await pubsub.get_message(timeout=keepalive)
+            if message and message["channel"].decode("utf-8").endswith(
+                PROGRESS_CHANNEL_SUFFIX
+            ):
+                yield "progress", json.loads(message["data"])
+                sent = monotonic()
+                continue
+            last = status
+            status = await connection.hget(key, "status")
+            status = status.decode("utf-8") if status else None
+            if status != last:
+                yield "status", status
+                sent = monotonic()
+            elif monotonic() - sent >= keepalive:
+                # get_message also returns None early, e.g. on subscribing
+                yield "keepalive", None
+                sent = monotonic()
+    finally:
+        await pubsub.close()
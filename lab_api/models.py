@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List
 from pydantic import BaseModel
 
@@ -15,18 +16,24 @@ class NetworkDevice(LabComponentBase):
     default_cfg_on_flash: bool | None = None
     status: str | None = None
     error: str | None = None
+    reset: bool | None = None
+    # How a reset was done, replace or reload, and the seconds it took
+    reset_strategy: str | None = None
+    reset_time: float | None = None
 
 
 class DNACModel(LabComponentBase):
     name: str = "dnac"
     last_restore: str | None = None
     restore_id: str | None = None
+    status: str | None = None
 
 
 class vManageModel(LabComponentBase):
     name: str = "vmanage"
     last_restore: str | None = None
     restore_file: str | None = None
+    status: str | None = None
 
 
 class ISEModel(LabComponentBase):
@@ -46,6 +53,8 @@ class LabStatus(BaseModel):
 
 class StatusResponse(BaseModel):
     status: LabStatus | None = None
+    # Seconds since the status was collected from the lab
+    age: int | None = None
 
 
 # /list response models
@@ -65,6 +74,13 @@ class JobStatus(BaseModel):
     status: str | None = None
     result: str | None = None
     disposition: str | None = None
+    # Latest output lines of a running job, if the task reports them
+    progress: List[str] | None = None
+    # Last percentage seen in the output
+    percent: float | None = None
+    enqueued_at: datetime | None = None
+    started_at: datetime | None = None
+    ended_at: datetime | None = None
 
 
 class JobError(BaseModel):
@@ -78,8 +94,42 @@ class JobResponse(BaseModel):
 
 class MultiJobResponse(BaseModel):
     responses: List[JobResponse]
+    # Set when the jobs run as one orchestration, see /v1/orchestration
+    orchestration: str | None = None
+
+
+class OrchestrationNode(BaseModel):
+    name: str
+    status: str | None = None
+    depends_on: List[str] = []
+    # Dependencies a node job already in flight was started without
+    ignored_depends_on: List[str] = []
+    # Seconds the node ran, and expected seconds until it ends
+    elapsed: float | None = None
+    eta: float | None = None
+
+
+class OrchestrationStatus(BaseModel):
+    id: str
+    status: str
+    elapsed: float
+    # Expected seconds until the last node ends, following the critical path
+    eta: float
+    critical_path: List[str]
+    nodes: List[OrchestrationNode]
+
+
+class OrchestrationResponse(BaseModel):
+    orchestration: OrchestrationStatus
 
 
 # /reset response model
 class ResetResponse(BaseModel):
     reset: bool | None = None
+
+
+# REQUEST MODELS
+
+# /jobs request model
+class JobsRequest(BaseModel):
+    ids: List[str]
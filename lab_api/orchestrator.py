@@ -0,0 +1,295 @@
+import json
+import logging
+from datetime import datetime, timezone
+from time import time
+from typing import Callable, NamedTuple
+from uuid import uuid4
+from redis import Redis
+from rq import Queue
+from rq.job import Job
+from .jobs import enqueue_once
+
+
+logger = logging.getLogger("civlab_api")
+
+# Hash of an orchestration: its plan, and the end state of each node as
+# recorded by the worker
+ORCH_KEY_PREFIX = "civlab:orch:"
+# Measured durations of each plan node, newest first
+NODE_TIMES_KEY_PREFIX = "civlab:orch:times:"
+# Hash of the orchestrations a node job is part of, to its node name.
+# Kept out of the job meta, which the worker saves over with progress.
+ORCH_JOB_KEY_PREFIX = "civlab:orch:job:"
+# Seconds an orchestration can be looked up for
+ORCH_TTL = 86400
+# Node statuses that mean the node won't run or didn't succeed
+FAILED_STATUSES = ("failed", "stopped", "canceled", "blocked", "expired")
+ACTIVE_STATUSES = ("queued", "started", "deferred", "scheduled")
+
+
+class PlanNode(NamedTuple):
+    """A step of an orchestration plan, run as one job"""
+
+    task: Callable
+    job_id: str
+    # Names of the nodes that must finish before this one starts
+    depends_on: tuple = ()
+    # Seconds the step is expected to take, until durations are recorded
+    expected: int = 600
+    # Max items the task works on at once, passed to it as max_workers
+    concurrency: int = None
+    timeout: str = "1h"
+
+
+def orchestration_key(id: str) -> str:
+    """Name of the hash holding an orchestration"""
+    return f"{ORCH_KEY_PREFIX}{id}"
+
+
+def orchestration_job_key(job_id: str) -> str:
+    """Name of the hash of the orchestrations a job is a node of"""
+    return f"{ORCH_JOB_KEY_PREFIX}{job_id}"
+
+
+def node_times_key(name: str) -> str:
+    """Name of the list holding the measured durations of a plan node"""
+    return f"{NODE_TIMES_KEY_PREFIX}{name}"
+
+
+def plan_order(depends_on: dict) -> list:
+    """Order node names so each comes after the nodes it depends on
+
+    Args:
+        depends_on (dict): node name to names of the nodes it depends on
+    Returns:
+        list: node names
+    Raises:
+        ValueError: if a dependency is unknown or the plan has a cycle
+    """
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Plan has a cycle through {name}")
+        if name not in depends_on:
+            raise ValueError(f"Plan has no node {name}")
+        visiting.add(name)
+        for dep in depends_on[name]:
+            visit(dep)
+        order.append(name)
+
+    for name in depends_on:
+        visit(name)
+    return order
+
+
+def start_orchestration(
+    queue: Queue, plan: dict, result_ttl: int = 600, ttl: int = ORCH_TTL
+) -> tuple:
+    """Enqueue the nodes of a plan, each depending on the jobs before it
+
+    Nodes already in flight are attached to instead of enqueued again. A
+    job in flight that doesn't wait on the same dependencies runs without
+    them, they are kept as ignored_depends_on of its node.
+
+    Args:
+        queue (Queue): Queue to enqueue the node jobs on
+        plan (dict): node name to PlanNode
+        result_ttl (int): Seconds node job results are kept
+        ttl (int): Seconds the orchestration can be looked up for
+    Returns:
+        tuple:
+            (str) Orchestration ID
+            (dict) node name to Job
+    """
+    id = uuid4().hex
+    jobs = {}
+    nodes = {}
+    for name in plan_order({name: node.depends_on for name, node in plan.items()}):
+        node = plan[name]
+        deps = [jobs[dep] for dep in node.depends_on]
+        # Join the job before enqueueing, so the worker credits this run
+        # even if the job ends right after it is attached to
+        join_key = orchestration_job_key(node.job_id)
+        with queue.connection.pipeline() as pipe:
+            pipe.hset(join_key, id, name)
+            pipe.expire(join_key, ttl)
+            pipe.execute()
+        job = enqueue_once(
+            queue,
+            node.task,
+            node.job_id,
+            reuse_finished=False,
+            kwargs={"max_workers": node.concurrency} if node.concurrency else None,
+            depends_on=deps or None,
+            job_timeout=node.timeout,
+            result_ttl=result_ttl,
+        )
+        waits_on = job._dependency_ids or []
+        nodes[name] = {
+            "job_id": job.id,
+            "depends_on": [dep for dep in node.depends_on if jobs[dep].id in waits_on],
+            "expected": node.expected,
+        }
+        ignored = [dep for dep in node.depends_on if jobs[dep].id not in waits_on]
+        if ignored:
+            logger.info(f"Attached to {job.id} in flight, not waiting on {ignored}")
+            nodes[name]["ignored_depends_on"] = ignored
+        jobs[name] = job
+    record = {"created": time(), "nodes": {name: nodes[name] for name in plan}}
+    key = orchestration_key(id)
+    with queue.connection.pipeline() as pipe:
+        pipe.hset(key, "plan", json.dumps(record))
+        pipe.expire(key, ttl)
+        pipe.execute()
+    logger.info(f"Started orchestration {id}: {list(jobs)}")
+    return id, jobs
+
+
+def record_orchestration_node(connection: Redis, job: Job, keep: int = 20) -> None:
+    """Record the end state of a job that is a node of orchestrations
+
+    Called by the worker when a job finishes or fails, so the state outlives
+    the job result.
+
+    Args:
+        connection (Redis): Redis connection
+        job (Job): Job that ended
+        keep (int): Number of measured durations kept per node
+    """
+    key = orchestration_job_key(job.id)
+    with connection.pipeline() as pipe:
+        pipe.hgetall(key)
+        pipe.delete(key)
+        orchestrations, _ = pipe.execute()
+    if not orchestrations:
+        return
+    orchestrations = {
+        id.decode("utf-8"): name.decode("utf-8") for id, name in orchestrations.items()
+    }
+    state = {
+        "status": job.get_status(refresh=False),
+        "started_at": _timestamp(job.started_at),
+        "ended_at": _timestamp(job.ended_at),
+    }
+    with connection.pipeline() as pipe:
+        for id, name in orchestrations.items():
+            key = orchestration_key(id)
+            pipe.hset(key, f"node:{name}", json.dumps(state))
+            pipe.expire(key, ORCH_TTL)
+        elapsed = _elapsed(state, None)
+        if state["status"] == "finished" and elapsed is not None:
+            times = node_times_key(next(iter(orchestrations.values())))
+            pipe.lpush(times, elapsed)
+            pipe.ltrim(times, 0, keep - 1)
+        pipe.execute()
+
+
+def orchestration_status(connection: Redis, id: str) -> dict | None:
+    """Report the state of an orchestration
+
+    Args:
+        connection (Redis): Redis connection
+        id (str): Orchestration ID
+    Returns:
+        dict:
+            id, status, elapsed and eta in seconds, the critical_path of
+            node names, and nodes: name to status, depends_on, elapsed and
+            eta of each node
+        None if there is no such orchestration
+    """
+    fields = connection.hgetall(orchestration_key(id))
+    if b"plan" not in fields:
+        return None
+    record = json.loads(fields[b"plan"])
+    nodes = record["nodes"]
+    jobs = Job.fetch_many(
+        [node["job_id"] for node in nodes.values()], connection=connection
+    )
+    now = time()
+    states = {}
+    for name, job in zip(nodes, jobs):
+        ended = fields.get(f"node:{name}".encode("utf-8"))
+        states[name] = json.loads(ended) if ended else _job_state(job)
+    order = plan_order({name: node["depends_on"] for name, node in nodes.items()})
+    finish = {}
+    for name in order:
+        state = states[name]
+        deps = nodes[name]["depends_on"]
+        if state["status"] == "deferred" and any(
+            states[dep]["status"] in FAILED_STATUSES for dep in deps
+        ):
+            state["status"] = "blocked"
+        state["depends_on"] = deps
+        state["ignored_depends_on"] = nodes[name].get("ignored_depends_on", [])
+        state["elapsed"] = _elapsed(state, now)
+        state["eta"] = _remaining(connection, name, nodes[name], state)
+        start = max((finish[dep] for dep in deps), default=0)
+        finish[name] = start + state["eta"]
+    return {
+        "id": id,
+        "status": _overall_status([state["status"] for state in states.values()]),
+        "elapsed": round(now - record["created"], 1),
+        "eta": round(max(finish.values(), default=0), 1),
+        "critical_path": _critical_path(nodes, finish),
+        "nodes": states,
+    }
+
+
+def _job_state(job: Job | None) -> dict:
+    if job is None:
+        return {"status": "expired"}
+    return {
+        "status": job.get_status(refresh=False),
+        "started_at": _timestamp(job.started_at),
+        "ended_at": _timestamp(job.ended_at),
+    }
+
+
+def _elapsed(state: dict, now: float | None) -> float | None:
+    """Seconds a node ran, up to now if it hasn't ended"""
+    started = state.get("started_at")
+    ended = state.get("ended_at") or now
+    if not started or not ended:
+        return None
+    return round(ended - started, 1)
+
+
+def _remaining(connection: Redis, name: str, node: dict, state: dict) -> float:
+    """Expected seconds until a node ends"""
+    if state["status"] not in ACTIVE_STATUSES:
+        return 0
+    times = [float(t) for t in connection.lrange(node_times_key(name), 0, -1)]
+    expected = sum(times) / len(times) if times else node["expected"]
+    if state["status"] == "started":
+        return round(max(expected - (state["elapsed"] or 0), 0), 1)
+    return round(expected, 1)
+
+
+def _critical_path(nodes: dict, finish: dict) -> list:
+    """Chain of nodes ending last, following the dependency ending last"""
+    path = []
+    names = list(nodes)
+    while names:
+        name = max(names, key=lambda n: finish[n])
+        path.insert(0, name)
+        names = nodes[name]["depends_on"]
+    return path
+
+
+def _overall_status(statuses: list) -> str:
+    if all(status == "finished" for status in statuses):
+        return "finished"
+    if any(status in ACTIVE_STATUSES for status in statuses):
+        return "started"
+    return "failed"
+
+
+def _timestamp(dt: datetime | None) -> float | None:
+    """Epoch seconds of a naive UTC datetime, as RQ stores job times"""
+    if dt is None:
+        return None
+    return dt.replace(tzinfo=timezone.utc).timestamp()
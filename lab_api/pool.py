@@ -0,0 +1,176 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic
+from genie.libs.conf.testbed import Testbed
+from pyats.topology.device import Device
+
+# Results a job leaves on a device, cleared so the next job doesn't report them
+JOB_ATTRIBUTES = (
+    "status",
+    "default_config_exists",
+    "running_default_diff",
+    "reset",
+    "reset_strategy",
+    "reset_time",
+    "error",
+)
+
+
+class DevicePool:
+    """Keeps network device connections open between jobs
+
+    Only useful in a worker that doesn't fork per job (see
+    lab_api.worker.PooledWorker), a forked work horse closes its
+    connections at the end of each job.
+    """
+
+    def __init__(
+        self, testbed: Testbed, idle_timeout: int = 300, check_after: int = 30
+    ) -> None:
+        self.testbed = testbed
+        # Seconds a connection may go unused before it is closed
+        self.idle_timeout = idle_timeout
+        # Seconds unused after which a connection is probed before reuse
+        self.check_after = check_after
+        self._last_used = {}
+        self._in_use = set()
+        self._locks = {name: Lock() for name in testbed.devices}
+        self._logger = logging.getLogger("civlab_api")
+
+    @contextmanager
+    def connection(self, device: Device) -> Device:
+        """Use a live connection to a device
+
+        The connection is dropped if the block raises, so the next use
+        reconnects.
+
+        args:
+            device: device from the pool testbed
+        """
+        self.checkout(device)
+        try:
+            yield device
+        except Exception:
+            self.discard(device)
+            raise
+        self.release(device)
+
+    @contextmanager
+    def connections(self, devices, max_workers: int = None) -> None:
+        """Use live connections to several devices
+
+        A device that fails to connect doesn't stop the others, its error
+        is kept on device.error. Devices that have an error set when the
+        block exits are dropped.
+
+        args:
+            devices: iterable of devices from the pool testbed, e.g. a DeviceLab
+            max_workers: devices connected to at a time, defaults to the
+                max_workers of devices, as DeviceLab has, or of the testbed
+        """
+        max_workers = (
+            max_workers
+            or getattr(devices, "max_workers", None)
+            or int(self.testbed.custom.get("max_workers", 1))
+        )
+        devices = list(devices)
+        max_workers = max(min(max_workers, len(devices)), 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(self._try_checkout, devices))
+        try:
+            yield
+        except Exception:
+            for device in devices:
+                self.discard(device)
+            raise
+        for device in devices:
+            if getattr(device, "error", None):
+                self.discard(device)
+            else:
+                self.release(device)
+
+    def checkout(self, device: Device) -> Device:
+        """Make sure a device is connected and its connection healthy
+
+        Results left on the device by an earlier job are cleared, see
+        JOB_ATTRIBUTES.
+
+        args:
+            device: device from the pool testbed
+        returns: the connected device
+        """
+        for attr in JOB_ATTRIBUTES:
+            setattr(device, attr, None)
+        with self._locks[device.name]:
+            if not self.is_healthy(device):
+                self._logger.info(f"Connecting to: {device.name}")
+                self._disconnect(device)
+                device.connect()
+            self._last_used[device.name] = monotonic()
+            self._in_use.add(device.name)
+        return device
+
+    def _try_checkout(self, device: Device) -> None:
+        try:
+            self.checkout(device)
+        except Exception as e:
+            self._logger.error(f"Failed to connect to {device.name}: {e}")
+            device.error = str(e)
+
+    def release(self, device: Device) -> None:
+        """Hand a device back to the pool, keeping it connected"""
+        self._last_used[device.name] = monotonic()
+        self._in_use.discard(device.name)
+
+    def discard(self, device: Device) -> None:
+        """Close a device connection that may be broken"""
+        self._logger.info(f"Dropping connection to: {device.name}")
+        with self._locks[device.name]:
+            self._disconnect(device)
+            self._in_use.discard(device.name)
+
+    def is_healthy(self, device: Device) -> bool:
+        """Check the device is connected, probing it if unused for a while"""
+        if not device.is_connected():
+            return False
+        idle = monotonic() - self._last_used.get(device.name, 0)
+        if idle < self.check_after:
+            return True
+        try:
+            device.execute("")
+        except Exception as e:
+            self._logger.info(f"Health check failed for {device.name}: {e}")
+            return False
+        return True
+
+    def evict_idle(self) -> None:
+        """Close connections unused for longer than the idle timeout"""
+        now = monotonic()
+        for name, last_used in list(self._last_used.items()):
+            if now - last_used < self.idle_timeout or name in self._in_use:
+                continue
+            lock = self._locks[name]
+            # Skip devices being checked out
+            if lock.acquire(blocking=False):
+                try:
+                    self._logger.info(f"Closing idle connection to: {name}")
+                    self._disconnect(self.testbed.devices[name])
+                finally:
+                    lock.release()
+
+    def close(self) -> None:
+        """Close every connection in the pool"""
+        for device in self.testbed:
+            self.discard(device)
+
+    def _disconnect(self, device: Device) -> None:
+        self._last_used.pop(device.name, None)
+        try:
+            if device.is_connected():
+                device.disconnect()
+        except Exception as e:
+            self._logger.debug(f"Error disconnecting {device.name}: {e}")
+            # Forget the connection so the next connect starts fresh
+            device.destroy()
@@ -1,15 +1,17 @@
 import logging
+import requests
 from vmanage.api.authentication import Authentication
-from vmanage.api.http_methods import HttpMethods
+from vmanage.api.http_methods import STANDARD_HEADERS, STANDARD_TIMEOUT
 from .appliance import ApplianceAPI
 
 
 class vManage(ApplianceAPI):
+    # Sessions time out after 30 minutes idle
+    auth_ttl = 1500
+
     def __init__(self, host: str, username: str, password: str, port: str = "443"):
         super().__init__(host, username, password, port)
-        self._session = Authentication(
-            host=self.host, user=self.username, password=self.password
-        ).login()
+        self._session = None
         self._base_url = f"https://{self.host}:{self.port}/dataservice/"
         self._logger = logging.getLogger("civlab_api")
 
@@ -19,12 +21,58 @@ class vManage(ApplianceAPI):
     def reset(self) -> tuple:
         pass
 
+    def _auth(self) -> None:
+        self._session = Authentication(
+            host=self.host, user=self.username, password=self.password
+        ).login()
+
+    def _unauthorized(self, resp: requests.Response) -> bool:
+        # An expired session is often answered with the login page and a 200
+        return (
+            resp.status_code == 401
+            or resp.headers.get("Content-Type", "").startswith("text/html")
+            or "j_security_check" in resp.text
+        )
+
+    def _request(self, method: str, url: str, payload: dict = None) -> dict:
+        """Make a request on the logged in session
+
+        Made on the session directly, the SDK HttpMethods raises on the
+        login page before it can be told apart from other errors.
+
+        Returns:
+            dict: status_code, json, error and response, like the SDK
+                HttpMethods.request
+        """
+        resp = self.call(
+            lambda: self._session.request(
+                method,
+                url,
+                headers=STANDARD_HEADERS,
+                data=payload,
+                timeout=STANDARD_TIMEOUT,
+            )
+        )
+        result = {
+            "status_code": resp.status_code,
+            "json": None,
+            "error": None,
+            "response": resp,
+        }
+        if self._unauthorized(resp):
+            result["error"] = f"Login to {self.host} rejected"
+        elif not resp.ok:
+            result["error"] = f"Error {resp.status_code}: {resp.text}"
+        elif resp.text:
+            result["json"] = resp.json()
+        return result
+
     def _get_back_up_list(self) -> list:
         url = f"{self._base_url}backup/list"
-        r = HttpMethods(self._session, url).request("GET")
+        r = self._request("GET", url)
         # {'status_code': 200, 'status': 'ok', 'details': None, 'error': None,
         # 'json': {'backupList': []}, 'response': <Response [200]>}
-        if r["status_code"] == 200:
+        if r["error"] is None and r["status_code"] == 200:
             return r["json"]["backupList"]
         else:
             return r["error"]
@@ -32,5 +80,5 @@ class vManage(ApplianceAPI):
     def _request_backup(self):
         url = f"{self._base_url}backup/export"
         payload = {}
-        r = HttpMethods(self._session, url).request("POST", payload=payload)
+        r = self._request("POST", url, payload=payload)
         return r
@@ -1,11 +1,21 @@
 import logging
+from codecs import getincrementaldecoder
+from contextlib import contextmanager
+from datetime import datetime
+from re import DOTALL
 from re import compile as re_compile
-from time import sleep
+from select import select
+from threading import Lock, RLock
+from time import monotonic, sleep
 from socket import error as socket_error
+from typing import Callable
 # from abc import ABC
 import paramiko
 from genie.libs.conf.testbed import Testbed
 from pyats.topology.device import Device
+from redis import Redis
+from redis.exceptions import RedisError
+from .cache import load_appliance_generation
 # from ciscoisesdk import IdentityServicesEngineAPI
 # from ciscoisesdk.exceptions import ciscoisesdkException, ApiError
 
@@ -120,6 +130,14 @@ class Appliance:
         self._shell = None
         self._last_cmd = None
         self._logout_cmd = "exit"
+        # Seconds between SSH keepalives so idle sessions stay open
+        self._keepalive = 30
+        # Serializes use of the shell, one command and response at a time
+        self._lock = RLock()
+        # End of output that means the appliance is waiting for input
+        self._prompt = re_compile(r"[#$>]\s*$")
+        # Bytes read off the channel per recv
+        self._read_chunk = 4096
 
     def get_status():
         # Implement in child class
@@ -152,6 +170,7 @@ class Appliance:
     def _connect_ssh(self) -> bool:
         """Connect via Paramiko client and invoke a shell"""
         self._ssh.connect(self.host, self.port, self.username, self.password)
+        self._ssh.get_transport().set_keepalive(self._keepalive)
         self._shell = self._ssh.invoke_shell()
         return True
 
@@ -178,17 +197,24 @@ class Appliance:
     def _check_connection(self) -> bool:
         try:
             if self._shell.closed is False:
-                return True
+                transport = self._ssh.get_transport()
+                return transport is not None and transport.is_active()
         except AttributeError:
-            return False
+            pass
+        return False
 
-    def _send_command(self, cmd: str, bytes: int = 20000, wait: int = 4) -> str:
+    def _send_command(
+        self, cmd: str, bytes: int = 20000, wait: int = 30, prompt=None
+    ) -> str:
         """Sends commands via ssh shell
 
         Args:
             cmd (str): Command to send to the shell
-            wait (int): Time in seconds to wait after sending the command
-                (default is 4)
+            bytes (int): Max bytes of response to read (default is 20000)
+            wait (int): Max seconds to wait for the prompt after sending the
+                command (default is 30)
+            prompt (Pattern): Compiled regex marking the end of the response
+                (default is the appliance prompt)
 
         Returns:
             str: response read off the ssh shell decoded in utf-8
@@ -198,11 +224,14 @@ class Appliance:
             self._last_cmd = cmd
             cmd = cmd + "\n"
             self.last_cmd = cmd
-            sent_bytes = self._shell.send(cmd)
-            # Confirm entire command was sent to the shell
-            assert sent_bytes == len(cmd.encode("utf-8"))
-            # Read bytes off channel
-            resp = self._read_shell(bytes=bytes, wait=wait)
+            with self._lock:
+                # Output left from earlier, e.g. a banner, isn't the response
+                self._drain_shell()
+                sent_bytes = self._shell.send(cmd)
+                # Confirm entire command was sent to the shell
+                assert sent_bytes == len(cmd.encode("utf-8"))
+                # Read bytes off channel
+                resp = self._read_shell(bytes=bytes, wait=wait, prompt=prompt)
             logger.info("Response:")
             logger.info(resp)
             # Return decoded bytes as str
@@ -215,16 +244,52 @@ class Appliance:
         ) as error:
             return error
 
-    def _read_shell(self, bytes: int = 20000, wait: int = 4) -> str:
-        """Read bytes off of ssh shell, decode in utf-8"""
+    def _read_shell(self, bytes: int = 20000, wait: int = 30, prompt=None) -> str:
+        """Read off of ssh shell until the prompt shows up, decode in utf-8
+
+        Returns as soon as the end of the output matches the prompt, bytes
+        have been read or wait seconds have passed, whichever comes first.
+
+        Args:
+            bytes (int): Max bytes to read (default is 20000)
+            wait (int): Max seconds to wait for the prompt (default is 30)
+            prompt (Pattern): Compiled regex marking the end of the output
+                (default is the appliance prompt)
+
+        Returns:
+            str: output read off the ssh shell decoded in utf-8
+        """
         logger.info("Reading from shell channel...")
-        if wait > 0:
-            sleep(wait)
-        else:
+        prompt = prompt or self._prompt
+        deadline = monotonic() + wait
+        chunks = []
+        size = 0
+        while size < bytes:
+            if not self._shell.recv_ready():
+                remaining = deadline - monotonic()
+                if remaining <= 0 or self._shell.closed:
+                    break
+                # Sleep until data arrives or the deadline passes
+                select([self._shell], [], [], remaining)
+                continue
+            chunk = self._shell.recv(min(self._read_chunk, bytes - size))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            # Only the tail can hold the prompt
+            tail = b"".join(chunks[-2:])[-512:].decode("utf-8", errors="ignore")
+            if prompt.search(tail):
+                break
+        if not chunks:
             return "Shell read timeout. No data received on shell/channel."
-        if self._shell.recv_ready():
-            return self._shell.recv(bytes).decode("utf-8")
-        return self._read_shell(bytes, wait // 2)
+        return b"".join(chunks).decode("utf-8", errors="replace")
+
+    def _drain_shell(self) -> None:
+        """Discard output waiting on the ssh shell"""
+        while self._shell.recv_ready():
+            if not self._shell.recv(self._read_chunk):
+                break
 
     def _wait_on_restore(
         self,
@@ -232,16 +297,23 @@ class Appliance:
         fail_substr: str,
         wait: int = 180,
         interval: int = 1,
+        progress: Callable = None,
+        buffer: int = 100000,
     ) -> tuple:
-        """Waits on response from shell and checks if the success sub string arg is present.
-        wait is seconds to wait per interval.
+        """Watches the restore output on the shell until it succeeds or fails.
+        Gives up after wait * interval seconds.
+
+        Output is read as it arrives and searched incrementally, so a sub
+        string split across reads is found and the result is known as soon
+        as it is printed.
 
         Args:
-            started_substr (str): Sub string indicating the restore has started
             success_substr (str): Sub string that will be in response for a success
             fail_substr (str): Sub string that will be in response for a failure
-            wait (int): Seconds to wait for response
+            wait (int): Seconds to wait per interval
             interval (int): Number of times to wait
+            progress (Callable): Called with each batch of complete output lines
+            buffer (int): Characters of recent output to keep (default is 100000)
         Returns:
             tuple:
                 (bool) If restore was successful or not
@@ -249,26 +321,39 @@ class Appliance:
         """
         total_wait_time_mins = str(wait * interval // 60)
         logger.info(f"Waiting for restore operation for {total_wait_time_mins} mins")
-        while interval > 0:
-            wait_time_left = str(wait * interval // 60)
-            logger.debug(f"Waiting {wait_time_left} more minutes until timeout.")
-            sleep(wait)
-            logger.info("Checking if restore complete...")
-            # Read 100K bytes off the channel because when restoring
-            # there's a lot of output
-            logger.info("Reading from channel...")
-            resp = self._read_shell(bytes=100000)
-            logger.debug(resp)
-            if success_substr in resp:
+        deadline = monotonic() + wait * interval
+        decoder = getincrementaldecoder("utf-8")(errors="replace")
+        overlap = max(len(success_substr), len(fail_substr))
+        # Rolling buffer of the most recent restore output
+        self.restore_output = ""
+        line = ""
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0 or self._shell.closed:
+                break
+            if not self._shell.recv_ready():
+                select([self._shell], [], [], min(remaining, wait))
+                continue
+            data = self._shell.recv(self._read_chunk)
+            if not data:
+                break
+            chunk = decoder.decode(data)
+            # Include the end of earlier output to catch split sub strings
+            search = self.restore_output[-overlap:] + chunk
+            self.restore_output = (self.restore_output + chunk)[-buffer:]
+            lines = (line + chunk).split("\n")
+            line = lines.pop()
+            if progress and lines:
+                progress(lines)
+            if success_substr in search:
                 logger.info("Restore successful.")
                 return True, "Restore successful."
-            elif fail_substr in resp:
+            elif fail_substr in search:
                 logger.info("Restore failed.")
                 return False, "Restore failed."
-            interval -= 1
         logger.info("Determining restore status timed out.")
         return False, "Timeout. Restore may or may not be successful."
-    
+
     def str_has_time(self, s: str) -> bool:
         pattern = re_compile(r".*\d:\d\d:\d\d.*")
         if pattern.match(s):
@@ -277,6 +362,86 @@ class Appliance:
             return False
 
 
+class ApplianceSessionPool:
+    """Keeps one connected shell per appliance between jobs
+
+    Sessions are logged in once, so repeated commands skip connecting and
+    the prompt handling in _do_after_connect. A session is used by one
+    caller at a time and reconnected when _check_connection finds it dead,
+    or when the appliance generation in Redis changed since it was opened,
+    see lab_api.cache.bump_appliance_generation. Only useful in a worker
+    that doesn't fork per job.
+    """
+
+    def __init__(self, factory: Callable, connection: Redis = None) -> None:
+        # Builds a disconnected appliance object from its name
+        self._factory = factory
+        # Redis connection to read appliance generations from, None to not
+        self._connection = connection
+        self._sessions = {}
+        self._generations = {}
+        self._lock = Lock()
+
+    @contextmanager
+    def session(self, name: str) -> Appliance:
+        """Use the live session to an appliance
+
+        The session is dropped if the block raises, so the next use
+        reconnects.
+
+        Args:
+            name (str): Appliance name, e.g. dnac
+        """
+        generation = self._load_generation(name)
+        with self._lock:
+            appliance = self._sessions.get(name)
+            if appliance is not None and self._generations[name] != generation:
+                logger.info(f"Session to {name} is from before a reset")
+                stale = self._sessions.pop(name)
+                appliance = None
+            else:
+                stale = None
+            if appliance is None:
+                appliance = self._sessions[name] = self._factory(name)
+                self._generations[name] = generation
+        if stale is not None:
+            with stale._lock:
+                stale.disconnect()
+        with appliance._lock:
+            if not (appliance.connected and appliance._check_connection()):
+                logger.info(f"Opening session to {name}")
+                appliance._ssh.close()
+                appliance.connect()
+            try:
+                yield appliance
+            except Exception:
+                self.drop(name)
+                raise
+
+    def drop(self, name: str) -> None:
+        """Close the session to an appliance"""
+        with self._lock:
+            appliance = self._sessions.pop(name, None)
+        if appliance is not None:
+            with appliance._lock:
+                appliance.disconnect()
+
+    def close(self) -> None:
+        """Close every session in the pool"""
+        for name in list(self._sessions):
+            self.drop(name)
+
+    def _load_generation(self, name: str) -> int:
+        if self._connection is None:
+            return 0
+        try:
+            return load_appliance_generation(self._connection, name)
+        except RedisError as e:
+            logger.info(f"Could not read the generation of {name}: {e}")
+            # Keep using the session, _check_connection still catches dead ones
+            return self._generations.get(name, 0)
+
+
 class DNAC(Appliance):
     def __init__(self, host, username, password, port):
         super().__init__(host, username, password, port)
@@ -294,8 +459,13 @@ class DNAC(Appliance):
         }
         self._restore_success = "Scheduled restore of backup '93c5643c-f3e0-4bae-a283-5e0210f7e68d"
         self._restore_fail = "fail"
+        # maglev shell prompt, or kong asking for credentials
+        self._prompt = re_compile(
+            r"(\$\s*$)|(maglev@\S+ \(\S+\) ~\s*$)"
+            r"|(\[administration\] (username|password)[^\n]*:\s*$)"
+        )
 
-    def reset(self, backup_id: str):
+    def reset(self, backup_id: str, progress: Callable = None):
         # Not tested at all
         logger.info("Restoring DNAC...")
         restore_cmd = "maglev restore apply " + backup_id
@@ -310,8 +480,13 @@ class DNAC(Appliance):
             self._restore_fail,
             wait=300,
             interval=8,
+            progress=progress,
         )
 
+    def _do_after_connect(self) -> None:
+        """Wait for the login banner to end with the shell prompt"""
+        self._read_shell(wait=10)
+
     def get_status(self) -> list:
         # Tested and works
         resp = self._send_command(self._status_cmd)
@@ -363,6 +538,8 @@ class ISE(Appliance):
         ]
         self._restore_success = "Completing Restore...100% completed"
         self._restore_fail = "restore failed"
+        # CLI prompt, or the prompt to resume an earlier admin session
+        self._prompt = re_compile(r"(#\s*$)|(start a new one:\s*$)")
 
     def get_status(self) -> dict:
         # Tested and works
@@ -370,14 +547,20 @@ class ISE(Appliance):
         self.status = self._parse_show_restore_history(resp)
         return self.status
 
-    def reset(self, backup_file, backup_repo, backup_key) -> tuple:
+    def reset(
+        self, backup_file, backup_repo, backup_key, progress: Callable = None
+    ) -> tuple:
         self._restore_cmd_frame[1] = backup_file
         self._restore_cmd_frame[3] = backup_repo
         self._restore_cmd_frame[6] = backup_key
         restore_cmd = " ".join(self._restore_cmd_frame)
         self._send_command(restore_cmd)
         return self._wait_on_restore(
-            self._restore_success, self._restore_fail, wait=300, interval=10
+            self._restore_success,
+            self._restore_fail,
+            wait=300,
+            interval=10,
+            progress=progress,
         )
 
     def _do_after_connect(self) -> None:
@@ -422,6 +605,103 @@ class ISE(Appliance):
         return parsed
 
 
+class RestoreLogTracker:
+    """Follows a restore log, reading only what was logged since last time
+
+    The log is read from the byte offset the previous read ended at, so
+    each poll moves only new bytes, and lines are parsed as they arrive
+    for their timestamp and the phase of the restore they mark.
+    """
+
+    # Lines marking each phase of a configuration-db restore, in order, a
+    # restore only moves forward through them
+    PHASES = [
+        ("connecting", re_compile(r"Routing driver instance")),
+        ("restoring", re_compile(r"restore configuration-db from|neo4j_restore")),
+        # Sucessfully (sic) is how vManage logs it
+        ("restored", re_compile(r"Suc+es+ful+y restored? ")),
+        ("failed", re_compile(r"Failed to restore")),
+    ]
+    # e.g. Apr 15, 2022 5:55:37 PM org.neo4j.driver.internal.logging.JULogger info
+    TIMESTAMP = re_compile(r"^([A-Z][a-z]{2} \d{1,2}, \d{4} \d{1,2}:\d{2}:\d{2} [AP]M)")
+    TIMESTAMP_FORMAT = "%b %d, %Y %I:%M:%S %p"
+
+    def __init__(self, read: Callable = None, offset: int = 0) -> None:
+        """
+        Args:
+            read (Callable): Reads the log from a byte offset, returns the
+                bytes read and the offset they end at
+            offset (int): Byte offset to start reading the log at
+        """
+        self._read = read
+        self.offset = offset
+        self.phase = None
+        # Time of the first and last timestamped lines
+        self.started = None
+        self.last_logged = None
+        self._decoder = getincrementaldecoder("utf-8")(errors="replace")
+        self._line = ""
+
+    @property
+    def done(self) -> bool:
+        return self.phase in ("restored", "failed")
+
+    @property
+    def success(self) -> bool:
+        return self.phase == "restored"
+
+    def poll(self) -> list:
+        """Read and parse what was logged since the last poll
+
+        Returns:
+            list: complete lines logged since the last poll
+        """
+        data, offset = self._read(self.offset)
+        if offset < self.offset:
+            # The log was truncated by a new restore, start over
+            logger.info("Restore log truncated, reading from the start.")
+            self._line = ""
+            self._decoder.reset()
+            self.phase = self.started = self.last_logged = None
+        self.offset = offset
+        return self.feed(data)
+
+    def feed(self, data: bytes) -> list:
+        """Parse a chunk of the log, lines may be split across chunks
+
+        Returns:
+            list: the complete lines in the chunk
+        """
+        lines = (self._line + self._decoder.decode(data)).split("\n")
+        self._line = lines.pop()
+        lines = [line.rstrip("\r") for line in lines]
+        for line in lines:
+            self._parse_line(line)
+        return lines
+
+    def status(self) -> dict:
+        return {
+            "phase": self.phase,
+            "started": self.started,
+            "last_logged": self.last_logged,
+            "done": self.done,
+            "success": self.success,
+        }
+
+    def _parse_line(self, line: str) -> None:
+        match = self.TIMESTAMP.match(line)
+        if match:
+            logged = datetime.strptime(match.group(1), self.TIMESTAMP_FORMAT)
+            self.started = self.started or logged
+            self.last_logged = logged
+        phases = [phase for phase, _ in self.PHASES]
+        current = phases.index(self.phase) if self.phase else -1
+        for phase, marker in self.PHASES[current + 1 :]:
+            if marker.search(line):
+                logger.info(f"Restore phase: {phase}")
+                self.phase = phase
+
+
 class vManage(Appliance):
     def __init__(self, host, username, password, port):
         super().__init__(host, username, password, port)
@@ -431,6 +711,13 @@ class vManage(Appliance):
         self._screen_len_cmd = "screen-length 1000"
         self._cli_history_cmd = "history 1000"
         self._restore_log_cmd = "more /var/log/nms/neo4j-restore.log"
+        self._restore_log = "/var/log/nms/neo4j-restore.log"
+        # Most bytes of the restore log read per poll
+        self._restore_log_chunk = 16384
+        self._read_file_output = re_compile(
+            r"@@start\r?\n(.*?)\r?\n@@end (\d+) (-?\d+)", DOTALL
+        )
+        self._read_file_end = re_compile(r"@@end \d+ -?\d+\r?\n[^\n]*[#$>]\s*$")
         self._restore_started = "Starting backup of configuration-db"
         self._restore_success = "Successfully restored database"
         self._restore_fail = "Failed to restore"
@@ -448,16 +735,107 @@ class vManage(Appliance):
         self.status = self._parse_show_history(resp, default_result)
         return self.status
 
-    def reset(self, backup_path: str) -> tuple:
-        # Tested and works
-        cmd = f"{self._restore_cmd_stem} {backup_path}"
-        self._send_command(cmd)
-        return self._wait_on_restore(
-            self._restore_success,
-            self._restore_fail,
-            wait=300,
-            interval=8,
+    def reset(
+        self,
+        backup_path: str,
+        progress: Callable = None,
+        wait: int = 2400,
+        interval: int = 5,
+    ) -> tuple:
+        """Restore the configuration-db, following the restore log
+
+        The log is tailed on a second session while the restore runs on
+        this one, and the result is known as soon as it is logged.
+
+        Args:
+            backup_path (str): Path of the backup on vManage
+            progress (Callable): Called with each batch of new log lines
+            wait (int): Seconds to wait for the restore to finish
+            interval (int): Seconds between reads of the log
+        Returns:
+            tuple:
+                (bool) If restore was successful or not
+                (str) Message indicating disposition
+        """
+        log_session = vManage(self.host, self.username, self.password, self.port)
+        log_session.connect()
+        try:
+            log_session._send_command("vshell")
+            tracker = RestoreLogTracker(log_session._read_file_from)
+            # Earlier restores are already in the log, follow what comes next
+            tracker.offset = log_session._file_size()
+            cmd = f"{self._restore_cmd_stem} {backup_path}"
+            self._send_command(cmd)
+            return self._wait_on_restore_log(tracker, progress, wait, interval)
+        finally:
+            log_session._send_command("exit")
+            log_session.disconnect()
+
+    def _wait_on_restore_log(
+        self, tracker: RestoreLogTracker, progress: Callable, wait: int, interval: int
+    ) -> tuple:
+        deadline = monotonic() + wait
+        while monotonic() < deadline:
+            lines = tracker.poll()
+            # The restore also prints to this shell, nobody reads it
+            self._drain_shell()
+            if progress and lines:
+                progress(lines)
+            if tracker.done:
+                logger.info(f"Restore ended: {tracker.status()}")
+                if tracker.success:
+                    return True, "Restore successful."
+                return False, "Restore failed."
+            sleep(interval)
+        logger.info("Determining restore status timed out.")
+        return False, "Timeout. Restore may or may not be successful."
+
+    def _read_file_from(self, offset: int, max_bytes: int = None) -> tuple:
+        """Read a file in vshell from a byte offset
+
+        Args:
+            offset (int): Byte offset to read from
+            max_bytes (int): Most bytes to read (default is _restore_log_chunk)
+        Returns:
+            tuple:
+                (bytes) data read
+                (int) offset the data ends at, less than offset if the file
+                    shrank, in which case nothing is read
+        """
+        if max_bytes is None:
+            max_bytes = self._restore_log_chunk
+        path = self._restore_log
+        # Markers are printed with printf so the echoed command doesn't hold them
+        cmd = (
+            f"s=$(stat -c %s {path} 2>/dev/null || echo 0); "
+            f"n=$((s-{offset})); [ $n -gt {max_bytes} ] && n={max_bytes}; "
+            "printf '@@%s\\n' start; "
+            f"[ $n -gt 0 ] && tail -c +{offset + 1} {path} | head -c $n; "
+            "printf '\\n@@end %s %s\\n' $s $n"
+        )
+        # The log may hold prompt characters, only the end marker ends it
+        resp = self._send_command(
+            cmd, bytes=max_bytes + 4096, prompt=self._read_file_end
+        )
+        match = self._read_file_output.search(str(resp))
+        if not match:
+            raise IOError(f"Could not read {path}: {resp}")
+        size, read = int(match.group(2)), int(match.group(3))
+        if size < offset:
+            return b"", size
+        data = match.group(1).replace("\r\n", "\n").encode("utf-8")
+        return data, offset + max(read, 0)
+
+    def _file_size(self) -> int:
+        """Size in bytes of the restore log, 0 if there is none"""
+        path = self._restore_log
+        resp = self._send_command(
+            f"printf '@@size %s\\n' $(stat -c %s {path} 2>/dev/null || echo 0)"
         )
+        match = re_compile(r"@@size (\d+)").search(str(resp))
+        if not match:
+            raise IOError(f"Could not read {path}: {resp}")
+        return int(match.group(1))
 
     def _do_after_connect(self):
         # Send a \n to vManage first
@@ -468,22 +846,18 @@ class vManage(Appliance):
         # Set to largest value, 1000
         self._send_command(self._cli_history_cmd)
 
-    def _parse_restore_log(self, s: str) -> dict:
-        # Needs work, not in use
-        lines = s.split("\n")
-        # Sucessfully (sic)
-        restore_success = [line for line in lines if s in line]
-        if restore_success:
-            entries_with_time = [line for line in lines if self.str_has_time(line)]
-            restore_finished_time_entry = entries_with_time[-1]
-            restore_finished_time = restore_finished_time_entry.split("org")[0].strip()
-            parsed = {
-                "last_restore": restore_finished_time,
-                "restore_file": self._backup_path,
-                "status": f"Last restore finished at {restore_finished_time}",
-                "host": self.host,
-            }
-            return parsed
+    def _parse_restore_log(self, s: str) -> dict | None:
+        """Status of the last restore in the restore log, None if unfinished"""
+        tracker = RestoreLogTracker()
+        tracker.feed(s.encode("utf-8") + b"\n")
+        if not tracker.done:
+            return None
+        last_logged = str(tracker.last_logged)
+        return {
+            "last_restore": last_logged,
+            "status": f"Last restore {tracker.phase}, last logged at {last_logged}",
+            "host": self.host,
+        }
 
     def _parse_show_history(self, s: str, r: dict) -> dict:
         lines = s.split("\n")
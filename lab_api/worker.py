@@ -0,0 +1,84 @@
+from rq import SimpleWorker, Worker
+from . import get_appliance_pool, invalidate_reset_status
+from .cache import release_job_status, store_job_status
+from .config import get_device_pool
+from .jobs import publish_job_done
+from .orchestrator import record_orchestration_node
+
+
+# Start with: rq worker -w lab_api.worker.NotifyingWorker
+class NotifyingWorker(Worker):
+    """RQ worker that announces finished and failed jobs on Redis pub/sub
+
+    Publishing happens after RQ has stored the job status and result so
+    a woken waiter always reads the final state of the job. Results of
+    status jobs are also kept in the status cache, and the end state of
+    orchestration nodes in their orchestration. Reset jobs drop the cached
+    status of what they reset, finished or not. A forked work horse closes
+    the device and appliance connections its job opened before it exits.
+    """
+
+    def perform_job(self, job, queue):
+        try:
+            return super().perform_job(job, queue)
+        finally:
+            # The work horse leaves with os._exit, which doesn't close them
+            if self.is_horse:
+                close_pools()
+
+    def prepare_job_execution(self, job):
+        super().prepare_job_execution(job)
+        # Waiters re-check the status on any message, followers of
+        # /v1/job/{jobID}/events see the job start
+        publish_job_done(self.connection, job)
+
+    def handle_job_success(self, job, queue, started_job_registry):
+        super().handle_job_success(job, queue, started_job_registry)
+        store_job_status(self.connection, job)
+        self._invalidate_reset_status(job)
+        record_orchestration_node(self.connection, job)
+        publish_job_done(self.connection, job)
+
+    def handle_job_failure(self, job, queue, started_job_registry=None, exc_string=""):
+        super().handle_job_failure(
+            job, queue, started_job_registry=started_job_registry, exc_string=exc_string
+        )
+        release_job_status(self.connection, job)
+        self._invalidate_reset_status(job)
+        record_orchestration_node(self.connection, job)
+        publish_job_done(self.connection, job)
+
+    def _invalidate_reset_status(self, job):
+        task_name = job.func_name.rsplit(".", 1)[-1]
+        invalidate_reset_status(self.connection, task_name, job.args)
+
+
+# Start with: rq worker -w lab_api.worker.PooledWorker
+class PooledWorker(NotifyingWorker, SimpleWorker):
+    """Long-lived worker that keeps network device connections open
+
+    Jobs run in the worker process instead of a forked work horse, so the
+    connections in the device and appliance pools outlive each job. Idle
+    connections are closed on the worker heartbeat, which runs after every
+    job and at least every worker TTL while waiting for one.
+    """
+
+    def heartbeat(self, timeout=None, pipeline=None):
+        super().heartbeat(timeout=timeout, pipeline=pipeline)
+        if pipeline is None:
+            get_device_pool().evict_idle()
+
+    def register_death(self):
+        close_pools()
+        super().register_death()
+
+
+def close_pools():
+    """Close the connections in the device and appliance pools
+
+    Pools this process never made are left alone, making one would load
+    the testbed.
+    """
+    for get_pool in (get_device_pool, get_appliance_pool):
+        if get_pool.cache_info().currsize:
+            get_pool().close()
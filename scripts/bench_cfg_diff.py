@@ -0,0 +1,72 @@
+"""Benchmark the config diff engine against genie's dict diff
+
+Run from the repo root with the mock data:
+    CIVLAB_NETDEVICE_DATA=mock_data/testbed.yaml CIVLAB_API_KEY=DUMMY \\
+    CIVLAB_APPLIANCE_DATA=mock_data/appliances.yaml \\
+    PYTHONPATH=. python scripts/bench_cfg_diff.py
+"""
+import random
+from timeit import timeit
+import yaml
+from genie.libs.sdk.apis.utils import compare_config_dicts, get_config_dict
+from lab_api.cfgdiff import compile_excludes, diff_configs, parse_config
+
+
+EXCLUDES = [
+    r"(^!)",
+    r"(^exec-timeout)",
+    r"(^no logging console)",
+    r"(^login local)",
+    r"(^crypto pki certificate chain)",
+    r"(^service password-encryption)",
+    r"(^crypto pki trustpoint)",
+]
+EXCLUDE = compile_excludes(EXCLUDES)
+
+
+def mock_cfgs() -> tuple:
+    """Running and default config of the mock csr1000v-1"""
+    with open("mock_data/csr1/csr1000v-1.yaml") as stream:
+        commands = yaml.safe_load(stream)["execute"]["commands"]
+    return commands["show running-config"], commands["more bootflash:discovery.cfg"]
+
+
+def synthetic_cfgs(lines: int = 10000, changes: int = 20) -> tuple:
+    """Config of about lines lines and a copy with a few changes"""
+    cfg = ["hostname synthetic"]
+    for i in range(lines // 5):
+        cfg += [
+            f"interface GigabitEthernet1.{i}",
+            f" description synthetic {i}",
+            f" encapsulation dot1Q {i}",
+            f" ip address 10.{i // 256}.{i % 256}.1 255.255.255.0",
+            "!",
+        ]
+    changed = list(cfg)
+    for i in random.Random(0).sample(range(len(cfg)), changes):
+        changed[i] = f"{cfg[i]} changed"
+    return "\n".join(changed), "\n".join(cfg)
+
+
+def genie_diff(running: str, default: str):
+    return compare_config_dicts(
+        get_config_dict(running), get_config_dict(default), exclude=EXCLUDES
+    )
+
+
+def native_diff(running: str, default: str):
+    return diff_configs(parse_config(running, EXCLUDE), parse_config(default, EXCLUDE))
+
+
+def bench(name: str, running: str, default: str, number: int) -> None:
+    genie = timeit(lambda: genie_diff(running, default), number=number) / number
+    native = timeit(lambda: native_diff(running, default), number=number) / number
+    print(
+        f"{name}: {len(running.splitlines())} lines, genie {genie * 1000:.2f} ms, "
+        f"native {native * 1000:.2f} ms, {genie / native:.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    bench("mock csr1000v-1", *mock_cfgs(), number=50)
+    bench("synthetic", *synthetic_cfgs(), number=3)
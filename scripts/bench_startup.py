@@ -0,0 +1,54 @@
+"""Benchmark the import time and memory of the API process
+
+Each case runs in a fresh interpreter. "api" is what uvicorn pays to import
+the app, "worker" adds the libraries and testbed a worker loads for its
+first job, which the API process used to load at import too.
+
+Run from the repo root with the mock data, after compiling the inventory
+as start.sh does:
+    export CIVLAB_NETDEVICE_DATA=mock_data/testbed.yaml CIVLAB_API_KEY=DUMMY \\
+    CIVLAB_APPLIANCE_DATA=mock_data/appliances.yaml
+    python lab_api/inventory.py
+    PYTHONPATH=. python scripts/bench_startup.py
+"""
+import subprocess
+import sys
+from statistics import median
+
+
+CASES = {
+    "api": "import lab_api",
+    "worker": (
+        "import lab_api, lab_api.config, lab_api.device, lab_api.ise, "
+        "lab_api.services; lab_api.config.get_netdevice_testbed()"
+    ),
+}
+MEASURE = """
+import resource, time
+start = time.perf_counter()
+{stmt}
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def run(stmt: str) -> tuple:
+    """Seconds to run stmt and peak RSS in MB, in a fresh interpreter"""
+    out = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(stmt=stmt)],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.split()
+    return float(out[-2]), int(out[-1]) / 1024
+
+
+def bench(name: str, stmt: str, number: int) -> None:
+    runs = [run(stmt) for _ in range(number)]
+    seconds = median(seconds for seconds, _ in runs)
+    rss = max(rss for _, rss in runs)
+    print(f"{name}: import {seconds * 1000:.0f} ms, peak RSS {rss:.0f} MB")
+
+
+if __name__ == "__main__":
+    for name, stmt in CASES.items():
+        bench(name, stmt, number=5)
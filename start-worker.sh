@@ -10,5 +10,26 @@ else
     export CIVLAB_NETDEVICE_DATA=lab_data/testbed.yaml
     export CIVLAB_APPLIANCE_DATA=lab_data/appliances.yaml
 fi
-# Start RQ worker
-rq worker -u redis://redis:6379
+# Compile the device inventory read by lab_api, so it doesn't load genie
+python lab_api/inventory.py || exit 1
+# Worker class, PooledWorker keeps network device connections open between jobs
+# Use lab_api.worker.NotifyingWorker to fork a work horse per job instead
+worker_class=${CIVLAB_WORKER_CLASS:-lab_api.worker.PooledWorker}
+# Workers per queue, status jobs are short and never wait behind resets
+status_workers=${CIVLAB_STATUS_WORKERS:-2}
+reset_workers=${CIVLAB_RESET_WORKERS:-4}
+backup_workers=${CIVLAB_BACKUP_WORKERS:-1}
+start_workers() {
+    # Start $1 RQ workers listening on the queues after it
+    count=$1
+    shift
+    for i in $(seq 1 $count); do
+        rq worker -u redis://redis:6379 -w $worker_class "$@" &
+    done
+}
+# Status workers also take jobs from the default queue
+start_workers $status_workers status default
+start_workers $reset_workers reset
+start_workers $backup_workers backup
+# Exit when any worker does, so the container is restarted
+wait -n
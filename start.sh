@@ -11,5 +11,7 @@ else
     export CIVLAB_NETDEVICE_DATA=lab_data/testbed.yaml
     export CIVLAB_APPLIANCE_DATA=lab_data/appliances.yaml
 fi
+# Compile the device inventory read by lab_api, so it doesn't load genie
+python lab_api/inventory.py || exit 1
 # Start API
 uvicorn lab_api:app --host=0.0.0.0 --port=80 --proxy-headers
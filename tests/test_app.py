@@ -1,4 +1,7 @@
+import json
 import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, PropertyMock
 from fastapi.testclient import TestClient
 from lab_api import app
 
@@ -20,3 +23,163 @@ def test_client():
 # def test_lab_reset(test_client):
 #     response = test_client.put("/reset")
 #     assert "default" in response.text
+
+
+def mock_job(id):
+    # Mock finished RQ job
+    job = MagicMock()
+    job.id = id
+    job.result = job._result = "done"
+    job.meta = {}
+    job.get_status.return_value = "finished"
+    job.enqueued_at = datetime(2022, 1, 1)
+    job.started_at = job.ended_at = None
+    return job
+
+
+def test_get_jobs_status(mocker, test_client):
+    fetch_many = mocker.patch(
+        "lab_api.Job.fetch_many", return_value=[mock_job("a"), None, mock_job("c")]
+    )
+    response = test_client.get(
+        "/v1/jobs?ids=a,b&ids=c&ids=a", headers={"access_token": "DUMMY"}
+    )
+    assert fetch_many.call_args.args[0] == ["a", "b", "c"]
+    responses = response.json()["responses"]
+    assert responses[0]["job"] == {
+        "id": "a",
+        "status": "finished",
+        "result": "done",
+        "enqueued_at": "2022-01-01T00:00:00",
+    }
+    assert responses[1] == {"job": {"id": "b"}, "error": {"error": "No job found."}}
+    assert responses[2]["job"]["id"] == "c"
+
+
+def test_get_jobs_status_no_result_reads(mocker, test_client):
+    queued = mock_job("a")
+    queued._result = None
+    type(queued).result = PropertyMock(side_effect=AssertionError("Redis read"))
+    queued.get_status.return_value = "queued"
+    mocker.patch("lab_api.Job.fetch_many", return_value=[queued])
+    response = test_client.get("/v1/jobs?ids=a", headers={"access_token": "DUMMY"})
+    assert response.json()["responses"][0]["job"]["status"] == "queued"
+
+
+def test_post_jobs_status(mocker, test_client):
+    mocker.patch("lab_api.Job.fetch_many", return_value=[None])
+    response = test_client.post(
+        "/v1/jobs", json={"ids": ["a"]}, headers={"access_token": "DUMMY"}
+    )
+    assert response.json()["responses"][0]["error"] == {"error": "No job found."}
+
+
+def test_rq_queue():
+    from lab_api import (
+        rq_queue,
+        task_backup_network_device,
+        task_get_dnac_status,
+        task_reset_ise,
+    )
+    from lab_api.config import BACKUP_Q, DEFAULT_Q, RESET_Q, STATUS_Q
+
+    assert rq_queue(task_get_dnac_status) is STATUS_Q
+    assert rq_queue(task_reset_ise) is RESET_Q
+    assert rq_queue(task_backup_network_device) is BACKUP_Q
+    assert rq_queue(print) is DEFAULT_Q
+
+
+def test_list_etag(test_client):
+    headers = {"access_token": "DUMMY"}
+    response = test_client.get("/v1/list", headers=headers)
+    assert response.status_code == 200
+    assert {"name": "csr1000v-1", "host": "10.0.0.1"} in response.json()[
+        "network_devices"
+    ]
+    etag = response.headers["etag"]
+    headers["If-None-Match"] = etag
+    response = test_client.get("/v1/list", headers=headers)
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+    headers["If-None-Match"] = '"stale", W/' + etag
+    assert test_client.get("/v1/list", headers=headers).status_code == 304
+    headers["If-None-Match"] = '"stale"'
+    assert test_client.get("/v1/list", headers=headers).status_code == 200
+
+
+def test_task_get_appliance_status_all(mocker):
+    import lab_api
+
+    async def dnac_status(session):
+        return {"restore_id": "abc", "status": "SUCCESS", "host": "10.1.1.1"}
+
+    async def ise_status(session):
+        raise TimeoutError("No answer in 30s")
+
+    clients = {"dnac": MagicMock(), "ise": MagicMock()}
+    clients["dnac"].get_status_async = dnac_status
+    clients["ise"].get_status_async = ise_status
+    registry = mocker.patch("lab_api.get_appliance_registry")
+    registry.return_value.get.side_effect = clients.get
+    mocker.patch(
+        "lab_api.task_get_vmanage_status",
+        return_value=lab_api.vManageModel(last_restore="today"),
+    )
+    status = lab_api.task_get_appliance_status_all()
+    assert status.dnac.restore_id == "abc"
+    assert status.ise.status == "No answer in 30s"
+    assert status.ise.host == "192.168.1.2"
+    assert status.vmanage.last_restore == "today"
+
+
+def test_job_events_result(mocker, test_client):
+    import lab_api
+
+    async def events(job_id, connection):
+        yield "status", "finished"
+
+    job = mock_job("a")
+    job.started_at = datetime(2022, 1, 1, 0, 1)
+    job.ended_at = datetime(2022, 1, 1, 0, 2)
+    mocker.patch.object(lab_api.ASYNC_REDIS_CONN, "exists", AsyncMock(return_value=1))
+    mocker.patch("lab_api.job_events", events)
+    mocker.patch("lab_api.Job.fetch", return_value=job)
+    response = test_client.get("/v1/job/a/events", headers={"access_token": "DUMMY"})
+    assert response.status_code == 200
+    event, data = response.text.split("\n\n")[1].split("\n")
+    assert event == "event: result"
+    assert json.loads(data.removeprefix("data: "))["job"] == {
+        "id": "a",
+        "status": "finished",
+        "result": "done",
+        "enqueued_at": "2022-01-01T00:00:00",
+        "started_at": "2022-01-01T00:01:00",
+        "ended_at": "2022-01-01T00:02:00",
+    }
+
+
+def test_reset_invalidates_status(mocker, test_client):
+    import lab_api
+
+    invalidate = mocker.patch("lab_api.invalidate_status")
+    mocker.patch("lab_api.enqueue_once", return_value=mock_job("csr1000v-1_reset"))
+    response = test_client.put(
+        "/v1/reset/csr1000v-1", headers={"access_token": "DUMMY"}
+    )
+    assert response.status_code == 201
+    invalidate.assert_called_once_with(
+        lab_api.REDIS_CONN, ["csr1000v-1_status", "netdevices_status"]
+    )
+
+
+def test_reset_status_ids():
+    from lab_api import reset_status_ids
+
+    assert reset_status_ids("task_reset_dnac") == ["dnac_status", "appliances_status"]
+    assert reset_status_ids("task_reset_network_device_all") == [
+        "netdevices_status",
+        "csr1000v-1_status",
+        "csr1000v-2_status",
+    ]
+    assert reset_status_ids("task_get_dnac_status") == []
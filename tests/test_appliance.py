@@ -0,0 +1,163 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+import pytest
+from lab_api.appliance import ApplianceAPI, ApplianceRegistry
+from lab_api.dnac import DNAC
+from lab_api.sdwan import vManage
+
+
+class CountingAPI(ApplianceAPI):
+    def __init__(self):
+        super().__init__("10.1.1.1", "admin", "admin", 443)
+        self.logins = 0
+
+    def _auth(self):
+        self.logins += 1
+
+
+def resp(status_code):
+    r = MagicMock()
+    r.status_code = status_code
+    return r
+
+
+@pytest.fixture
+def api():
+    return CountingAPI()
+
+
+def test_appliance_api_login_once(api):
+    with ThreadPoolExecutor(8) as executor:
+        generations = list(executor.map(lambda _: api.login(), range(32)))
+    assert api.logins == 1
+    assert set(generations) == {1}
+
+
+def test_appliance_api_login_expired(mocker, api):
+    api.auth_ttl = 60
+    monotonic = mocker.patch("lab_api.appliance.monotonic", return_value=100)
+    api.login()
+    monotonic.return_value = 159
+    api.login()
+    assert api.logins == 1
+    monotonic.return_value = 160
+    assert api.login() == 2
+
+
+def test_appliance_api_call_reauth(api):
+    request = MagicMock(side_effect=[resp(401), resp(200)])
+    assert api.call(request).status_code == 200
+    assert api.logins == 2
+    assert request.call_count == 2
+
+
+def test_appliance_api_stale_login_once(api):
+    generation = api.login()
+    api.login(stale=generation)
+    # A second thread rejected with the same login doesn't log in again
+    api.login(stale=generation)
+    assert api.logins == 2
+
+
+def test_appliance_registry_reuses_client():
+    factory = MagicMock(side_effect=lambda name: object())
+    registry = ApplianceRegistry(factory)
+    assert registry.get("dnac") is registry.get("dnac")
+    factory.assert_called_once_with("dnac")
+    registry.drop("dnac")
+    registry.get("dnac")
+    assert factory.call_count == 2
+
+
+def test_dnac_request_reauth(mocker):
+    dnac = DNAC("10.1.1.1", "admin", "admin")
+    post = mocker.patch.object(dnac._session, "post")
+    post.return_value.json.side_effect = [{"Token": "one"}, {"Token": "two"}]
+    tokens = []
+
+    def request(method, path, headers, **kwargs):
+        tokens.append(headers["X-Auth-Token"])
+        return resp(401 if len(tokens) == 1 else 200)
+
+    mocker.patch.object(dnac._session, "request", side_effect=request)
+    dnac._get_backup_history()
+    assert tokens == ["one", "two"]
+
+
+def test_dnac_session_pool():
+    dnac = DNAC("10.1.1.1", "admin", "admin", pool_size=8, retries=2)
+    adapter = dnac._session.get_adapter("https://10.1.1.1/")
+    assert adapter._pool_maxsize == 8
+    assert adapter.max_retries.total == 2
+    assert 503 in adapter.max_retries.status_forcelist
+
+
+def test_dnac_get_status(mocker):
+    dnac = DNAC("10.1.1.1", "admin", "admin")
+    history = {
+        "response": [
+            {"id": "old", "status": "SUCCESS", "start_timestamp": 1646748528000},
+            {"id": "new", "status": "FAILED", "start_timestamp": 1647984189000},
+        ]
+    }
+    get = mocker.patch.object(dnac, "_request", return_value=history)
+    assert dnac.get_status() == {
+        "last_restore": "2022-03-22 21:23:09",
+        "restore_id": "new",
+        "status": "FAILED",
+        "host": "10.1.1.1",
+    }
+    get.assert_called_once_with(
+        "get", "https://10.1.1.1:443/api/system/v1/maglev/restore/history"
+    )
+
+
+def test_dnac_get_status_no_history(mocker):
+    dnac = DNAC("10.1.1.1", "admin", "admin")
+    mocker.patch.object(dnac, "_request", return_value={"response": []})
+    assert dnac.get_status() == dnac._default_result
+
+
+def vmanage_resp(status_code: int, text: str, content_type: str) -> MagicMock:
+    # Mock requests response from vManage
+    r = resp(status_code)
+    r.ok = status_code < 400
+    r.text = text
+    r.headers = {"Content-Type": content_type}
+    r.json.return_value = json.loads(text) if text.startswith("{") else None
+    return r
+
+
+def test_vmanage_request_reauth(mocker):
+    auth = mocker.patch("lab_api.sdwan.Authentication")
+    session = auth.return_value.login.return_value
+    session.request.side_effect = [
+        vmanage_resp(401, "", "text/plain"),
+        vmanage_resp(200, '{"backupList": []}', "application/json"),
+    ]
+    vmanage = vManage("10.1.1.3", "admin", "admin")
+    assert vmanage._get_back_up_list() == []
+    assert auth.return_value.login.call_count == 2
+
+
+def test_vmanage_request_reauth_login_page(mocker):
+    login_page = '<html><form action="j_security_check" method="POST"></form></html>'
+    auth = mocker.patch("lab_api.sdwan.Authentication")
+    session = auth.return_value.login.return_value
+    session.request.side_effect = [
+        vmanage_resp(200, login_page, "text/html;charset=UTF-8"),
+        vmanage_resp(200, '{"backupList": ["backup"]}', "application/json"),
+    ]
+    vmanage = vManage("10.1.1.3", "admin", "admin")
+    assert vmanage._get_back_up_list() == ["backup"]
+    assert auth.return_value.login.call_count == 2
+
+
+def test_vmanage_request_login_page_after_reauth(mocker):
+    login_page = '<html><form action="j_security_check" method="POST"></form></html>'
+    auth = mocker.patch("lab_api.sdwan.Authentication")
+    session = auth.return_value.login.return_value
+    session.request.return_value = vmanage_resp(200, login_page, "text/html")
+    vmanage = vManage("10.1.1.3", "admin", "admin")
+    assert vmanage._get_back_up_list() == "Login to 10.1.1.3 rejected"
@@ -0,0 +1,95 @@
+import asyncio
+import pickle
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from lab_api.cache import (
+    appliance_generation_key,
+    bump_appliance_generation,
+    claim_refresh,
+    invalidate_status,
+    load_appliance_generation,
+    load_status,
+    refresh_key,
+    status_cache_meta,
+    status_key,
+    store_job_status,
+)
+
+
+# Cache Setup
+
+
+@pytest.fixture()
+def job():
+    # Mock RQ status job
+    obj = MagicMock()
+    obj.id = "test_status"
+    obj.meta = status_cache_meta(60)
+    obj.result = "test"
+    yield obj
+
+
+# Test cache
+
+
+def test_store_job_status(job):
+    connection = MagicMock()
+    pipe = connection.pipeline.return_value.__enter__.return_value
+    r = store_job_status(connection, job)
+    pipe.set.assert_called_once()
+    assert pipe.set.call_args.args[0] == status_key("test_status")
+    assert pipe.set.call_args.kwargs["ex"] == 60
+    pipe.delete.assert_called_once_with(refresh_key("test_status"))
+    assert r
+
+
+def test_store_job_status_not_status_job(job):
+    connection = MagicMock()
+    job.meta = {}
+    assert not store_job_status(connection, job)
+    connection.pipeline.assert_not_called()
+
+
+def test_load_status(mocker):
+    mocker.patch("lab_api.cache.time", return_value=110.0)
+    connection = MagicMock()
+    connection.get = AsyncMock(return_value=pickle.dumps((100.0, "test")))
+    age, result = asyncio.run(load_status(connection, "test_status"))
+    connection.get.assert_awaited_once_with(status_key("test_status"))
+    assert age == 10.0
+    assert result == "test"
+
+
+def test_load_status_miss():
+    connection = MagicMock()
+    connection.get = AsyncMock(return_value=None)
+    assert asyncio.run(load_status(connection, "test_status")) is None
+
+
+def test_claim_refresh():
+    connection = MagicMock()
+    connection.set = AsyncMock(side_effect=[True, None])
+    assert asyncio.run(claim_refresh(connection, "test_status", 600))
+    assert not asyncio.run(claim_refresh(connection, "test_status", 600))
+    connection.set.assert_awaited_with(refresh_key("test_status"), 1, nx=True, ex=600)
+
+
+def test_invalidate_status():
+    connection = MagicMock()
+    invalidate_status(connection, ["a_status", "b_status"])
+    connection.delete.assert_called_once_with(
+        status_key("a_status"),
+        refresh_key("a_status"),
+        status_key("b_status"),
+        refresh_key("b_status"),
+    )
+
+
+def test_appliance_generation():
+    connection = MagicMock()
+    connection.get.return_value = None
+    assert load_appliance_generation(connection, "dnac") == 0
+    bump_appliance_generation(connection, "dnac")
+    connection.incr.assert_called_once_with(appliance_generation_key("dnac"))
+    connection.get.return_value = b"2"
+    assert load_appliance_generation(connection, "dnac") == 2
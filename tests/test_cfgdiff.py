@@ -0,0 +1,112 @@
+import os
+import pytest
+import yaml
+from genie.testbed import load
+from genie.libs.sdk.apis.utils import compare_config_dicts, get_config_dict
+from lab_api.cfgdiff import (
+    compile_excludes,
+    config_fingerprint,
+    diff_configs,
+    format_diff,
+    parse_config,
+)
+from lab_api.device import DeviceLab
+
+
+# Config diff Setup
+
+
+@pytest.fixture()
+def exclude():
+    yield compile_excludes([r"(^!)", r"(^exec-timeout)"])
+
+
+@pytest.fixture()
+def mock_cfgs():
+    # Running and default configs from the mock csr1000v-1
+    path = os.path.join("mock_data", "csr1", "csr1000v-1.yaml")
+    with open(path) as stream:
+        commands = yaml.safe_load(stream)["execute"]["commands"]
+    yield commands["show running-config"], commands["more bootflash:discovery.cfg"]
+
+
+RUNNING = """Building configuration...
+
+Current configuration : 1234 bytes
+!
+hostname test
+!
+interface GigabitEthernet1
+ ip address 10.0.0.1 255.255.255.0
+ no shutdown
+!
+interface Loopback0
+ ip address 1.1.1.1 255.255.255.255
+!
+line vty 0 4
+ exec-timeout 0 0
+ transport input ssh
+end
+"""
+
+DEFAULT = """hostname test
+interface GigabitEthernet1
+ ip address 10.0.0.2 255.255.255.0
+ no shutdown
+line vty 0 4
+ transport input ssh
+"""
+
+
+# Test config diff
+
+
+def test_parse_config(exclude):
+    r = parse_config(RUNNING, exclude)
+    assert ("hostname test",) in r
+    assert ("interface GigabitEthernet1", "no shutdown") in r
+    assert ("line vty 0 4", "exec-timeout 0 0") not in r
+    assert not [path for path in r if path[0].startswith(("Building", "!"))]
+
+
+def test_parse_config_excludes_section(exclude):
+    cfg = "! comment\n hidden\nhostname test\n"
+    assert list(parse_config(cfg, exclude)) == [("hostname test",)]
+
+
+def test_diff_configs(exclude):
+    r = diff_configs(parse_config(RUNNING, exclude), parse_config(DEFAULT, exclude))
+    assert r == {
+        "added": [
+            ("interface GigabitEthernet1", "ip address 10.0.0.1 255.255.255.0"),
+            ("interface Loopback0",),
+        ],
+        "removed": [
+            ("interface GigabitEthernet1", "ip address 10.0.0.2 255.255.255.0"),
+        ],
+    }
+    assert format_diff(r).splitlines()[1] == "+ interface Loopback0"
+
+
+def test_diff_configs_match(exclude):
+    running = parse_config(RUNNING, exclude)
+    assert diff_configs(running, parse_config(RUNNING, exclude)) == {}
+
+
+def test_config_fingerprint(exclude):
+    reordered = "line vty 0 4\n transport input ssh\nhostname test\n"
+    a = parse_config("hostname test\nline vty 0 4\n transport input ssh\n", exclude)
+    assert config_fingerprint(a) == config_fingerprint(parse_config(reordered))
+    assert config_fingerprint(a) != config_fingerprint(parse_config(DEFAULT))
+
+
+def test_diff_configs_agrees_with_genie(mock_cfgs):
+    # Same verdict as compare_config_dicts with the DeviceLab excludes
+    running, default = mock_cfgs
+    excludes = DeviceLab(load(os.getenv("CIVLAB_NETDEVICE_DATA")))._cfg_diff_excludes
+    exclude = compile_excludes(excludes)
+    genie_diff = compare_config_dicts(
+        get_config_dict(running), get_config_dict(default), exclude=excludes
+    )
+    r = diff_configs(parse_config(running, exclude), parse_config(default, exclude))
+    assert bool(r) == bool(genie_diff)
@@ -0,0 +1,109 @@
+import asyncio
+from time import monotonic
+from unittest.mock import MagicMock
+from aiohttp import web
+from lab_api.collector import collect_status
+from lab_api.dnac import DNAC
+from lab_api.ise import ISE
+
+
+def sleeper(seconds, result):
+    async def check(session):
+        await asyncio.sleep(seconds)
+        return result
+
+    return check
+
+
+def test_collect_status_concurrent():
+    checks = {name: sleeper(0.2, name) for name in ("dnac", "ise", "vmanage")}
+    start = monotonic()
+    results = asyncio.run(collect_status(checks))
+    assert monotonic() - start < 0.5
+    assert results == {"dnac": "dnac", "ise": "ise", "vmanage": "vmanage"}
+
+
+def test_collect_status_deadline_and_error():
+    async def fail(session):
+        raise ValueError("down")
+
+    checks = {"dnac": sleeper(5, "dnac"), "ise": fail, "vmanage": sleeper(0, "ok")}
+    start = monotonic()
+    results = asyncio.run(collect_status(checks, {"dnac": 0.1}))
+    assert monotonic() - start < 1
+    assert isinstance(results["dnac"], TimeoutError)
+    assert str(results["dnac"]) == "No answer in 0.1s"
+    assert isinstance(results["ise"], ValueError)
+    assert results["vmanage"] == "ok"
+
+
+async def serve(routes: list, check) -> dict:
+    """Run check against a local server with routes, returning its results"""
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        return await check(port)
+    finally:
+        await runner.cleanup()
+
+
+def test_dnac_get_status_async():
+    tokens = []
+
+    async def history(request):
+        tokens.append(request.headers["X-Auth-Token"])
+        if len(tokens) == 1:
+            return web.Response(status=401)
+        restore = {"id": "new", "status": "SUCCESS", "start_timestamp": 1647984189000}
+        return web.json_response({"response": [restore]})
+
+    async def check(port):
+        dnac = DNAC("127.0.0.1", "admin", "admin", port=port)
+        dnac._base_url = f"http://127.0.0.1:{port}"
+        dnac._auth = MagicMock(
+            side_effect=lambda: dnac._headers.update({"X-Auth-Token": str(len(tokens))})
+        )
+        return await collect_status({"dnac": dnac.get_status_async})
+
+    route = web.get("/api/system/v1/maglev/restore/history", history)
+    results = asyncio.run(serve([route], check))
+    assert tokens == ["0", "1"]
+    assert results["dnac"]["restore_id"] == "new"
+    assert results["dnac"]["last_restore"] == "2022-03-22 21:23:09"
+
+
+def test_ise_get_status_async():
+    requests = []
+
+    async def last_status(request):
+        requests.append(request)
+        assert request.headers["Authorization"].startswith("Basic ")
+        status = {
+            "startDate": "Thu Apr 28 01:06:05 UTC 2022",
+            "name": "backup.tar.gpg",
+            "action": "RESTORE",
+            "status": "COMPLETED",
+        }
+        return web.json_response({"response": status})
+
+    async def check(port):
+        ise = ISE("127.0.0.1", "admin", "admin", "3.1.0", port=port)
+        ise._base_url = f"http://127.0.0.1:{port}"
+        await collect_status({"ise": ise.get_status_async})
+        return await collect_status({"ise": ise.get_status_async})
+
+    route = web.get("/api/v1/backup-restore/config/last-backup-status", last_status)
+    results = asyncio.run(serve([route], check))
+    assert results["ise"] == {
+        "last_restore": "Thu Apr 28 01:06:05 UTC 2022",
+        "restore_file": "backup.tar.gpg",
+        "status": "RESTORE COMPLETED",
+        "host": "127.0.0.1",
+    }
+    # The second sweep is served from the ISE client cache
+    assert len(requests) == 1
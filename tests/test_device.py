@@ -0,0 +1,267 @@
+import os
+import pickle
+import socket
+import pytest
+from threading import Thread
+from unittest.mock import MagicMock
+from pyats.datastructures import AttrDict
+from genie.testbed import load
+from lab_api.cache import default_cfg_key
+from lab_api.device import DeviceLab, ssh_answers
+
+
+# DeviceLab Setup
+
+
+@pytest.fixture()
+def testbed():
+    # Setup testbed for testing
+    yield load(os.getenv("CIVLAB_NETDEVICE_DATA"))
+
+
+@pytest.fixture()
+def devicelab(testbed):
+    # Setup DeviceLab object
+    obj = DeviceLab(testbed)
+    yield obj
+
+
+@pytest.fixture()
+def device():
+    # Mock network device with a default config on flash
+    obj = MagicMock()
+    obj.name = "test_device"
+    obj.default_dir = "bootflash:"
+    obj.default_cfg_path = "bootflash:/default.cfg"
+    obj.execute.return_value = "hostname test\n"
+    yield obj
+
+
+# DeviceLab tests
+
+
+def test_devicelab_max_workers(testbed, devicelab):
+    assert devicelab.max_workers == testbed.custom.max_workers
+    assert DeviceLab(testbed, max_workers=1).max_workers == 1
+
+
+def test_devicelab_get_status_all(devicelab):
+    devicelab.get_status = MagicMock(return_value="default")
+    r = devicelab.get_status_all()
+    assert devicelab.get_status.call_count == len(devicelab.devices)
+    assert r == {name: "default" for name in devicelab.devices}
+
+
+def test_devicelab_run_all_collects_exceptions(devicelab):
+    error = Exception("test")
+
+    def get_status(device):
+        if device.name == "csr1000v-1":
+            raise error
+        return "default"
+
+    devicelab.get_status = get_status
+    r = devicelab.get_status_all()
+    assert r["csr1000v-1"] is error
+    assert r["csr1000v-2"] == "default"
+    assert devicelab.devices["csr1000v-1"].error == "test"
+
+
+def test_devicelab_get_default_cfg_stamp(devicelab, device):
+    device.parse.return_value = {
+        "dir": {
+            "dir": "bootflash:/",
+            "bootflash:/": {
+                "files": {
+                    devicelab.default_cfg_file: {
+                        "size": "4485",
+                        "last_modified_date": "Sep 13 2021 20:15:47 +00:00",
+                    }
+                }
+            },
+        }
+    }
+    r = devicelab.get_default_cfg_stamp(device)
+    assert r == "4485:Sep 13 2021 20:15:47 +00:00"
+    device.parse.return_value = {"dir": {"dir": "bootflash:/"}}
+    assert devicelab.get_default_cfg_stamp(device) is None
+
+
+def test_devicelab_get_default_cfg_cache_miss(testbed, device):
+    cache = MagicMock()
+    cache.get.return_value = None
+    devicelab = DeviceLab(testbed, cache=cache)
+    devicelab.get_default_cfg_stamp = MagicMock(return_value="4485:today")
+    r = devicelab.get_default_cfg(device)
+    assert r == {("hostname test",): None}
+    cmd = f"more bootflash:{devicelab.default_cfg_file}"
+    device.execute.assert_called_once_with(cmd)
+    key = default_cfg_key("test_device", "bootflash:/default.cfg", "4485:today")
+    assert cache.set.call_args.args[0] == key
+
+
+def test_devicelab_get_default_cfg_cache_hit(testbed, device):
+    cache = MagicMock()
+    cache.get.return_value = pickle.dumps({("hostname cached",): None})
+    devicelab = DeviceLab(testbed, cache=cache)
+    devicelab.get_default_cfg_stamp = MagicMock(return_value="4485:today")
+    r = devicelab.get_default_cfg(device)
+    assert r == {("hostname cached",): None}
+    device.execute.assert_not_called()
+
+
+def test_devicelab_get_default_cfg_no_stamp(testbed, device):
+    cache = MagicMock()
+    devicelab = DeviceLab(testbed, cache=cache)
+    devicelab.get_default_cfg_stamp = MagicMock(return_value=None)
+    devicelab.get_default_cfg(device)
+    device.execute.assert_called_once()
+    cache.get.assert_not_called()
+
+
+def test_devicelab_cfg_fingerprint(devicelab):
+    running = (
+        "Building configuration...\n"
+        "Current configuration : 1234 bytes\n"
+        "! Last configuration change at 10:00:00\n"
+        "hostname test\n"
+        "line vty 0 4\n"
+        " exec-timeout 0 0\n"
+        " login local\n"
+        "end\n"
+    )
+    default = "!\nhostname test\nline vty 0 4\n login local\n\nend\n"
+    r = devicelab.cfg_fingerprint(running)
+    assert r == devicelab.cfg_fingerprint(default)
+    assert r != devicelab.cfg_fingerprint("hostname other\nline vty 0 4\n")
+
+
+def test_devicelab_get_status_default(devicelab, device):
+    devicelab.get_default_cfg_exists = MagicMock(return_value=True)
+    devicelab.get_running_default_cfg_diff = MagicMock()
+    device.execute.return_value = "hostname test\n"
+    devicelab.get_default_cfg_fingerprint = MagicMock(
+        return_value=devicelab.cfg_fingerprint("hostname test\n")
+    )
+    assert devicelab.get_status(device, details=True) == "default"
+    devicelab.get_running_default_cfg_diff.assert_not_called()
+
+
+def test_devicelab_get_status_configured(devicelab, device):
+    devicelab.get_default_cfg_exists = MagicMock(return_value=True)
+    devicelab.get_running_default_cfg_diff = MagicMock()
+    device.execute.return_value = "hostname changed\n"
+    devicelab.get_default_cfg_fingerprint = MagicMock(
+        return_value=devicelab.cfg_fingerprint("hostname test\n")
+    )
+    assert devicelab.get_status(device) == "configured"
+    devicelab.get_running_default_cfg_diff.assert_not_called()
+    assert devicelab.get_status(device, details=True) == "configured"
+    devicelab.get_running_default_cfg_diff.assert_called_once_with(
+        device, running_cfg="hostname changed\n"
+    )
+
+
+def test_ssh_answers():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    port = server.getsockname()[1]
+
+    def serve():
+        conn, _ = server.accept()
+        conn.sendall(b"SSH-2.0-Cisco-1.25\r\n")
+        conn.close()
+
+    thread = Thread(target=serve)
+    thread.start()
+    assert ssh_answers("127.0.0.1", port)
+    thread.join()
+    server.close()
+    assert not ssh_answers("127.0.0.1", port, timeout=1)
+
+
+def test_devicelab_wait_for_reload(mocker, testbed, device):
+    mocker.patch("lab_api.device.sleep")
+    mocker.patch("lab_api.device.monotonic", side_effect=[100, 190])
+    probe = mocker.patch("lab_api.device.ssh_answers", side_effect=[False, True])
+    device.connections.ssh = AttrDict(ip="10.0.0.1")
+    cache = MagicMock()
+    cache.lrange.return_value = []
+    devicelab = DeviceLab(testbed, cache=cache)
+    r = devicelab.wait_for_reload(device, 10)
+    assert r == 180
+    assert probe.call_count == 2
+    device.connect.assert_called_once()
+    pipe = cache.pipeline.return_value.__enter__.return_value
+    pipe.lpush.assert_called_once_with("civlab:reload:test_device", 180)
+
+
+def test_devicelab_wait_for_reload_timeout(mocker, devicelab, device):
+    mocker.patch("lab_api.device.sleep")
+    mocker.patch("lab_api.device.monotonic", return_value=5000)
+    mocker.patch("lab_api.device.ssh_answers", return_value=False)
+    device.connections.ssh = AttrDict(ip="10.0.0.1")
+    with pytest.raises(TimeoutError):
+        devicelab.wait_for_reload(device, 10)
+    device.connect.assert_not_called()
+
+
+def test_devicelab_get_reload_timeout(testbed, device):
+    cache = MagicMock()
+    devicelab = DeviceLab(testbed, cache=cache)
+    cache.lrange.return_value = []
+    assert devicelab.get_reload_timeout(device) == devicelab._reload_timeout
+    cache.lrange.return_value = [b"90.5", b"120.0"]
+    assert devicelab.get_reload_timeout(device) == 240
+    cache.lrange.return_value = [b"1000"]
+    assert devicelab.get_reload_timeout(device) == devicelab._reload_timeout
+
+
+def test_devicelab_reset_by_replace(devicelab, device):
+    device.custom = {}
+    devicelab.get_running_default_cfg_diff = MagicMock(return_value={"added": []})
+    devicelab.is_running_cfg_default = MagicMock(return_value=True)
+    devicelab.reload = MagicMock()
+    assert devicelab.reset(device)
+    device.api.configure_replace.assert_called_once()
+    device.api.execute_copy_to_startup_config.assert_called_once()
+    devicelab.reload.assert_not_called()
+    assert device.reset_strategy == "replace"
+    assert device.reset_time is not None
+
+
+def test_devicelab_reset_replace_falls_back(devicelab, device):
+    device.custom = {}
+    devicelab.get_running_default_cfg_diff = MagicMock(return_value={"added": []})
+    devicelab.is_running_cfg_default = MagicMock(return_value=False)
+    devicelab.reload = MagicMock()
+    assert devicelab.reset(device)
+    devicelab.reload.assert_called_once_with(device)
+    assert device.reset_strategy == "reload"
+    device.api.configure_replace.side_effect = Exception("test")
+    devicelab.is_running_cfg_default.return_value = True
+    assert devicelab.reset(device)
+    assert device.reset_strategy == "reload"
+
+
+def test_devicelab_reset_strategy_per_device(devicelab, device):
+    device.custom = {"reset_strategy": "reload"}
+    devicelab.get_running_default_cfg_diff = MagicMock(return_value={"added": []})
+    devicelab.reload = MagicMock()
+    assert devicelab.reset(device)
+    device.api.configure_replace.assert_not_called()
+    assert device.reset_strategy == "reload"
+
+
+def test_devicelab_reset_not_needed(devicelab, device):
+    devicelab.get_running_default_cfg_diff = MagicMock(return_value={})
+    assert not devicelab.reset(device)
+    assert device.reset_strategy is None
+
+
+def test_devicelab_running_default_cfg_diff_no_default(devicelab, device):
+    # Left over from an earlier job on a pooled device
+    device.running_default_diff = {"added": ["hostname old"], "removed": []}
+    devicelab.get_default_cfg_exists = MagicMock(return_value=False)
+    assert devicelab.get_running_default_cfg_diff(device) == {}
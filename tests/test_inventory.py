@@ -0,0 +1,45 @@
+import json
+import os
+import pytest
+from lab_api.inventory import load_inventory
+
+
+TESTBED = "mock_data/testbed.yaml"
+APPLIANCES = "mock_data/appliances.yaml"
+
+
+def test_load_inventory_compiles(tmp_path):
+    path = tmp_path / "inventory.json"
+    inventory = load_inventory(str(path), TESTBED, APPLIANCES)
+    assert {"name": "csr1000v-1", "host": "10.0.0.1"} in inventory["network_devices"]
+    assert {"name": "dnac", "host": "10.1.1.1"} in inventory["appliances"]
+    assert json.loads(path.read_text()) == inventory
+
+
+def test_load_inventory_reads_compiled(mocker, tmp_path):
+    path = tmp_path / "inventory.json"
+    inventory = load_inventory(str(path), TESTBED, APPLIANCES)
+    compile_inventory = mocker.patch("lab_api.inventory.compile_inventory")
+    assert load_inventory(str(path), TESTBED, APPLIANCES) == inventory
+    compile_inventory.assert_not_called()
+
+
+def test_load_inventory_recompiles_changed(mocker, tmp_path):
+    path = tmp_path / "inventory.json"
+    appliances = tmp_path / "appliances.yaml"
+    appliances.write_text(open(APPLIANCES).read())
+    load_inventory(str(path), TESTBED, str(appliances))
+    os.utime(appliances, (0, 0))
+    compile_inventory = mocker.patch(
+        "lab_api.inventory.compile_inventory", return_value={"sources": {}}
+    )
+    load_inventory(str(path), TESTBED, str(appliances))
+    compile_inventory.assert_called_once_with(TESTBED, str(appliances))
+
+
+def test_load_inventory_no_compile(mocker, tmp_path):
+    path = tmp_path / "inventory.json"
+    compile_inventory = mocker.patch("lab_api.inventory.compile_inventory")
+    with pytest.raises(RuntimeError):
+        load_inventory(str(path), TESTBED, APPLIANCES, compile=False)
+    compile_inventory.assert_not_called()
@@ -0,0 +1,148 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import sleep
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+from lab_api.ise import ISE, TTLCache
+
+
+@pytest.fixture
+def clock(mocker):
+    return mocker.patch("lab_api.ise.monotonic", return_value=1000)
+
+
+def test_ttl_cache_serves_until_expired(clock):
+    cache = TTLCache(refresh_ahead=0)
+    fetch = MagicMock(side_effect=["one", "two"])
+    assert cache.get("key", fetch, 30) == "one"
+    clock.return_value = 1029
+    assert cache.get("key", fetch, 30) == "one"
+    clock.return_value = 1030
+    assert cache.get("key", fetch, 30) == "two"
+    assert fetch.call_count == 2
+
+
+def test_ttl_cache_refresh_ahead(clock):
+    cache = TTLCache(refresh_ahead=0.2)
+    refreshed = Event()
+
+    def fetch():
+        if fetch.calls:
+            refreshed.set()
+        fetch.calls += 1
+        return fetch.calls
+
+    fetch.calls = 0
+    assert cache.get("key", fetch, 30) == 1
+    clock.return_value = 1025
+    # Served from the cache while refreshed in the background
+    assert cache.get("key", fetch, 30) == 1
+    assert refreshed.wait(1)
+    sleep(0.05)
+    assert cache.get("key", fetch, 30) == 2
+    assert fetch.calls == 2
+
+
+def test_ttl_cache_one_fetch_at_a_time():
+    cache = TTLCache()
+
+    def fetch():
+        sleep(0.1)
+        fetch.calls += 1
+        return "value"
+
+    fetch.calls = 0
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: cache.get("key", fetch, 30), range(16)))
+    assert results == ["value"] * 16
+    assert fetch.calls == 1
+
+
+def test_ttl_cache_lru(clock):
+    cache = TTLCache(maxsize=2)
+    cache.get("a", lambda: "a", 30)
+    cache.get("b", lambda: "b", 30)
+    cache.get("a", lambda: "a", 30)
+    cache.get("c", lambda: "c", 30)
+    fetch = MagicMock(return_value="new")
+    assert cache.get("a", fetch, 30) == "a"
+    fetch.assert_not_called()
+    assert cache.get("b", fetch, 30) == "new"
+
+
+def test_ttl_cache_errors_not_cached():
+    cache = TTLCache()
+    fetch = MagicMock(side_effect=[ValueError("down"), "value"])
+    with pytest.raises(ValueError):
+        cache.get("key", fetch, 30)
+    assert cache.get("key", fetch, 30) == "value"
+
+
+def test_ttl_cache_aget(clock):
+    cache = TTLCache(refresh_ahead=0.2)
+    fetch = AsyncMock(side_effect=["one", "two"])
+    refreshed = Event()
+
+    def refresh():
+        refreshed.set()
+        return "refreshed"
+
+    assert asyncio.run(cache.aget("key", fetch, 30)) == "one"
+    clock.return_value = 1025
+    # No refresh given, the result is served until it expires
+    assert asyncio.run(cache.aget("key", fetch, 30)) == "one"
+    clock.return_value = 1030
+    assert asyncio.run(cache.aget("key", fetch, 30)) == "two"
+    assert fetch.await_count == 2
+    clock.return_value = 1055
+    assert asyncio.run(cache.aget("key", fetch, 30, refresh=refresh)) == "two"
+    assert refreshed.wait(1)
+    sleep(0.05)
+    assert asyncio.run(cache.aget("key", fetch, 30)) == "refreshed"
+    assert fetch.await_count == 2
+
+
+@pytest.fixture
+def ise():
+    ise = ISE("192.168.1.2", "admin", "admin", "3.1.0")
+    ise._api = MagicMock()
+    return ise
+
+
+def test_ise_get_status_cached(ise):
+    r = ise._api.backup_and_restore.get_last_status.return_value
+    r.status_code = 200
+    r.response = {
+        "response": {"startDate": "d", "name": "n", "action": "a", "status": "s"}
+    }
+    for _ in range(10):
+        assert ise.get_status()["status"] == "a s"
+    ise._api.backup_and_restore.get_last_status.assert_called_once()
+
+
+def test_ise_check_backup_file_cached(ise):
+    old, new = MagicMock(), MagicMock()
+    old.response.response = ["old.tar.gpg"]
+    new.response.response = ["old.tar.gpg", "new.tar.gpg"]
+    get_files = ise._api.repository.get_files
+    get_files.side_effect = [old, new]
+    assert ise._check_backup_file("old.tar.gpg", "repo")
+    assert ise._check_backup_file("old.tar.gpg", "repo")
+    get_files.assert_called_once_with("repo")
+    # A file missing from the cached listing is looked up again
+    assert ise._check_backup_file("new.tar.gpg", "repo")
+    assert get_files.call_count == 2
+
+
+def test_ise_get_status_async_cached(ise):
+    r = ise._api.backup_and_restore.get_last_status.return_value
+    r.status_code = 200
+    r.response = {
+        "response": {"startDate": "d", "name": "n", "action": "a", "status": "s"}
+    }
+    assert ise.get_status()["status"] == "a s"
+    session = MagicMock()
+    # Served the last status cached by get_status, without a request
+    assert asyncio.run(ise.get_status_async(session))["status"] == "a s"
+    session.get.assert_not_called()
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import pickle
+import pytest
+from time import monotonic
+from unittest.mock import AsyncMock, MagicMock
+from rq.exceptions import NoSuchJobError
+from lab_api.jobs import (
+    JOB_CHANNEL_PREFIX,
+    JOB_PERCENT_KEY,
+    JOB_PROGRESS_KEY,
+    JobProgress,
+    JobWaiters,
+    async_wait_for_job,
+    enqueue_once,
+    format_sse,
+    job_channel,
+    job_events,
+    job_progress_channel,
+    publish_job_done,
+)
+from lab_api.worker import NotifyingWorker
+
+
+# Jobs Setup
+
+
+@pytest.fixture()
+def connection():
+    # Mock Redis connection
+    obj = MagicMock()
+    obj.pubsub.return_value.get_message.return_value = None
+    yield obj
+
+
+@pytest.fixture()
+def job():
+    # Mock RQ job
+    obj = MagicMock()
+    obj.id = "test_job"
+    yield obj
+
+
+# Test jobs
+
+
+def test_publish_job_done(connection, job):
+    job.get_status.return_value = "finished"
+    publish_job_done(connection, job)
+    connection.publish.assert_called_once_with(job_channel("test_job"), "finished")
+
+
+def async_connection(messages: list):
+    # Mock asyncio Redis connection, its pubsub yields messages then stops
+    connection = MagicMock()
+    pubsub = connection.pubsub.return_value
+    pubsub.psubscribe = AsyncMock()
+    pubsub.close = AsyncMock()
+
+    async def listen():
+        for message in messages:
+            await asyncio.sleep(0.05)
+            yield message
+        await asyncio.sleep(10)
+
+    pubsub.listen = listen
+    return connection
+
+
+def test_async_wait_for_job_wakes_on_message():
+    message = {"type": "pmessage", "channel": job_channel("test_job").encode()}
+    connection = async_connection([message])
+    connection.hget = AsyncMock(side_effect=[b"started", b"finished"])
+    waiters = JobWaiters(connection)
+
+    async def wait():
+        started = monotonic()
+        status = await async_wait_for_job("test_job", waiters, poll=30)
+        return status, monotonic() - started
+
+    status, waited = asyncio.run(wait())
+    assert status == "finished"
+    assert waited < 1
+    connection.pubsub.return_value.psubscribe.assert_awaited_once_with(
+        f"{JOB_CHANNEL_PREFIX}*"
+    )
+
+
+def test_async_wait_for_job_shares_subscription():
+    connection = async_connection([])
+    connection.hget = AsyncMock(return_value=b"started")
+    waiters = JobWaiters(connection)
+
+    async def wait():
+        jobs = [f"job{i}" for i in range(10)]
+        await asyncio.gather(
+            *[async_wait_for_job(job, waiters, timeout=0.1, poll=0.05) for job in jobs]
+        )
+
+    asyncio.run(wait())
+    connection.pubsub.assert_called_once()
+    assert waiters._events == {}
+
+
+def test_async_wait_for_job_polls_without_subscription():
+    connection = MagicMock()
+    connection.pubsub.return_value.psubscribe = AsyncMock(side_effect=OSError)
+    connection.pubsub.return_value.close = AsyncMock()
+    connection.hget = AsyncMock(side_effect=[b"started", b"finished"])
+    waiters = JobWaiters(connection)
+    status = asyncio.run(async_wait_for_job("test_job", waiters, poll=0.05))
+    assert status == "finished"
+
+
+def test_job_events():
+    connection = MagicMock()
+    meta = pickle.dumps({JOB_PROGRESS_KEY: ["line 1"]})
+    connection.hmget = AsyncMock(return_value=[b"started", meta])
+    connection.hget = AsyncMock(return_value=b"finished")
+    pubsub = connection.pubsub.return_value
+    pubsub.subscribe = AsyncMock()
+    pubsub.get_message = AsyncMock(
+        side_effect=[
+            {
+                "channel": job_progress_channel("test_job").encode("utf-8"),
+                "data": json.dumps({"lines": ["line 2"], "percent": None}),
+            },
+            {"channel": job_channel("test_job").encode("utf-8"), "data": b"done"},
+        ]
+    )
+    pubsub.close = AsyncMock()
+
+    async def collect():
+        return [event async for event in job_events("test_job", connection)]
+
+    r = asyncio.run(collect())
+    assert r == [
+        ("status", "started"),
+        ("progress", {"lines": ["line 1"], "percent": None}),
+        ("progress", {"lines": ["line 2"], "percent": None}),
+        ("status", "finished"),
+    ]
+    pubsub.close.assert_awaited_once()
+
+
+def test_format_sse():
+    r = format_sse("status", "started")
+    assert r == 'event: status\ndata: "started"\n\n'
+
+
+@pytest.fixture()
+def queue(connection):
+    # Mock RQ queue
+    obj = MagicMock()
+    obj.connection = connection
+    yield obj
+
+
+def test_enqueue_once_attaches_to_running_job(mocker, queue, job):
+    mocker.patch("lab_api.jobs.Job.fetch", return_value=job)
+    job.get_status.return_value = "started"
+    r = enqueue_once(queue, print, "test_job")
+    queue.connection.lock.return_value.__enter__.assert_called_once()
+    queue.enqueue.assert_not_called()
+    assert r == job
+
+
+def test_enqueue_once_reruns_finished_job(mocker, queue, job):
+    mocker.patch("lab_api.jobs.Job.fetch", return_value=job)
+    job.get_status.return_value = "finished"
+    enqueue_once(queue, print, "test_job", reuse_finished=False, args=(1,))
+    queue.enqueue.assert_called_once_with(print, job_id="test_job", args=(1,))
+
+
+def test_enqueue_once_new_job(mocker, queue):
+    mocker.patch("lab_api.jobs.Job.fetch", side_effect=NoSuchJobError)
+    enqueue_once(queue, print, "test_job")
+    queue.enqueue.assert_called_once_with(print, job_id="test_job")
+
+
+def test_job_progress_saves_meta(mocker, job):
+    job.meta = {}
+    mocker.patch("lab_api.jobs.get_current_job", return_value=job)
+    progress = JobProgress(lines=2, save_every=60)
+    progress(["one", "", "two\r", "three"])
+    assert job.meta[JOB_PROGRESS_KEY] == ["two", "three"]
+    job.save_meta.assert_called_once()
+    # Saves are throttled
+    progress(["four"])
+    job.save_meta.assert_called_once()
+
+
+def test_job_progress_publishes_percent(mocker, job):
+    job.meta = {}
+    mocker.patch("lab_api.jobs.get_current_job", return_value=job)
+    progress = JobProgress()
+    progress(["Restore 42% done", "Copied 100 files"])
+    assert job.meta[JOB_PERCENT_KEY] == 42
+    channel, event = job.connection.publish.call_args.args
+    assert channel == job_progress_channel("test_job")
+    assert json.loads(event) == {
+        "lines": ["Restore 42% done", "Copied 100 files"],
+        "percent": 42,
+    }
+
+
+def test_job_progress_outside_job(mocker):
+    mocker.patch("lab_api.jobs.get_current_job", return_value=None)
+    progress = JobProgress()
+    progress(["one"])
+    assert list(progress.lines) == ["one"]
+
+
+def test_notifying_worker_publishes(mocker, job):
+    mocker.patch("rq.Worker.handle_job_success")
+    mocker.patch("lab_api.worker.store_job_status")
+    record = mocker.patch("lab_api.worker.record_orchestration_node")
+    publish = mocker.patch("lab_api.worker.publish_job_done")
+    worker = NotifyingWorker.__new__(NotifyingWorker)
+    worker.connection = MagicMock()
+    worker.handle_job_success(job, MagicMock(), MagicMock())
+    record.assert_called_once_with(worker.connection, job)
+    publish.assert_called_once_with(worker.connection, job)
+
+
+def test_notifying_worker_invalidates_reset_status(mocker, job):
+    mocker.patch("rq.Worker.handle_job_failure")
+    mocker.patch("lab_api.worker.release_job_status")
+    mocker.patch("lab_api.worker.record_orchestration_node")
+    mocker.patch("lab_api.worker.publish_job_done")
+    invalidate = mocker.patch("lab_api.worker.invalidate_reset_status")
+    job.func_name = "lab_api.task_reset_network_device"
+    job.args = ("csr1000v-1",)
+    worker = NotifyingWorker.__new__(NotifyingWorker)
+    worker.connection = MagicMock()
+    worker.handle_job_failure(job, MagicMock())
+    invalidate.assert_called_once_with(
+        worker.connection, "task_reset_network_device", ("csr1000v-1",)
+    )
+
+
+@pytest.mark.parametrize("is_horse", [True, False])
+def test_notifying_worker_closes_pools_in_work_horse(mocker, job, is_horse):
+    mocker.patch("rq.Worker.perform_job", return_value=True)
+    close_pools = mocker.patch("lab_api.worker.close_pools")
+    worker = NotifyingWorker.__new__(NotifyingWorker)
+    worker._is_horse = is_horse
+    assert worker.perform_job(job, MagicMock())
+    assert close_pools.called == is_horse
@@ -0,0 +1,176 @@
+import json
+import pytest
+from datetime import datetime
+from unittest.mock import MagicMock
+from lab_api.orchestrator import (
+    PlanNode,
+    orchestration_job_key,
+    orchestration_key,
+    orchestration_status,
+    plan_order,
+    record_orchestration_node,
+    start_orchestration,
+)
+
+
+# Orchestrator Setup
+
+
+def task():
+    pass
+
+
+@pytest.fixture()
+def plan():
+    yield {
+        "a": PlanNode(task, "job_a", expected=100),
+        "b": PlanNode(task, "job_b", depends_on=("a",), expected=50),
+        "c": PlanNode(task, "job_c", expected=120),
+    }
+
+
+def mock_job(id, status, depends_on=None):
+    # Mock RQ job
+    obj = MagicMock()
+    obj.id = id
+    obj.meta = {}
+    obj._dependency_ids = [job.id for job in depends_on or ()]
+    obj.get_status.return_value = status
+    obj.started_at = obj.ended_at = None
+    return obj
+
+
+# Test orchestrator
+
+
+def test_plan_order():
+    r = plan_order({"b": ("a",), "a": (), "c": ("b", "a")})
+    assert r == ["a", "b", "c"]
+    with pytest.raises(ValueError):
+        plan_order({"a": ("b",), "b": ("a",)})
+    with pytest.raises(ValueError):
+        plan_order({"a": ("missing",)})
+
+
+def test_start_orchestration(mocker, plan):
+    jobs = {}
+
+    def enqueue_once(queue, func, job_id, **kwargs):
+        jobs[job_id] = mock_job(job_id, "queued", kwargs["depends_on"])
+        jobs[job_id].depends_on = kwargs["depends_on"]
+        return jobs[job_id]
+
+    mocker.patch("lab_api.orchestrator.enqueue_once", side_effect=enqueue_once)
+    queue = MagicMock()
+    id, r = start_orchestration(queue, plan)
+    assert list(r) == ["a", "b", "c"]
+    assert jobs["job_b"].depends_on == [jobs["job_a"]]
+    assert jobs["job_a"].depends_on is None
+    pipe = queue.connection.pipeline.return_value.__enter__.return_value
+    pipe.hset.assert_any_call(orchestration_job_key("job_c"), id, "c")
+    key, field, record = pipe.hset.call_args.args
+    assert (key, field) == (orchestration_key(id), "plan")
+    assert json.loads(record)["nodes"]["b"]["depends_on"] == ["a"]
+    jobs["job_c"].save_meta.assert_not_called()
+
+
+def test_start_orchestration_attaches(mocker, plan):
+    # b is in flight from an earlier run that didn't wait on a
+    running = {
+        "job_a": mock_job("job_a", "queued"),
+        "job_b": mock_job("job_b", "started"),
+    }
+    mocker.patch(
+        "lab_api.orchestrator.enqueue_once",
+        side_effect=lambda queue, func, job_id, **kwargs: running[job_id],
+    )
+    queue = MagicMock()
+    id, r = start_orchestration(queue, {"a": plan["a"], "b": plan["b"]})
+    pipe = queue.connection.pipeline.return_value.__enter__.return_value
+    pipe.hset.assert_any_call(orchestration_job_key("job_b"), id, "b")
+    record = json.loads(pipe.hset.call_args.args[2])
+    assert record["nodes"]["b"]["depends_on"] == []
+    assert record["nodes"]["b"]["ignored_depends_on"] == ["a"]
+    running["job_b"].save_meta.assert_not_called()
+
+
+def test_record_orchestration_node():
+    job = mock_job("job_a", "finished")
+    job.started_at = datetime(2022, 1, 1, 0, 0, 0)
+    job.ended_at = datetime(2022, 1, 1, 0, 1, 30)
+    connection = MagicMock()
+    pipe = connection.pipeline.return_value.__enter__.return_value
+    pipe.execute.side_effect = [[{b"orch": b"a"}, 1], []]
+    record_orchestration_node(connection, job)
+    pipe.hgetall.assert_called_once_with(orchestration_job_key("job_a"))
+    pipe.delete.assert_called_once_with(orchestration_job_key("job_a"))
+    key, field, state = pipe.hset.call_args.args
+    assert (key, field) == (orchestration_key("orch"), "node:a")
+    assert json.loads(state)["status"] == "finished"
+    pipe.lpush.assert_called_once_with("civlab:orch:times:a", 90)
+
+
+def test_record_orchestration_node_not_a_node():
+    connection = MagicMock()
+    pipe = connection.pipeline.return_value.__enter__.return_value
+    pipe.execute.return_value = [{}, 0]
+    record_orchestration_node(connection, mock_job("job_a", "finished"))
+    pipe.hset.assert_not_called()
+
+
+def test_orchestration_status(mocker, plan):
+    record = {
+        "created": 1000,
+        "nodes": {
+            "a": {"job_id": "job_a", "depends_on": [], "expected": 100},
+            "b": {"job_id": "job_b", "depends_on": ["a"], "expected": 50},
+            "c": {"job_id": "job_c", "depends_on": [], "expected": 120},
+        },
+    }
+    connection = MagicMock()
+    connection.hgetall.return_value = {
+        b"plan": json.dumps(record),
+        b"node:c": json.dumps(
+            {"status": "finished", "started_at": 1000, "ended_at": 1100}
+        ),
+    }
+    connection.lrange.return_value = []
+    job_a = mock_job("job_a", "started")
+    job_a.started_at = datetime.utcfromtimestamp(1000)
+    job_b = mock_job("job_b", "deferred")
+    jobs = [job_a, job_b, None]
+    mocker.patch("lab_api.orchestrator.Job.fetch_many", return_value=jobs)
+    mocker.patch("lab_api.orchestrator.time", return_value=1040)
+    r = orchestration_status(connection, "orch")
+    assert r["status"] == "started"
+    assert r["elapsed"] == 40
+    assert r["nodes"]["a"]["elapsed"] == 40
+    assert r["nodes"]["a"]["eta"] == 60
+    assert r["nodes"]["b"]["eta"] == 50
+    assert r["nodes"]["c"]["status"] == "finished"
+    assert r["eta"] == 110
+    assert r["critical_path"] == ["a", "b"]
+
+
+def test_orchestration_status_blocked(mocker):
+    record = {
+        "created": 1000,
+        "nodes": {
+            "a": {"job_id": "job_a", "depends_on": [], "expected": 100},
+            "b": {"job_id": "job_b", "depends_on": ["a"], "expected": 50},
+        },
+    }
+    connection = MagicMock()
+    connection.hgetall.return_value = {b"plan": json.dumps(record)}
+    jobs = [mock_job("job_a", "failed"), mock_job("job_b", "deferred")]
+    mocker.patch("lab_api.orchestrator.Job.fetch_many", return_value=jobs)
+    r = orchestration_status(connection, "orch")
+    assert r["nodes"]["b"]["status"] == "blocked"
+    assert r["status"] == "failed"
+    assert r["eta"] == 0
+
+
+def test_orchestration_status_missing():
+    connection = MagicMock()
+    connection.hgetall.return_value = {}
+    assert orchestration_status(connection, "orch") is None
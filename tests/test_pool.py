@@ -0,0 +1,101 @@
+import pytest
+from unittest.mock import MagicMock
+from lab_api.pool import DevicePool
+
+
+# DevicePool Setup
+
+
+@pytest.fixture()
+def device():
+    # Mock device
+    obj = MagicMock()
+    obj.name = "test"
+    obj.is_connected.return_value = False
+    yield obj
+
+
+@pytest.fixture()
+def pool(device):
+    # Mock testbed with a single device
+    testbed = MagicMock()
+    testbed.devices = {device.name: device}
+    testbed.__iter__.return_value = [device]
+    obj = DevicePool(testbed, idle_timeout=300, check_after=30)
+    yield obj
+
+
+# DevicePool tests
+
+
+def test_pool_checkout_connects(pool, device):
+    pool.checkout(device)
+    device.connect.assert_called_once()
+
+
+def test_pool_checkout_clears_job_results(pool, device):
+    device.status = "configured"
+    device.reset_strategy = "reload"
+    device.error = "test"
+    pool.checkout(device)
+    assert device.status is None
+    assert device.reset_strategy is None
+    assert device.error is None
+
+
+def test_pool_reuses_connection(pool, device):
+    with pool.connection(device):
+        device.is_connected.return_value = True
+    with pool.connection(device):
+        pass
+    device.connect.assert_called_once()
+    device.execute.assert_not_called()
+
+
+def test_pool_reconnects_unhealthy(pool, device):
+    pool.checkout(device)
+    pool.release(device)
+    pool._last_used[device.name] -= 60
+    device.is_connected.return_value = True
+    device.execute.side_effect = Exception("test")
+    pool.checkout(device)
+    device.disconnect.assert_called_once()
+    assert device.connect.call_count == 2
+
+
+def test_pool_discards_on_error(pool, device):
+    with pytest.raises(ValueError):
+        with pool.connection(device):
+            device.is_connected.return_value = True
+            raise ValueError
+    device.disconnect.assert_called_once()
+
+
+def test_pool_connections_keeps_connect_error(pool, device):
+    device.connect.side_effect = Exception("test")
+    with pool.connections([device]):
+        pass
+    assert device.error == "test"
+
+
+def test_pool_connections_max_workers(mocker, pool, device):
+    executor = mocker.patch("lab_api.pool.ThreadPoolExecutor")
+    devices = MagicMock()
+    devices.__iter__.return_value = [device] * 8
+    devices.max_workers = 3
+    with pool.connections(devices):
+        pass
+    executor.assert_called_with(max_workers=3)
+    with pool.connections(devices, max_workers=16):
+        pass
+    executor.assert_called_with(max_workers=8)
+
+
+def test_pool_evict_idle(pool, device):
+    with pool.connection(device):
+        device.is_connected.return_value = True
+    pool.evict_idle()
+    device.disconnect.assert_not_called()
+    pool._last_used[device.name] -= 600
+    pool.evict_idle()
+    device.disconnect.assert_called_once()
@@ -2,7 +2,8 @@ import os
 import pytest
 from unittest.mock import MagicMock
 from genie.testbed import load
-from lab_api.services import ISE, Appliance, DNAC, DeviceLab
+from lab_api.services import ISE, Appliance, ApplianceSessionPool, DNAC, DeviceLab
+from lab_api.services import RestoreLogTracker, vManage
 
 
 # DeviceLab Setup
@@ -165,6 +166,7 @@ def test_appliance__send_command(mocker, appliance):
     cmd_nl = f"{cmd}\n"
     mocker.patch.object(appliance, "_shell")
     mocker.patch.object(appliance, "_read_shell")
+    appliance._shell.recv_ready.return_value = False
     appliance._shell.send.return_value = len(cmd_nl.encode("utf-8"))
     appliance._read_shell.return_value = cmd
     r = appliance._send_command(cmd)
@@ -174,7 +176,7 @@ def test_appliance__send_command(mocker, appliance):
 
 
 def test_appliance__read_shell_recv_ready(mocker, appliance):
-    data = "test"
+    data = "test\nhost# "
     mocker.patch.object(appliance, "_shell")
     appliance._shell.recv_ready.return_value = True
     appliance._shell.recv.return_value = data.encode("utf-8")
@@ -183,6 +185,119 @@ def test_appliance__read_shell_recv_ready(mocker, appliance):
     assert r == data
 
 
+def test_appliance__read_shell_until_prompt(mocker, appliance):
+    chunks = [b"show ver", b"sion\nVersion 1\n", b"host# ", b"unread"]
+    mocker.patch.object(appliance, "_shell")
+    appliance._shell.recv_ready.return_value = True
+    appliance._shell.recv.side_effect = chunks
+    r = appliance._read_shell(wait=1)
+    assert r == "show version\nVersion 1\nhost# "
+
+
+def test_appliance__read_shell_byte_cap(mocker, appliance):
+    mocker.patch.object(appliance, "_shell")
+    appliance._shell.recv_ready.return_value = True
+    appliance._shell.recv.side_effect = lambda n: b"x" * n
+    r = appliance._read_shell(bytes=10000, wait=1)
+    assert len(r) == 10000
+
+
+def test_appliance__read_shell_timeout(mocker, appliance):
+    mocker.patch.object(appliance, "_shell")
+    mocker.patch("lab_api.services.select")
+    appliance._shell.recv_ready.return_value = False
+    appliance._shell.closed = False
+    r = appliance._read_shell(wait=0.01)
+    assert r == "Shell read timeout. No data received on shell/channel."
+
+
+def test_appliance__wait_on_restore_split_marker(mocker, appliance):
+    chunks = [b"Restoring...\nRestore comp", b"lete\n", b"unread"]
+    progress = MagicMock()
+    mocker.patch.object(appliance, "_shell")
+    appliance._shell.closed = False
+    appliance._shell.recv_ready.return_value = True
+    appliance._shell.recv.side_effect = chunks
+    r = appliance._wait_on_restore(
+        "Restore complete", "fail", wait=1, progress=progress
+    )
+    assert r == (True, "Restore successful.")
+    assert appliance._shell.recv.call_count == 2
+    progress.assert_any_call(["Restoring..."])
+    progress.assert_any_call(["Restore complete"])
+
+
+def test_appliance__wait_on_restore_fail(mocker, appliance):
+    mocker.patch.object(appliance, "_shell")
+    appliance._shell.closed = False
+    appliance._shell.recv_ready.return_value = True
+    appliance._shell.recv.side_effect = [b"Restore fail", b"ed\n"]
+    r = appliance._wait_on_restore("Restore complete", "Restore failed", wait=1)
+    assert r == (False, "Restore failed.")
+
+
+def test_appliance__wait_on_restore_timeout(mocker, appliance):
+    mocker.patch.object(appliance, "_shell")
+    mocker.patch("lab_api.services.select")
+    appliance._shell.closed = False
+    appliance._shell.recv_ready.return_value = False
+    r = appliance._wait_on_restore("Restore complete", "fail", wait=0.01)
+    assert r == (False, "Timeout. Restore may or may not be successful.")
+
+
+def test_appliance__check_connection(mocker, appliance):
+    assert not appliance._check_connection()
+    mocker.patch.object(appliance, "_shell")
+    mocker.patch.object(appliance, "_ssh")
+    appliance._shell.closed = False
+    appliance._ssh.get_transport.return_value.is_active.return_value = True
+    assert appliance._check_connection()
+    appliance._ssh.get_transport.return_value.is_active.return_value = False
+    assert not appliance._check_connection()
+
+
+# Test ApplianceSessionPool
+
+
+def test_appliance_session_pool_reuses_session(mocker, appliance):
+    mocker.patch.object(appliance, "connect")
+    mocker.patch.object(appliance, "_check_connection")
+    factory = MagicMock(return_value=appliance)
+    pool = ApplianceSessionPool(factory)
+    with pool.session("dnac") as a:
+        assert a is appliance
+        appliance.connected = True
+        appliance._check_connection.return_value = True
+    with pool.session("dnac"):
+        pass
+    factory.assert_called_once_with("dnac")
+    appliance.connect.assert_called_once()
+
+
+def test_appliance_session_pool_drops_on_error(mocker, appliance):
+    mocker.patch.object(appliance, "connect")
+    mocker.patch.object(appliance, "disconnect")
+    pool = ApplianceSessionPool(MagicMock(return_value=appliance))
+    with pytest.raises(ValueError):
+        with pool.session("dnac"):
+            raise ValueError
+    appliance.disconnect.assert_called_once()
+
+
+def test_appliance_session_pool_reconnects_after_reset(mocker, appliance):
+    mocker.patch("lab_api.services.load_appliance_generation", side_effect=[0, 0, 1])
+    mocker.patch.object(appliance, "connect")
+    mocker.patch.object(appliance, "disconnect")
+    mocker.patch.object(appliance, "_check_connection", return_value=True)
+    factory = MagicMock(return_value=appliance)
+    pool = ApplianceSessionPool(factory, connection=MagicMock())
+    for _ in range(3):
+        with pool.session("dnac"):
+            appliance.connected = True
+    assert factory.call_count == 2
+    appliance.disconnect.assert_called_once()
+
+
 # Test DNAC
 
 
@@ -255,3 +370,132 @@ def test_ise_get_status(mocker, ise):
     assert r == dummy_resp
     ise._send_command.assert_called_once_with(ise._status_cmd)
     ise._parse_show_restore_history.assert_called_once_with(dummy_resp)
+
+
+# Test vManage
+
+
+@pytest.fixture()
+def vmanage(mocker):
+    mocker.patch("paramiko.SSHClient")
+    vmanage = vManage("10.1.1.1", "test", "test", 22)
+    yield vmanage
+
+
+@pytest.fixture()
+def restore_log():
+    with open("mock_data/vmanage_restore_log", "rb") as stream:
+        yield stream.read()
+
+
+class FakeLog:
+    """Restore log read from offsets, growing as the test appends to it"""
+
+    def __init__(self):
+        self.data = b""
+        self.reads = []
+
+    def read(self, offset):
+        self.reads.append(offset)
+        return self.data[offset:], len(self.data)
+
+
+def test_restore_log_tracker_split_lines(restore_log):
+    tracker = RestoreLogTracker()
+    lines = []
+    for i in range(0, len(restore_log), 7):
+        lines += tracker.feed(restore_log[i : i + 7])
+    assert "Sucessfully restore neo4j and system database" in lines
+    assert tracker.done and tracker.success
+    assert str(tracker.started) == "2022-04-15 17:55:37"
+    assert str(tracker.last_logged) == "2022-04-15 17:59:21"
+
+
+def test_restore_log_tracker_poll(restore_log):
+    log = FakeLog()
+    tracker = RestoreLogTracker(log.read)
+    done_at = restore_log.index(b"Sucessfully")
+    log.data = restore_log[:done_at]
+    tracker.poll()
+    assert tracker.phase == "restoring"
+    assert not tracker.done
+    log.data = restore_log
+    assert tracker.poll()[0].startswith("Sucessfully")
+    assert tracker.success
+    # Each poll starts where the last one ended
+    assert log.reads == [0, done_at]
+
+
+def test_restore_log_tracker_truncated(restore_log):
+    log = FakeLog()
+    log.data = restore_log
+    tracker = RestoreLogTracker(log.read, offset=len(restore_log))
+    assert tracker.poll() == []
+    log.data = b"restore configuration-db from /backup/staging\n"
+    tracker.poll()
+    log.data += b"Failed to restore\n"
+    tracker.poll()
+    assert tracker.done and not tracker.success
+
+
+def test_vmanage__read_file_from(mocker, vmanage):
+    resp = (
+        "vmanage:~$ s=$(stat ...\r\n@@start\r\nline $ one\r\nline t"
+        "\r\n@@end 120 17\r\nvmanage:~$ "
+    )
+    mocker.patch.object(vmanage, "_send_command", return_value=resp)
+    assert vmanage._read_file_from(100) == (b"line $ one\nline t", 117)
+    cmd = vmanage._send_command.call_args[0][0]
+    assert "tail -c +101 /var/log/nms/neo4j-restore.log" in cmd
+    assert vmanage._read_file_end.search(resp)
+
+
+def test_vmanage__read_file_from_shrunk(mocker, vmanage):
+    resp = "@@start\r\n\r\n@@end 50 -50\r\nvmanage:~$ "
+    mocker.patch.object(vmanage, "_send_command", return_value=resp)
+    assert vmanage._read_file_from(100) == (b"", 50)
+
+
+def test_vmanage__wait_on_restore_log(mocker, vmanage, restore_log):
+    mocker.patch("lab_api.services.sleep")
+    mocker.patch.object(vmanage, "_drain_shell")
+    log = FakeLog()
+    chunks = [restore_log[:200], restore_log[:400], restore_log]
+
+    def read(offset):
+        log.data = chunks.pop(0)
+        return log.read(offset)
+
+    progress = MagicMock()
+    tracker = RestoreLogTracker(read)
+    r = vmanage._wait_on_restore_log(tracker, progress, wait=60, interval=5)
+    assert r == (True, "Restore successful.")
+    assert chunks == []
+    assert progress.call_count == 3
+
+
+def test_vmanage__parse_restore_log(vmanage, restore_log):
+    r = vmanage._parse_restore_log(restore_log.decode("utf-8"))
+    assert r["last_restore"] == "2022-04-15 17:59:21"
+    assert r["host"] == "10.1.1.1"
+    assert vmanage._parse_restore_log("restore configuration-db from x") is None
+
+
+def test_vmanage_reset(mocker, vmanage):
+    mocker.patch.object(vManage, "connect")
+    mocker.patch.object(vManage, "disconnect")
+    mocker.patch.object(vManage, "_file_size", return_value=634)
+    send = mocker.patch.object(vManage, "_send_command")
+    wait = mocker.patch.object(
+        vManage, "_wait_on_restore_log", return_value=(True, "Restore successful.")
+    )
+    assert vmanage.reset("/home/admin/backup.tar.gz") == (True, "Restore successful.")
+    tracker = wait.call_args[0][0]
+    assert tracker.offset == 634
+    sent = [call[0][0] for call in send.call_args_list]
+    assert sent == [
+        "vshell",
+        f"{vmanage._restore_cmd_stem} /home/admin/backup.tar.gz",
+        "exit",
+    ]
+    vManage.disconnect.assert_called_once()